@@ -0,0 +1,94 @@
+"""
+Compare the throughput of the screen backends on recorded sessions.
+
+    python scripts/benchmark_screens.py [--backend pyte --backend fast] [--width 80] [--height 24] [session ...]
+
+A session is a file with the raw bytes a shell sent, such as one saved with `script -q -O session.log`.
+With no sessions, synthetic ones are generated: a long scrolling listing, coloured output, full screen redraws
+like top and text with double width characters. Each backend is fed the same chunks and its final display is
+checked against the first backend's.
+"""
+
+import argparse
+import codecs
+from pathlib import Path
+import random
+import time
+
+from terminalX.screens import create_screen, screen_backends
+
+
+CHUNK_SIZE = 65536
+
+
+def scrolling_session(lines: int = 20000) -> bytes:
+    return ''.join(f'{i:>8} /usr/lib/python3/dist-packages/module_{i % 97}.py\r\n' for i in range(lines)).encode()
+
+
+def coloured_session(lines: int = 5000) -> bytes:
+    rand = random.Random(0)
+    out = []
+    for i in range(lines):
+        colour = 31 + i % 7
+        out.append(f'\x1b[{colour}m{"drwxr-xr-x" if i % 3 else "-rw-r--r--"}\x1b[0m 1 user user '
+                   f'{rand.randint(0, 10 ** 6):>8} \x1b[1;{colour}mfile_{i}\x1b[0m\r\n')
+    return ''.join(out).encode()
+
+
+def top_session(frames: int = 200, height: int = 24) -> bytes:
+    rand = random.Random(0)
+    out = []
+    for frame in range(frames):
+        out.append(f'\x1b[H\x1b[7mtop - {frame:05} up 3 days, load average: {rand.random():.2f}\x1b[0m\x1b[K')
+        for y in range(2, height + 1):
+            out.append(f'\x1b[{y};1H{rand.randint(1, 99999):>6} user  20   0 {rand.random() * 100:5.1f} '
+                       f'{rand.random() * 100:5.1f}  process_{y}\x1b[K')
+    return ''.join(out).encode()
+
+
+def wide_session(lines: int = 5000) -> bytes:
+    return ''.join(f'{i} 漢字とかなのテキスト é ü ñ 表示\r\n' for i in range(lines)).encode()
+
+
+synthetic_sessions = {
+    'scrolling': scrolling_session,
+    'coloured': coloured_session,
+    'top': top_session,
+    'wide': wide_session,
+}
+
+
+def run(backend: str, data: bytes, width: int, height: int, history: int) -> tuple[float, list[str]]:
+    screen, stream = create_screen(backend, width, height, history)
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    start = time.perf_counter()
+    for offset in range(0, len(data), CHUNK_SIZE):
+        stream.feed(decoder.decode(data[offset:offset + CHUNK_SIZE]))
+    stream.feed(decoder.decode(b'', final=True))
+    return time.perf_counter() - start, screen.display
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark terminalX screen backends')
+    parser.add_argument('sessions', nargs='*', type=Path, help='Files of recorded raw shell output')
+    parser.add_argument('--backend', action='append', choices=sorted(screen_backends), dest='backends')
+    parser.add_argument('--width', type=int, default=80)
+    parser.add_argument('--height', type=int, default=24)
+    parser.add_argument('--history', type=int, default=100)
+    args = parser.parse_args()
+    backends = args.backends or list(screen_backends)
+    if args.sessions:
+        sessions = {path.name: path.read_bytes() for path in args.sessions}
+    else:
+        sessions = {name: generate() for name, generate in synthetic_sessions.items()}
+
+    print(f'{"session":<20}{"MB":>8}' + ''.join(f'{backend + " MB/s":>14}' for backend in backends) + '  match')
+    for name, data in sessions.items():
+        results = [run(backend, data, args.width, args.height, args.history) for backend in backends]
+        rates = ''.join(f'{len(data) / seconds / 1e6:>14.2f}' for seconds, _ in results)
+        match = all(display == results[0][1] for _, display in results)
+        print(f'{name:<20}{len(data) / 1e6:>8.2f}{rates}  {"yes" if match else "NO"}')
+
+
+if __name__ == '__main__':
+    main()
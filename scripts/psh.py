@@ -2,11 +2,12 @@ import logging
 import os
 import sys
 from terminalX.connections import Client
-from terminalX.types import CharSeq
 import curses
 from pathlib import Path
+import pyte
 from terminalX.utils import static
 import threading
+import time
 
 
 file_path = Path(os.path.realpath(__file__)).parent
@@ -133,9 +134,23 @@ indexes = {'i': 0}
 scrolls = [0, 2, 3, 4, 6, 0]
 
 
+MAX_FPS = 60
+
+
 class Terminal:
-    def __init__(self, client: Client, stdscr: curses.window, fixed_colors: tuple[str, str] = None):
+    """
+    Data received from the server only marks a frame as pending. Frames are drawn from the input loop, so all curses
+    calls happen in one thread, at most max_fps times a second however fast data arrives.
+    Each frame only redraws the runs of cells which have changed since they were last drawn.
+    """
+    def __init__(self, client: Client, stdscr: curses.window, fixed_colors: tuple[str, str] = None,
+                 max_fps: int = MAX_FPS):
         self.resized = threading.Event()
+        self.frame_pending = threading.Event()
+        self.frame_interval = 1 / max_fps
+        self.last_frame = 0
+        self.drawn: dict[int, list[pyte.screens.Char]] = {}     # Cells as they were last drawn on each line
+        self.cell_styles: dict[pyte.screens.Char, tuple[str, int]] = {}
         self.client = client
         self.stdscr = stdscr
         self.height, self.width = self.stdscr.getmaxyx()
@@ -143,7 +158,7 @@ class Terminal:
         curses.use_default_colors()
         self.color_pair = get_color_pair(*fixed_colors) if fixed_colors else None
         self.stdscr.keypad(True)
-        self.stdscr.timeout(50)
+        self.stdscr.timeout(max(1, round(self.frame_interval * 1000)))
         self.stdscr.scrollok(True)
         self.stdscr.idcok(False)
         self.client.invoke_shell(height=self.height, width=self.width, recv_callback=self.on_recv)
@@ -154,6 +169,7 @@ class Terminal:
         logger.debug('Resizing to Height: %s Width: %s', self.height, self.width)
         self.stdscr.refresh()
         self.client.resize_terminal(height=self.height, width=self.width, logger=logger)
+        self.redraw()
         self.resized.set()
         value = special_keys.get(curses.KEY_SNEXT)
         logger.debug('Sending curses.KEY_SNEXT as %s', value)
@@ -176,73 +192,105 @@ class Terminal:
                         value = special_keys.get(char) or chr(char)
                         logger.debug('Sending %s as %s', char, value)
                         self.client.send(value)
+                self.render_if_due()
+            self.render()       # The last of the output, received as the shell closed
         except BaseException as e:
             logger.exception("Uncaught exception: {0}".format(str(e)))
         finally:
             self.close()
 
-    def addstr(self, lineno, char_seq: CharSeq):
-        logger.debug('Adding %s chars to curses lineno %s column %s: %s', len(char_seq['text']), lineno, char_seq['column'], char_seq['text'])
-        height, width = self.stdscr.getmaxyx()
-        logger.debug('Height: %s Width: %s', height, width)
-        self.stdscr.addstr(lineno, char_seq['column'], char_seq['text'], char_seq['attrs'])
+    def cell_style(self, char: pyte.screens.Char) -> tuple[str, int]:
+        if style := self.cell_styles.get(char):
+            return style
+        text = char.data
+        attrs = self.color_pair if self.color_pair else get_color_pair(char.fg, char.bg)
+        if char.bold:
+            attrs |= curses.A_BOLD
+        if char.italics:
+            attrs |= curses.A_ITALIC
+        if char.underscore:
+            attrs |= curses.A_UNDERLINE
+        if char.strikethrough:
+            text = text + "\u0336"   # Strikethrough not directly supported in curses
+        if char.reverse:
+            attrs |= curses.A_REVERSE
+        if getattr(char, "blink", False):       # Blink added to pyte but not in latest official release yet
+            attrs |= curses.A_BLINK
+        self.cell_styles[char] = text, attrs
+        return text, attrs
+
+    def addstr(self, lineno: int, column: int, cells: list[str], attrs: int):
+        """
+        Write the text of a run of cells. A cell's text can be more than one character, such as with a combining
+        strikethrough, so positions are counted in cells.
+        """
+        if lineno == self.height - 1 and column + len(cells) >= self.width:
+            # Writing the bottom right cell moves the cursor off the screen, insert it instead
+            self.stdscr.addstr(lineno, column, ''.join(cells[:-1]), attrs)
+            self.stdscr.insstr(lineno, column + len(cells) - 1, cells[-1], attrs)
+        else:
+            self.stdscr.addstr(lineno, column, ''.join(cells), attrs)
+
+    def draw_line(self, lineno: int, line: dict[int, pyte.screens.Char]):
+        """
+        Write each run of changed cells sharing the same attributes with a single addstr
+        """
+        previous = self.drawn.get(lineno, [])
+        width = min(self.width, len(line))      # The screen may not have been resized to the window yet
+        cells = [line[column] for column in range(width)]
+        changed = [column >= len(previous) or cell != previous[column] for column, cell in enumerate(cells)]
+        column = 0
+        while column < width:
+            if not changed[column]:
+                column += 1
+                continue
+            start = column
+            text, attrs = self.cell_style(cells[column])
+            run = [text]
+            column += 1
+            while column < width and changed[column]:
+                text, next_attrs = self.cell_style(cells[column])
+                if next_attrs != attrs:
+                    break
+                run.append(text)
+                column += 1
+            self.addstr(lineno, start, run, attrs)
+        self.drawn[lineno] = cells
+
+    def render(self):
+        with self.client.screen_lock:       # The changes and cursor of the same frame
+            changes = self.client.display_screen_line_changes()
+            y, x = self.client.cursors()
+        logger.debug('The following lines have changed: %s', list(changes.keys()))
+        for lineno, line in changes.items():
+            if lineno < self.height:
+                self.draw_line(lineno, line)
+        self.stdscr.move(min(y, self.height - 1), min(x, self.width - 1))
+        self.stdscr.noutrefresh()
+        curses.doupdate()
+
+    def render_if_due(self):
+        now = time.monotonic()
+        if self.frame_pending.is_set() and now - self.last_frame >= self.frame_interval:
+            self.frame_pending.clear()
+            self.last_frame = now
+            self.render()
+
+    def redraw(self):
+        """
+        Forget what has been drawn so the next frame draws the whole screen again
+        """
+        self.drawn.clear()
+        self.stdscr.erase()
+        if self.client.screen:
+            with self.client.screen_lock:
+                self.client.screen.dirty.update(range(self.client.screen.lines))
+        self.frame_pending.set()
 
     def on_recv(self, data: bytes):
-        logger.debug(data)
-        try:
-            if self.client.shell_active:
-                changes = self.client.display_screen_line_changes()
-                logger.debug('The following lines have changed: %s', list(changes.keys()))
-                for lineno, chars in changes.items():
-                    logger.debug('Line %s has %s chars', lineno, len(chars))
-                    column = 0
-                    current_char_seq: CharSeq = {'column': column, 'text': '', 'attrs': 0}  # Create first sequence for line
-                    for column, char in chars.items():
-                        text = char.data
-                        attrs = self.color_pair if self.color_pair else get_color_pair(char.fg, char.bg)
-                        if char.bold:
-                            attrs += curses.A_BOLD
-                        if char.italics:
-                            attrs += curses.A_ITALIC
-                        if char.underscore:
-                            attrs += curses.A_UNDERLINE
-                        if char.strikethrough:
-                            text = text + "\u0336"   # Strikethrough not directly supported in curses
-                        if char.reverse:
-                            attrs += curses.A_REVERSE
-                        if getattr(char, "blink", False):       # Blink added to pyte but not in latest official release yet
-                            attrs += curses.A_BLINK
-                        if not text:
-                            current_char_seq['text'] = text     # Initial char sequence
-                            current_char_seq['attrs'] = attrs
-                        elif attrs == current_char_seq['attrs']:
-                            current_char_seq['text'] += text   # Append to existing string with same attrs
-                        else:
-                            # Attrs have changed. Write old character sequence and create new
-                            self.addstr(lineno, current_char_seq)
-                            current_char_seq = {'text': char.data, 'attrs': attrs, 'column': column}
-
-                    if current_char_seq['text']:
-                        self.addstr(lineno, current_char_seq)  # Write final sequence for this line
-
-                    # Delete remaining characters in line
-                    column += 1
-                    text = ' '.join(['' for _ in range(column, self.width)])
-                    if text:
-                        logger.debug('Deleting remaining chars')
-                        current_char_seq: CharSeq = {'column': column, 'text': text, 'attrs': 0}
-                        self.addstr(lineno, current_char_seq)
-
-                cursors = self.client.cursors()
-                cursors = (cursors[0], cursors[1])
-                logger.debug('Setting cursors to %s %s', cursors[0], cursors[1])
-                self.stdscr.move(*cursors)
-                self.stdscr.refresh()
-
-                logger.debug('Cursors are at %s', self.stdscr.getyx())
-        except BaseException as e:
-            logger.exception("Uncaught exception: {0}".format(str(e)))
-            self.client.close()
+        if data is not None:
+            logger.debug('Received %s bytes in %s chunks', len(data), data.chunks)
+        self.frame_pending.set()
 
     def close(self):
         self.stdscr.scrollok(False)
@@ -0,0 +1,62 @@
+"""
+Replay a recorded session without a server, to watch it or to measure and profile receiving and rendering it.
+
+    python -m scripts.replay session.cast [--backend fast] [--repeat 3] [--profile]
+    python -m scripts.replay session.cast --psh [--speed 1] [--max-fps 1000]
+
+Recordings are made by setting record on a Client, in asciicast v2 or terminalX's binary format.
+Without --psh the recording is received and emulated as fast as possible and the throughput is reported.
+With --psh it is also drawn by psh's renderer in the current terminal.
+"""
+
+import argparse
+import cProfile
+import curses
+from pathlib import Path
+import pstats
+import time
+
+from terminalX.replay import ReplayClient, replay
+from terminalX.screens import screen_backends
+
+
+def replay_headless(args: argparse.Namespace):
+    for _ in range(args.repeat):
+        client = ReplayClient('replay', recording=args.recording, screen_backend=args.backend, x11=False)
+        size, seconds = replay(client)
+        print(f'{size / 1e6:.2f} MB in {seconds:.3f}s, {size / seconds / 1e6:.2f} MB/s')
+        display = client.display_screen_as_text()
+        client.close()
+    print(display)
+
+
+def replay_psh(args: argparse.Namespace):
+    from scripts.psh import Terminal
+    client = ReplayClient('replay', recording=args.recording, screen_backend=args.backend, speed=args.speed,
+                          x11=False)
+    start = time.perf_counter()
+    curses.wrapper(lambda stdscr: Terminal(client, stdscr, max_fps=args.max_fps))
+    print(f'Replayed in {time.perf_counter() - start:.3f}s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a terminalX recording')
+    parser.add_argument('recording', type=Path)
+    parser.add_argument('--backend', choices=sorted(screen_backends), default='pyte')
+    parser.add_argument('--psh', action='store_true', help='Draw the session with the psh renderer')
+    parser.add_argument('--speed', type=float, default=0, help='0 for as fast as possible, 1 for real time')
+    parser.add_argument('--max-fps', type=int, default=60)
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--profile', action='store_true', help='Print the functions which took the most time')
+    args = parser.parse_args()
+    run = replay_psh if args.psh else replay_headless
+    if args.profile:
+        with cProfile.Profile() as profile:
+            run(args)
+        pstats.Stats(profile).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(25)
+    else:
+        run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+import asyncio
+import logging
+import socket
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from functools import partial
+from typing import Any, AsyncIterator, Callable
+
+import paramiko
+
+from .connections import Client, NoShellException, NotAvailableInProxyCommandMode, NotConnectedException
+from .event_loop import POLL_INTERVAL
+from .executors import executor
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CommandResult:
+    command: str
+    stdout: bytes
+    stderr: bytes
+    exit_status: int
+
+
+class AsyncClient:
+    """
+    asyncio interface to a Client, taking the same configuration.
+
+    Blocking paramiko calls (connecting, opening channels) run in the shared executor, or the one given, so the number
+    of threads stays bounded however many sessions are open. Received data is read when the event loop reports the
+    channel readable rather than by a receive thread per session. Paramiko itself still runs one thread per transport.
+    With x11, X11 channels are relayed by the X11 loop shared by every session.
+
+    Channels are watched with loop.add_reader so a selector based event loop is required. On Windows use
+    asyncio.WindowsSelectorEventLoopPolicy.
+    """
+    recv_size = 65536
+
+    def __init__(self, client: Client = None, executor: Executor = executor, **config):
+        self.client = client or Client(**config)
+        self.executor = executor
+        self._received: asyncio.Queue[bytes] = None
+        self._shell_fd: int = None
+
+    def __repr__(self) -> str:
+        return f'<AsyncClient({self.client.full_name()})>'
+
+    async def _run_blocking(self, func: Callable, *args, **kwargs) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(func, *args, **kwargs))
+
+    async def connect(self, **kwargs) -> None:
+        """
+        Same arguments and exceptions as Client.connect
+        """
+        await self._run_blocking(self.client.connect, **kwargs)
+
+    async def invoke_shell(self, width: int = 80, height: int = 24, width_pixels: int = 0, height_pixels: int = 0,
+                           history: int = 100) -> None:
+        """
+        Raises:	SSHException – if the request was rejected or the channel was closed
+        """
+        if self.client.proxy_command:
+            raise NotAvailableInProxyCommandMode('AsyncClient shell')
+        await self._run_blocking(self.client.open_shell, width, height, width_pixels, height_pixels, history)
+        channel = self.client.ssh_shell
+        channel.setblocking(False)
+        self._received = asyncio.Queue()
+        self._shell_fd = channel.fileno()
+        asyncio.get_running_loop().add_reader(self._shell_fd, self._on_shell_readable)
+
+    def _stop_reading_shell(self):
+        if self._shell_fd is not None:
+            asyncio.get_running_loop().remove_reader(self._shell_fd)
+            self._shell_fd = None
+
+    def _on_shell_readable(self):
+        try:
+            data = self.client.ssh_shell.recv(self.recv_size)
+        except socket.timeout:
+            return
+        if not data:
+            self._stop_reading_shell()
+        self.client.process_received(data)
+        self._received.put_nowait(data)
+
+    async def send(self, text: str) -> None:
+        channel = self.client.ssh_shell
+        if not channel:
+            raise NoShellException
+        data = text.encode(self.client.encoding)
+        if self.client.recorder and self.client.record_input:
+            self.client.recorder.input(data)
+        data = memoryview(data)
+        while data:
+            if not channel.send_ready():
+                await asyncio.sleep(POLL_INTERVAL)      # Wait for the channel's send window to open
+                continue
+            try:
+                sent = channel.send(bytes(data[:channel.out_max_packet_size]))
+            except socket.timeout:
+                continue
+            except OSError:
+                sent = 0
+            if not sent:            # EOF has been sent or the channel has closed
+                self.client.shell_active_event.clear()
+                return
+            data = data[sent:]
+
+    def __aiter__(self) -> AsyncIterator[bytes]:
+        return self
+
+    async def __anext__(self) -> bytes:
+        """
+        Next chunk of output from the shell. The screen has already been updated with it.
+        """
+        if not self._received:
+            raise NoShellException
+        data = await self._received.get()
+        if not data:
+            self._received.put_nowait(data)       # Any other readers also need to see the end of the stream
+            raise StopAsyncIteration
+        return data
+
+    async def exec(self, command: str, timeout: float = None) -> CommandResult:
+        """
+        Run a command in a new channel and return its output once it has finished.
+        Raises asyncio.TimeoutError if the command doesn't finish within timeout seconds.
+        """
+        if self.client.proxy_command:
+            raise NotAvailableInProxyCommandMode('Running a command')
+        if not self.client.transport:
+            raise NotConnectedException
+        channel = await self._run_blocking(self._open_exec_channel, command)
+        try:
+            return await asyncio.wait_for(self._read_command(command, channel), timeout)
+        finally:
+            channel.close()
+
+    def _open_exec_channel(self, command: str) -> paramiko.Channel:
+        channel = self.client.transport.open_session()
+        if self.client.environment:
+            channel.update_environment(self.client.environment)
+        channel.exec_command(command)
+        return channel
+
+    async def _read_command(self, command: str, channel: paramiko.Channel) -> CommandResult:
+        loop = asyncio.get_running_loop()
+        stdout, stderr = bytearray(), bytearray()
+        finished = loop.create_future()
+        fd = channel.fileno()
+        channel.setblocking(False)
+
+        def on_readable():
+            eof = channel.eof_received or channel.closed     # Checked first so no data arriving before EOF is missed
+            while channel.recv_ready():
+                stdout.extend(channel.recv(self.recv_size))
+            while channel.recv_stderr_ready():
+                stderr.extend(channel.recv_stderr(self.recv_size))
+            if eof and not finished.done():
+                finished.set_result(None)
+
+        loop.add_reader(fd, on_readable)
+        try:
+            await finished
+        finally:
+            loop.remove_reader(fd)
+        while not channel.exit_status_ready():
+            await asyncio.sleep(POLL_INTERVAL)
+        return CommandResult(command, bytes(stdout), bytes(stderr), channel.recv_exit_status())
+
+    def display_screen(self) -> list[str]:
+        return self.client.display_screen()
+
+    def display_screen_as_text(self) -> str:
+        return self.client.display_screen_as_text()
+
+    def cursors(self) -> tuple[int, int]:
+        return self.client.cursors()
+
+    async def close(self) -> None:
+        if self._shell_fd is not None:
+            self._stop_reading_shell()
+            self._received.put_nowait(b'')
+        await self._run_blocking(self.client.close)
+
+    async def __aenter__(self) -> 'AsyncClient':
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
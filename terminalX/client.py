@@ -2,7 +2,10 @@
 # From https://github.com/paramiko/paramiko/pull/1873/files#diff-beeef3198e4e0c451d6f4b07f625af72ba815566e85397a123200ef8e4eca45d
 
 from paramiko import SSHClient as ParamikoSSHClient
-from .socks_proxy import SOCKSProxy
+from .event_loop import EventLoop
+from .relay import DEFAULT_BUFFER_SIZE
+from .happy_eyeballs import CONNECTION_ATTEMPT_DELAY, DEFAULT_OPEN_TIMEOUT
+from .socks_proxy import create_socks_proxy
 
 
 class SSHClient(ParamikoSSHClient):
@@ -15,14 +18,42 @@ class SSHClient(ParamikoSSHClient):
             proxy.close()
         super().close()
 
-    def open_socks_proxy(self, bind_address="localhost", port=1080):
+    def use_transport(self, transport):
+        """
+        Use a transport which is already authenticated, such as one shared with another client or from a pool.
+        :param .Transport transport: the transport to use
+        """
+        self._transport = transport
+
+    def release_transport(self):
+        """
+        Close SOCKS proxies and stop using the transport without closing it, for transports shared with other clients
+        """
+        for proxy in self._socks_proxies:
+            proxy.close()
+        self._socks_proxies = []
+        self._transport = None
+
+    def open_socks_proxy(self, bind_address="localhost", port=1080, buffer_size=DEFAULT_BUFFER_SIZE,
+                         loop: EventLoop = None, attempt_delay=CONNECTION_ATTEMPT_DELAY,
+                         open_timeout=DEFAULT_OPEN_TIMEOUT, remote_dns=False, users=None, rate=None, share=None):
         """
         Start a SOCKS5 proxy and make it available on a local socket.
         :param str bind_address: the interface to bind to
         :param int port: the port to bind to
-        :return: a new `.SOCKSProxy` object
+        :param int buffer_size: relay buffer size for each direction of each connection
+        :param .EventLoop loop: handle all connections in this loop instead of a thread per connection
+        :param float attempt_delay: seconds to wait for a channel to one address of a destination before also trying
+            the next
+        :param float open_timeout: seconds to wait for a channel to open
+        :param bool remote_dns: let the server resolve domain names instead of resolving them locally
+        :param dict users: usernames and password hashes clients must log in with, and the limits for each
+        :param float rate: bytes a second to share fairly between users
+        :param .Share share: limits all traffic through the proxy
+        :return: a new `.SOCKSProxy` or `.LoopSOCKSProxy` object
         """
-        socks_proxy = SOCKSProxy(self._transport, bind_address, port)
+        socks_proxy = create_socks_proxy(self._transport, bind_address, port, buffer_size, loop, attempt_delay,
+                                         open_timeout, remote_dns, users, rate, share)
         self._socks_proxies.append(socks_proxy)
         return socks_proxy
 
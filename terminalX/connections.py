@@ -1,4 +1,9 @@
+import codecs
 import getpass
+import io
+import os
+import re
+import select
 import socket
 
 import paramiko
@@ -10,16 +15,64 @@ import threading
 import time
 
 from .client import SSHClient
-from .forwarder import forward_tunnel, ForwardServer
+from .event_loop import EventLoop
+from .forwarder import forward_tunnel, ForwardServer, LoopForwardServer
+from .happy_eyeballs import DEFAULT_OPEN_TIMEOUT
+from .pool import jump_transport_pool, PooledTransport, TransportPool
 from .proxy_command import ProxyCommand
-from .types import DisabledAlgorithms, StringDict, File, KnownHostsPolicy, ProxyJump, ProxyJumpPasswords, ProxyVersion, TunnelConfig
-from .x11 import register_x11
-from typing import Callable, Generator, Optional
+from .recording import Recorder
+from .relay import DEFAULT_BUFFER_SIZE
+from .screens import create_screen, ScreenFactory
+from .search import DEFAULT_MAX_LINES, OutputIndex, SearchMatch, SearchNotEnabled
+from .sftp import ProgressCallback, SFTPTransfer
+from .shaping import Scheduler, Share
+from .types import (DisabledAlgorithms, StringDict, File, ForwardEngine, KnownHostsPolicy, ProxyJump, ProxyJumpPasswords,
+                    ProxyVersion, RecordingFormat, ScreenBackend, SOCKSTunnelConfig, SOCKSUser, TrafficPriority,
+                    TunnelConfig)
+from .x11 import X11Session, register_x11
+from typing import Callable, Generator, Iterator, Optional
 
 
 logger = logging.getLogger()
 
 
+RECEIVE_SIZE = 65536
+MAX_BATCH_SIZE = 65536
+
+
+class ReceivedData(bytes):
+    """
+    Data passed to the receive callback, with the number of chunks received from the channel it was made up of
+    """
+    chunks: int = 1
+
+    def __new__(cls, data: bytes = b'', chunks: int = 1):
+        received = super().__new__(cls, data)
+        received.chunks = chunks
+        return received
+
+
+class ShellReader(io.RawIOBase):
+    """
+    The raw output of a client's shell as a binary file, read directly from the channel.
+    Anything read is still passed to the client's screen if one is attached.
+    """
+
+    def __init__(self, client: 'Client'):
+        self.client = client
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if not self.client.shell_active:
+            return 0
+        data = self.client.ssh_shell.recv(len(buffer))
+        buffer[:len(data)] = data
+        self.client.process_received(data)
+        return len(data)
+
+
 class NotConnectedException(BaseException):
     message = "SSH Client is not yet connected. Call the .connect() method first"
 
@@ -70,6 +123,14 @@ class Client:
     disabled_algorithms: DisabledAlgorithms = None
     host_keys_file: File = None
     term: str = 'linux'
+    encoding: str = 'utf-8'
+    screen_backend: ScreenBackend | str | ScreenFactory = "pyte"
+    headless: bool = False              # Keep shell output raw, without a screen until attach_screen is called
+    record: File = None                 # Record shell output to this file
+    record_format: RecordingFormat = "asciicast"
+    record_input: bool = False          # Also record what is sent to the shell
+    index_output: bool = False          # Keep shell output searchable with search
+    index_max_lines: int = DEFAULT_MAX_LINES
     environment: StringDict = None
     keepalive_interval: int = None
     x11: bool = True
@@ -77,8 +138,10 @@ class Client:
     x11_auth_protocol: str = "MIT-MAGIC-COOKIE-1"
     x11_try_start_server: bool = True
     threads: list[threading.Thread] = field(init=False, repr=False, hash=False, compare=False, default_factory=list)
+    x11_session: X11Session = field(init=False, repr=False, hash=False, compare=False, default=None)
     known_hosts_policy: KnownHostsPolicy = "auto"
     jump_hosts: list[ProxyJump] = None
+    share_jump_hosts: bool = True
     sub_clients: list['Client'] = field(init=False, repr=False, compare=False, hash=False, default_factory=list)
     proxy_command: str = None
     proxy_host: str = None
@@ -87,21 +150,43 @@ class Client:
     proxy_password: str = None
     proxy_version: ProxyVersion = "socks5"
     socks_rdns: Optional[bool] = None
-    socks_tunnels: Optional[list[tuple[str, int]]] = field(default_factory=list)
+    socks_tunnels: Optional[list[tuple[str, int] | tuple[str, int, ForwardEngine] | SOCKSTunnelConfig]] = field(
+        default_factory=list)
     tunnels: Optional[list[TunnelConfig]] = field(default_factory=list)
-    forward_tunnels: list[ForwardServer] = field(init=False, repr=False, hash=False, compare=False,
-                                                 default_factory=list)
+    forward_engine: ForwardEngine = "threading"
+    channel_open_timeout: float = DEFAULT_OPEN_TIMEOUT     # For tunnels and SOCKS proxies, unless set per tunnel
+    socks_tunnel_remote_dns: bool = False       # Let the server resolve names requested through socks_tunnels
+    socks_tunnel_users: Optional[dict[str, SOCKSUser]] = None     # Require clients of socks_tunnels to log in
+    socks_tunnel_rate: Optional[float] = None   # Bytes a second shared fairly between socks_tunnels users
+    traffic_rate: Optional[float] = None        # Bytes a second for tunnels, SOCKS proxies and X11, shared by priority
+    traffic_burst: Optional[float] = None
+    traffic_scheduler: Scheduler = field(init=False, repr=False, hash=False, compare=False, default=None)
+    shell_share: Share = field(init=False, repr=False, hash=False, compare=False, default=None)
+    forward_tunnels: list[ForwardServer | LoopForwardServer] = field(init=False, repr=False, hash=False, compare=False,
+                                                                     default_factory=list)
+    event_loop: EventLoop = field(init=False, repr=False, hash=False, compare=False, default=None)
     ssh_client: SSHClient = field(init=False, repr=False, hash=False, compare=False,
                                   default_factory=SSHClient)
     sftp_client: paramiko.SFTPClient = field(init=False, repr=False, hash=False, compare=False, default=None)
     session: paramiko.Channel = field(init=False, repr=False, hash=False, compare=False, default=None)
     ssh_shell: paramiko.Channel | ProxyCommand = field(init=False, repr=False, hash=False, compare=False, default=None)
     transport: paramiko.Transport = field(init=False, repr=False, hash=False, compare=False, default=None)
-    screen: pyte.HistoryScreen = field(init=False, repr=False, hash=False, compare=False, default=None)
+    pty_size: tuple[int, int] = field(init=False, repr=False, hash=False, compare=False, default=(80, 24))
+    screen: pyte.Screen = field(init=False, repr=False, hash=False, compare=False, default=None)
     stream: pyte.Stream = field(init=False, repr=False, hash=False, compare=False, default=None)
+    decoder: codecs.IncrementalDecoder = field(init=False, repr=False, hash=False, compare=False, default=None)
+    # Held while the screen is fed and while it is read from another thread, such as to draw it
+    screen_lock: threading.RLock = field(init=False, repr=False, hash=False, compare=False,
+                                         default_factory=threading.RLock)
+    recorder: Recorder = field(init=False, repr=False, hash=False, compare=False, default=None)
+    output_index: OutputIndex = field(init=False, repr=False, hash=False, compare=False, default=None)
     receive_thread: threading.Thread = field(init=False, repr=False, hash=False, compare=False, default=None)
     shell_active_event: threading.Event = field(init=False, repr=False, hash=False, compare=False, default_factory=threading.Event)
     receive_callback: Callable[[Optional[bytes]], None] = None
+    frame_interval: float = 1 / 60              # Minimum time between receive callbacks while data is streaming in
+    transport_pool: Optional[TransportPool] = field(default=None, repr=False, hash=False, compare=False)
+    pooled_transport: PooledTransport = field(init=False, repr=False, hash=False, compare=False, default=None)
+    shares_transport: bool = field(init=False, repr=False, hash=False, compare=False, default=False)
 
     def full_name(self) -> str:
         name = self.name or self.host
@@ -159,6 +244,13 @@ class Client:
             self.ssh_shell = self.connect_with_proxy_command()
             self.transport = paramiko.Transport(self.ssh_shell)
             return
+        if self.transport_pool:
+            self.pooled_transport = self.transport_pool.acquire(
+                self, passphrase=passphrase, password=password, sock=sock, jump_hosts_passwords=jump_hosts_passwords,
+                interactive_login_handler=interactive_login_handler, ask_password_callback=ask_password_callback)
+            self.use_transport(self.pooled_transport.transport)
+            self.start_tunnels()
+            return
         self.set_known_hosts_policy()
         if self.host_keys_file:
             self.ssh_client.load_host_keys(self.host_keys_file)
@@ -182,12 +274,16 @@ class Client:
         elif self.jump_hosts:
             jump_hosts = self.jump_hosts.copy()
             jump = jump_hosts.pop(-1)
-            jump_client = replace(self, jump_hosts=jump_hosts, socks_tunnels=[], tunnels=[], **jump)
-            passwords = (jump_hosts_passwords or {}).pop(jump['host'], {})
-            password = passwords.get('password')
-            passphrase = passwords.get('passphrase')
-            jump_client.connect(password=password, passphrase=passphrase, sock=sock, jump_hosts_passwords=passwords)
+            # Clients behind the same jump host share one authenticated transport to it, closed with the last client
+            jump_client = replace(self, jump_hosts=jump_hosts, socks_tunnels=[], tunnels=[],
+                                  transport_pool=jump_transport_pool if self.share_jump_hosts else None, **jump)
+            jump_hosts_passwords = dict(jump_hosts_passwords or {})
+            passwords = jump_hosts_passwords.pop(jump['host'], {})
+            jump_password = passwords.get('password')
+            jump_passphrase = passwords.get('passphrase')
             self.sub_clients.append(jump_client)
+            jump_client.connect(password=jump_password, passphrase=jump_passphrase, sock=sock,
+                                jump_hosts_passwords=jump_hosts_passwords)
             jump_transport = jump_client.transport
             sock = jump_transport.open_channel(
                 kind='direct-tcpip',
@@ -222,33 +318,93 @@ class Client:
         if self.keepalive_interval:
             self.transport.set_keepalive(self.keepalive_interval)
         self.session = self.transport.open_session()
+        self.start_tunnels()
+
+    def use_transport(self, transport: paramiko.Transport):
+        self.transport = transport
+        self.ssh_client.use_transport(transport)
+
+    def start_tunnels(self):
         for t in self.socks_tunnels:
-            self.ssh_client.open_socks_proxy(t[0], t[1])
+            if not isinstance(t, dict):
+                t = SOCKSTunnelConfig(src=(t[0], t[1]), engine=t[2]) if len(t) > 2 else SOCKSTunnelConfig(src=t)
+            share = self.traffic_share(f'socks {t["src"][0]}:{t["src"][1]}', t.get('priority', 'tunnel'),
+                                       t.get('rate'), t.get('burst'))
+            self.ssh_client.open_socks_proxy(t['src'][0], t['src'][1],
+                                             loop=self.engine_loop(t.get('engine', self.forward_engine)),
+                                             open_timeout=self.channel_open_timeout,
+                                             remote_dns=self.socks_tunnel_remote_dns,
+                                             users=self.socks_tunnel_users, rate=self.socks_tunnel_rate, share=share)
         for t in self.tunnels:
             self.setup_tunnel(t)
 
     def scroll_up(self):
-        self.screen.prev_page()
+        with self.screen_lock:
+            self.screen.prev_page()
         self.receive_callback(None)
 
     def scroll_down(self):
-        self.screen.next_page()
+        with self.screen_lock:
+            self.screen.next_page()
         self.receive_callback(None)
 
     def resize_terminal(self, width: int = None, height: int = None, logger=None):
-        width = width or self.screen.columns
-        height = height or self.screen.lines
+        width = width or self.pty_size[0]
+        height = height or self.pty_size[1]
         if self.ssh_shell:
-            logger.info('Resizing screen')
-            self.screen.resize(height, width)
+            if self.screen:
+                logger.info('Resizing screen')
+                with self.screen_lock:
+                    self.screen.resize(height, width)
             logger.info('Resizing pty')
             self.ssh_shell.resize_pty(width, height)
+            self.pty_size = (width, height)
             if self.receive_callback:
                 self.receive_callback(None)
 
+    def get_event_loop(self) -> EventLoop:
+        """
+        One event loop per client is shared by all tunnels using the selector engine
+        """
+        if not self.event_loop:
+            self.event_loop = EventLoop(name=f'terminalX-{self.full_name()}')
+            self.event_loop.start()
+        return self.event_loop
+
+    def engine_loop(self, engine: ForwardEngine) -> Optional[EventLoop]:
+        """
+        The event loop for tunnels and SOCKS proxies using the selector engine, None for the threading engine
+        """
+        match engine:
+            case "threading":
+                return None
+            case "selector":
+                return self.get_event_loop()
+            case _:
+                raise SSHConfigurationException(f'{engine} is not a recognised forwarding engine')
+
+    def traffic_share(self, name: str, priority: TrafficPriority, rate: float = None,
+                      burst: float = None) -> Optional[Share]:
+        """
+        A share of the traffic sent over the client's transport, None if neither it nor the client has a rate.
+        With traffic_rate, shares are served in proportion to the weight of their priority, so the shell is served
+        before X11, X11 before tunnels and tunnels before bulk transfers.
+        """
+        if not rate and not self.traffic_rate:
+            return None
+        if not self.traffic_scheduler:
+            self.traffic_scheduler = Scheduler(self.traffic_rate, self.traffic_burst)
+        return self.traffic_scheduler.priority_share(name, priority, rate, burst)
+
     def setup_tunnel(self, tunnel: TunnelConfig):
+        loop = self.engine_loop(tunnel.get('engine', self.forward_engine))
+        share = self.traffic_share(f'tunnel {tunnel["src"][0]}:{tunnel["src"][1]}', tunnel.get('priority', 'tunnel'),
+                                   tunnel.get('rate'), tunnel.get('burst'))
         forward_server = forward_tunnel(tunnel['src'][1], tunnel['dst'][0], tunnel['dst'][1], self.transport,
-                                        tunnel['src'][0])
+                                        tunnel['src'][0], loop=loop,
+                                        buffer_size=tunnel.get('buffer_size', DEFAULT_BUFFER_SIZE),
+                                        open_timeout=tunnel.get('open_timeout', self.channel_open_timeout),
+                                        share=share, remote_dns=tunnel.get('remote_dns', False))
         self.forward_tunnels.append(forward_server)
 
     def wait_started(self):
@@ -267,9 +423,11 @@ class Client:
                 raise UnknownKnownHostsPolicy(f'{self.known_hosts_policy} not a recognised known_hosts policy')
         self.ssh_client.set_missing_host_key_policy(policy)
 
-    def invoke_shell(self, width: int = 80, height: int = 24, width_pixels: int = 0, height_pixels: int = 0,
-                     history: int = 100, recv_callback: Callable[[], None] = None):
+    def open_shell(self, width: int = 80, height: int = 24, width_pixels: int = 0, height_pixels: int = 0,
+                   history: int = 100):
         """
+        Open the shell channel and screen without starting a thread to receive from it.
+        In headless mode there is no screen, output can be read with iter_output or shell_file instead.
         Raises:	SSHException – if the request was rejected or the channel was closed
         """
         if not self.transport:
@@ -278,44 +436,84 @@ class Client:
             self.ssh_shell = self.transport.open_session()
             if self.environment:
                 self.ssh_shell.update_environment(self.environment)
+            self.shell_share = self.traffic_share('shell', 'interactive')
             if self.x11:
-                x11_thread = register_x11(self.ssh_shell, screen_number=self.x11_screen_number,
-                                          auth_protocol=self.x11_auth_protocol,
-                                          x11_try_start_server=self.x11_try_start_server)
-                self.threads.append(x11_thread)
+                self.x11_session = register_x11(self.ssh_shell, screen_number=self.x11_screen_number,
+                                                auth_protocol=self.x11_auth_protocol,
+                                                x11_try_start_server=self.x11_try_start_server,
+                                                share=self.traffic_share('x11', 'x11'))
             self.ssh_shell.get_pty(self.term, width, height, width_pixels, height_pixels)
             self.ssh_shell.invoke_shell()
-        self.screen = pyte.HistoryScreen(width, height, history=history)
-        self.stream = pyte.Stream(self.screen)
+        self.shell_opened(width, height, history)
+
+    def shell_opened(self, width: int, height: int, history: int):
+        self.pty_size = (width, height)
+        # Keeps the start of a character split between two reads until the rest of it arrives
+        self.decoder = codecs.getincrementaldecoder(self.encoding)(errors='replace')
+        if self.index_output:
+            self.output_index = OutputIndex(self.index_max_lines)
+        if self.record:
+            self.stop_recording()
+            self.recorder = Recorder(self.record, width, height, format=self.record_format, term=self.term,
+                                     encoding=self.encoding)
+        if not self.headless:
+            self.create_screen(width, height, history)
         self.shell_active_event.set()
+
+    def stop_recording(self):
+        if self.recorder:
+            self.recorder.close()
+            self.recorder = None
+
+    def create_screen(self, width: int = 80, height: int = 24, history: int = 100):
+        screen, stream = create_screen(self.screen_backend, width, height, history)
+        if not self.decoder:
+            self.decoder = codecs.getincrementaldecoder(self.encoding)(errors='replace')
+        self.screen = screen
+        self.stream = stream        # Set last as output is only fed to the screen once there is a stream
+
+    def attach_screen(self, history: int = 100) -> pyte.Screen:
+        """
+        Start emulating the terminal of a headless shell, for when its output needs to be rendered.
+        The screen starts empty, only output received from now on is drawn on it.
+        """
+        if not self.screen:
+            self.create_screen(*self.pty_size, history)
+        return self.screen
+
+    def detach_screen(self):
+        """
+        Stop emulating the terminal, so output is only available raw
+        """
+        self.stream = None
+        self.screen = None
+
+    def invoke_shell(self, width: int = 80, height: int = 24, width_pixels: int = 0, height_pixels: int = 0,
+                     history: int = 100, recv_callback: Callable[[], None] = None):
+        """
+        Raises:	SSHException – if the request was rejected or the channel was closed
+        """
+        self.open_shell(width, height, width_pixels, height_pixels, history)
         self.receive_callback = recv_callback
         self.receive_thread = threading.Thread(target=self.receive_always,
                                                daemon=True)
         self.receive_thread.start()
 
-    def reconnect_existing(self, sock):
-        self.ssh_client.connect(self.host, sock=sock)
-
     def duplicate(self) -> 'Client':
         """
-        Raises:
-        BadHostKeyException – if the server’s host key could not be verified
-
-        Raises:
-        AuthenticationException – if authentication failed
-
-        Raises:
-        SSHException – if there was any other error connecting or establishing an SSH session
-
-        Raises:
-        socket.error – if a socket error occurred while connecting
+        Return a new client using the same authenticated transport, so it can open its own shell, sftp and exec
+        channels without connecting and authenticating again.
+        If the transport is not from a pool, it is closed when this client is closed.
         """
 
         if not self.transport:
             raise NotConnectedException
-        sock = self.transport.sock
-        client = replace(self)
-        client.reconnect_existing(sock)
+        client = replace(self, tunnels=[], socks_tunnels=[])
+        if self.pooled_transport:
+            client.pooled_transport = self.pooled_transport.lease()
+        else:
+            client.shares_transport = True
+        client.use_transport(self.transport)
         return client
 
     @property
@@ -325,40 +523,158 @@ class Client:
     def send(self, text: str):
         if not self.ssh_shell:
             raise NoShellException
+        data = text.encode(self.encoding)
+        if self.recorder and self.record_input:
+            self.recorder.input(data)
+        if self.shell_share:
+            self.shell_share.charge(len(data))      # Keystrokes never wait, everything else makes room for them
         try:
-            self.ssh_shell.sendall(text.encode('utf-8'))
+            self.ssh_shell.sendall(data)
         except OSError:
             self.shell_active_event.clear()
 
-    def receive(self):
-        data = self.ssh_shell.recv(9999)
+    def receive_available(self) -> list[bytes]:
+        """
+        Wait for data, then read everything else which has already arrived so a burst of output is parsed in one go.
+        The last chunk is empty if the shell has closed.
+        """
+        chunks = [self.ssh_shell.recv(RECEIVE_SIZE)]
+        if not isinstance(self.ssh_shell, paramiko.Channel):
+            return chunks
+        size = len(chunks[0])
+        while chunks[-1] and size < MAX_BATCH_SIZE and self.ssh_shell.recv_ready():
+            chunks.append(self.ssh_shell.recv(RECEIVE_SIZE))
+            size += len(chunks[-1])
+        return chunks
+
+    def receive(self) -> ReceivedData:
+        chunks = self.receive_available()
+        data = ReceivedData(b''.join(chunks), chunks=sum(1 for chunk in chunks if chunk))
+        self.feed(data)
+        if not chunks[-1]:
+            self.feed(b'')
+        return data
+
+    def feed(self, data: bytes):
         logging.debug('Received data %s bytes', len(data))
-        logging.debug('Received data %s', data)
+        stream, index = self.stream, self.output_index
+        if self.recorder and data:
+            self.recorder.output(data)
         if data:
-            self.stream.feed(data.decode('utf-8', errors='ignore'))
+            if stream or index is not None:
+                text = self.decoder.decode(data)
+                if stream:
+                    with self.screen_lock:
+                        stream.feed(text)
+                if index is not None:
+                    index.feed(text)
         else:
             logger.debug('Clearing shell event')
+            if (stream or index is not None) and (text := self.decoder.decode(b'', final=True)):
+                if stream:
+                    with self.screen_lock:
+                        stream.feed(text)
+                if index is not None:
+                    index.feed(text)
+            self.stop_recording()
             self.shell_active_event.clear()
+
+    def process_received(self, data: bytes):
+        self.feed(data)
         if self.receive_callback:
             self.receive_callback(data)
 
+    def _wait_readable(self, timeout: float) -> Optional[bool]:
+        """
+        Whether the shell has output to read within timeout, None if there is no way to know without reading it
+        """
+        shell = self.ssh_shell
+        if isinstance(shell, paramiko.Channel) and timeout <= 0:
+            return shell.recv_ready()
+        if isinstance(shell, ProxyCommand):
+            shell = shell.process.stdout
+        if os.name == 'nt' and not isinstance(shell, (paramiko.Channel, socket.socket)) or \
+                not hasattr(shell, 'fileno'):
+            return None     # select only works on sockets on Windows
+        return bool(select.select([shell], [], [], max(timeout, 0))[0])
+
     def receive_always(self):
+        """
+        Receive and parse everything which arrives until the shell closes, calling the receive callback at most once
+        per frame interval with everything received since the last call, and then once with an empty value
+        """
         if not self.ssh_shell:
             raise NoShellException
+        pending: list[ReceivedData] = []
+        last_callback = 0
         while self.shell_active_event.is_set():
-            self.receive()
+            due = last_callback + self.frame_interval
+            if pending and (readable := self._wait_readable(due - time.monotonic())) is None:
+                # Nothing can be received without blocking, so pass on what has already arrived first
+                self._receive_pending(pending)
+                last_callback = time.monotonic()
+            if not pending or readable:
+                pending.append(self.receive())
+            if pending and time.monotonic() >= due and self.shell_active_event.is_set():
+                self._receive_pending(pending)
+                last_callback = time.monotonic()
+        self._receive_pending(pending)      # Whatever arrived along with the end of the stream
+        if self.receive_callback:
+            self.receive_callback(ReceivedData(b''))
+
+    def _receive_pending(self, pending: list[ReceivedData]):
+        data = ReceivedData(b''.join(pending), chunks=sum(d.chunks for d in pending))
+        pending.clear()
+        if data and self.receive_callback:
+            self.receive_callback(data)
+
+    def iter_output(self) -> Iterator[bytes]:
+        """
+        Yield output from the shell as it arrives until it closes, in place of the receive thread.
+        Each item is everything which had arrived when it was read, up to MAX_BATCH_SIZE.
+        """
+        if not self.ssh_shell:
+            raise NoShellException
+        while self.shell_active:
+            if data := self.receive():
+                yield data
+
+    def shell_file(self, buffer_size: int = RECEIVE_SIZE) -> io.BufferedReader:
+        """
+        Shell output as a binary file object, in place of the receive thread
+        """
+        if not self.ssh_shell:
+            raise NoShellException
+        return io.BufferedReader(ShellReader(self), buffer_size)
+
+    def search(self, pattern: str | re.Pattern, flags: int = 0, limit: int = None) -> list[SearchMatch]:
+        """
+        Find a regex in everything the shell has output, up to index_max_lines lines, with escape sequences removed.
+        Matches are returned oldest first with the number of the line they were on.
+        """
+        if self.output_index is None:
+            raise SearchNotEnabled
+        return self.output_index.search(pattern, flags, limit)
 
     def display_screen(self) -> list[str]:
         if self.screen:
-            return self.screen.display
+            with self.screen_lock:
+                return self.screen.display
         return []
 
     def cursors(self) -> tuple[int, int]:
-        return self.screen.cursor.y, self.screen.cursor.x,
+        with self.screen_lock:
+            return self.screen.cursor.y, self.screen.cursor.x,
 
     def display_screen_line_changes(self) -> dict[int, dict[int, pyte.screens.Char]]:
-        changes = {line: self.screen.buffer[line] for line in self.screen.dirty}
-        self.screen.dirty.clear()
+        """
+        Copies of the lines which have changed since the last call, so they can be drawn while output is still fed in
+        """
+        with self.screen_lock:
+            screen = self.screen
+            changes = {line: {column: screen.buffer[line][column] for column in range(screen.columns)}
+                       for line in screen.dirty}
+            screen.dirty.clear()
         return changes
 
     def display_screen_as_text(self) -> str:
@@ -369,7 +685,7 @@ class Client:
         if self.proxy_command:
             raise NotAvailableInProxyCommandMode('SFTP')
         client = self.duplicate()
-        client.ssh_client.open_sftp()
+        client.sftp_client = client.ssh_client.open_sftp()
         return client
 
     def exec_command(self, command) -> None:
@@ -379,39 +695,94 @@ class Client:
                        delay: int = 5) -> Generator[str, None, None]:
         """
         This is specifically for running a single command and returning the result. There should always be a timeout
+        To run a command on many hosts at once use MultiClient
         """
         if self.proxy_command:
             raise NotAvailableInProxyCommandMode('Running a command')
         for i in range(0, repeat):
+            if i:
+                time.sleep(delay)
             stdin, stdout, stderr = self.ssh_client.exec_command(command, bufsize=bufsize, timeout=timeout,
                                                                  environment=self.environment)
-            text = stdin.read() + stderr.read()  # fix
+            text = stdout.read() + stderr.read()
             yield text.decode()
-            time.sleep(delay)
 
-    def sftp(self, passphrase: str = None, password: str = None) -> None:
+    def sftp(self, passphrase: str = None, password: str = None) -> paramiko.SFTPClient:
+        if self.proxy_command:
+            raise NotAvailableInProxyCommandMode('SFTP')
+        if not self.transport:
+            self.connect(passphrase=passphrase, password=password)
+        self.sftp_client = self.ssh_client.open_sftp()
+        return self.sftp_client
+
+    def sftp_transfer(self, channels: int = 4, clients: list['Client'] = (), **options) -> SFTPTransfer:
+        """
+        Open an SFTPTransfer with this many SFTP channels on this client's transport and on the transport of each of
+        the other connected clients given, to spread transfers over several connections.
+        Options are passed on to SFTPTransfer. Close it when finished with it.
+        """
         if self.proxy_command:
             raise NotAvailableInProxyCommandMode('SFTP')
-        self.connect(passphrase=passphrase, password=password)
-        self.ssh_client.open_sftp()
+        if not self.transport:
+            raise NotConnectedException
+        sftp_clients = [client.ssh_client.open_sftp() for client in (self, *clients) for _ in range(channels)]
+        return SFTPTransfer(sftp_clients, **options)
+
+    def get(self, remotepath: str, localpath: File, channels: int = 4, progress: ProgressCallback = None,
+            **options):
+        with self.sftp_transfer(channels, progress=progress, **options) as transfer:
+            transfer.get(remotepath, localpath)
+
+    def put(self, localpath: File, remotepath: str, channels: int = 4, progress: ProgressCallback = None,
+            **options):
+        with self.sftp_transfer(channels, progress=progress, **options) as transfer:
+            transfer.put(localpath, remotepath)
+
+    def get_tree(self, remotepath: str, localpath: File, channels: int = 4, progress: ProgressCallback = None,
+                 **options):
+        with self.sftp_transfer(channels, progress=progress, **options) as transfer:
+            transfer.get_tree(remotepath, localpath)
+
+    def put_tree(self, localpath: File, remotepath: str, channels: int = 4, progress: ProgressCallback = None,
+                 **options):
+        with self.sftp_transfer(channels, progress=progress, **options) as transfer:
+            transfer.put_tree(localpath, remotepath)
 
     def close(self):
         self.shell_active_event.clear()
+        self.stop_recording()
         for server in self.forward_tunnels:
             server.shutdown()
+        if self.x11_session:
+            self.x11_session.close()
+            self.x11_session = None
+        if self.event_loop:
+            self.event_loop.stop()
+            self.event_loop = None
+        if self.pooled_transport or self.shares_transport:
+            # Only close this client's own channels, the transport is still being used by others
+            for channel in (self.sftp_client, self.session, self.ssh_shell):
+                if channel:
+                    channel.close()
+            self.ssh_client.release_transport()
+            if self.pooled_transport:
+                self.pooled_transport.release()
+                self.pooled_transport = None
+            self.transport = None
+            self.shares_transport = False
         self.ssh_client.close()
         if self.transport:
             self.transport.close()
         for client in self.sub_clients:
             client.close()
+        self.sub_clients.clear()
 
     def wait_closed(self):
         logger.debug('joining receive thread')
-        self.receive_thread.join()
-        logger.debug('joining x11 thread')
+        if self.receive_thread:
+            self.receive_thread.join()
         for thread in self.threads:
             thread.join()
-        logger.debug('x11 thread joined')
 
     def save(self):
         pass
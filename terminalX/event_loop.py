@@ -0,0 +1,194 @@
+import collections
+import heapq
+import itertools
+import logging
+import selectors
+import socket
+import threading
+import time
+from typing import Any, Callable, Optional
+
+
+logger = logging.getLogger(__name__)
+
+
+POLL_INTERVAL = 0.01
+
+
+class TimerHandle:
+    def __init__(self, when: float, callback: Callable, args: tuple):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class EventLoop:
+    """
+    A single thread running a selector which multiplexes any number of sockets and paramiko channels.
+
+    Paramiko channels are only selectable for reading, so anything waiting for a channel's send window to open
+    registers a poller which is called on every iteration of the loop while it is registered.
+
+    All methods other than start, call_soon and stop must be called from inside the loop thread.
+    """
+
+    def __init__(self, name: str = 'terminalX-event-loop'):
+        self.name = name
+        self.selector = selectors.DefaultSelector()
+        self.thread: threading.Thread = None
+        self._callbacks: collections.deque[tuple[Callable, tuple]] = collections.deque()
+        self._pollers: set[Callable[[], None]] = set()
+        self._timers: list[tuple[float, int, TimerHandle]] = []
+        self._timer_sequence = itertools.count()
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._wakeup_recv.setblocking(False)
+        self._wakeup_send.setblocking(False)
+        self._stopping = False
+        self.selector.register(self._wakeup_recv, selectors.EVENT_READ, self._on_wakeup)
+
+    @property
+    def running(self) -> bool:
+        return bool(self.thread and self.thread.is_alive())
+
+    def in_loop_thread(self) -> bool:
+        return threading.current_thread() is self.thread
+
+    def start(self):
+        if not self.thread:
+            self.thread = threading.Thread(target=self.run_forever, name=self.name, daemon=True)
+            self.thread.start()
+
+    def call_soon(self, callback: Callable, *args):
+        """
+        Schedule a callback to be run in the loop thread. Safe to call from any thread.
+        """
+        self._callbacks.append((callback, args))
+        self._wakeup()
+
+    def call_later(self, delay: float, callback: Callable, *args) -> TimerHandle:
+        """
+        Schedule a callback to be run in the loop thread after delay seconds. Must be called from the loop thread.
+        """
+        timer = TimerHandle(time.monotonic() + delay, callback, args)
+        heapq.heappush(self._timers, (timer.when, next(self._timer_sequence), timer))
+        return timer
+
+    def register(self, fileobj: Any, events: int, callback: Callable[[Any, int], None]):
+        self.selector.register(fileobj, events, callback)
+
+    def modify(self, fileobj: Any, events: int, callback: Callable[[Any, int], None]):
+        self.selector.modify(fileobj, events, callback)
+
+    def set_events(self, fileobj: Any, events: int, callback: Callable[[Any, int], None]):
+        """
+        Register, modify or unregister fileobj depending on whether it is already registered and events is 0
+        """
+        try:
+            key = self.selector.get_key(fileobj)
+        except KeyError:
+            if events:
+                self.selector.register(fileobj, events, callback)
+            return
+        if not events:
+            self.selector.unregister(fileobj)
+        elif key.events != events or key.data != callback:
+            self.selector.modify(fileobj, events, callback)
+
+    def unregister(self, fileobj: Any):
+        try:
+            self.selector.unregister(fileobj)
+        except (KeyError, ValueError):
+            pass
+
+    def add_poller(self, poller: Callable[[], None]):
+        self._pollers.add(poller)
+
+    def remove_poller(self, poller: Callable[[], None]):
+        self._pollers.discard(poller)
+
+    def _wakeup(self):
+        try:
+            self._wakeup_send.send(b'\0')
+        except (BlockingIOError, OSError):
+            pass        # Loop is already due to wake up or has been closed
+
+    def _on_wakeup(self, fileobj: socket.socket, mask: int):
+        try:
+            while self._wakeup_recv.recv(4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+
+    def _run_callbacks(self):
+        for _ in range(len(self._callbacks)):
+            callback, args = self._callbacks.popleft()
+            try:
+                callback(*args)
+            except Exception:
+                logger.exception('Error in event loop callback %s', callback)
+
+    def _run_pollers(self):
+        for poller in list(self._pollers):
+            try:
+                poller()
+            except Exception:
+                logger.exception('Error in event loop poller %s', poller)
+
+    def _run_timers(self):
+        now = time.monotonic()
+        while self._timers and self._timers[0][0] <= now:
+            timer = heapq.heappop(self._timers)[2]
+            if not timer.cancelled:
+                try:
+                    timer.callback(*timer.args)
+                except Exception:
+                    logger.exception('Error in event loop timer %s', timer.callback)
+
+    def _select_timeout(self) -> Optional[float]:
+        if self._callbacks:
+            return 0
+        timeout = POLL_INTERVAL if self._pollers else None
+        if self._timers:
+            until_next_timer = max(self._timers[0][0] - time.monotonic(), 0)
+            timeout = until_next_timer if timeout is None else min(timeout, until_next_timer)
+        return timeout
+
+    def run_forever(self):
+        """
+        Run the loop in the current thread until stop is called. Use start to run it in a new thread instead.
+        """
+        self.thread = self.thread or threading.current_thread()
+        while not self._stopping:
+            timeout = self._select_timeout()
+            for key, mask in self.selector.select(timeout):
+                if self.selector.get_map().get(key.fd) is not key:
+                    continue        # Unregistered by an earlier callback in this iteration
+                try:
+                    key.data(key.fileobj, mask)
+                except Exception:
+                    logger.exception('Error handling event for %s', key.fileobj)
+            self._run_pollers()
+            self._run_timers()
+            self._run_callbacks()
+        self._close()
+
+    def stop(self):
+        """
+        Stop the loop after the current iteration. Safe to call from any thread.
+        """
+        self._stopping = True
+        if not self.thread:
+            self._close()
+            return
+        self._wakeup()
+        if not self.in_loop_thread():
+            self.thread.join()
+
+    def _close(self):
+        self.selector.close()
+        self._wakeup_recv.close()
+        self._wakeup_send.close()
@@ -21,21 +21,41 @@
 
 # Inspired by https://raw.githubusercontent.com/paramiko/paramiko/main/demos/forward.py
 
+from concurrent.futures import Future, wait
 from functools import partial
 import selectors
+import socket
 import socketserver
 import threading
 
 
 import paramiko
 
+from .event_loop import EventLoop, TimerHandle
+from .happy_eyeballs import CONNECTION_ATTEMPT_DELAY, DEFAULT_OPEN_TIMEOUT, Address, ChannelOpener, open_channel
+from .paramiko_util import dns_cache, with_port
+from .relay import DEFAULT_BUFFER_SIZE, Relay, relay
+from .shaping import Share
+
 g_verbose = True
 
+ACCEPT_RETRY_DELAY = 1      # Seconds to stop accepting for after an error such as running out of file descriptors
+
 
 class TunnelNotStartedException(BaseException):
     pass
 
 
+def destination_addresses(host: str, port: int, resolved: Future = None) -> list[Address]:
+    """
+    Addresses to try for the destination from the result of resolving host through the DNS cache.
+    Without a result, or if host couldn't be resolved here, the server is left to resolve it.
+    """
+    if resolved and resolved.done() and not resolved.exception():
+        return with_port(resolved.result(), port)
+    return [(socket.AF_UNSPEC, (host, port))]
+
+
 class ForwardServer(socketserver.ThreadingTCPServer):
     daemon_threads = True
     allow_reuse_address = True
@@ -55,20 +75,32 @@ class ForwardServer(socketserver.ThreadingTCPServer):
 
 class Handler(socketserver.BaseRequestHandler):
 
-    def __init__(self, chain_host: str, chain_port: int, ssh_transport: paramiko.Transport, request, client_address: str, server: ForwardServer):
+    def __init__(self, chain_host: str, chain_port: int, ssh_transport: paramiko.Transport, request, client_address: str,
+                 server: ForwardServer, buffer_size: int = DEFAULT_BUFFER_SIZE,
+                 open_timeout: float = DEFAULT_OPEN_TIMEOUT, share: Share = None,
+                 attempt_delay: float = CONNECTION_ATTEMPT_DELAY, remote_dns: bool = False):
         self.chain_host = chain_host
         self.chain_port = chain_port
         self.ssh_transport = ssh_transport
+        self.buffer_size = buffer_size
+        self.open_timeout = open_timeout
+        self.share = share
+        self.attempt_delay = attempt_delay
+        self.remote_dns = remote_dns
         super().__init__(request, client_address, server)
 
+    def _addresses(self) -> list[Address]:
+        resolved = None
+        if not self.remote_dns:
+            resolved = dns_cache.resolve_async(self.chain_host)
+            wait([resolved], self.open_timeout)
+        return destination_addresses(self.chain_host, self.chain_port, resolved)
+
     def handle(self):
         try:
-            chan = self.ssh_transport.open_channel(
-                "direct-tcpip",
-                (self.chain_host, self.chain_port),
-                self.request.getpeername(),
-            )
-        except paramiko.SSHException as e:
+            chan = open_channel(self.ssh_transport, self._addresses(), self.request.getpeername(),
+                                self.attempt_delay, self.open_timeout)[0]
+        except (paramiko.SSHException, OSError) as e:
             verbose(
                 "Incoming request to %s:%d failed: %s"
                 % (self.chain_host, self.chain_port, repr(e))
@@ -90,31 +122,9 @@ class Handler(socketserver.BaseRequestHandler):
             )
         )
 
-        selector = selectors.DefaultSelector()
-        selector.register(self.request, selectors.EVENT_READ)
-        selector.register(chan, selectors.EVENT_READ)
-
-        while True:
-            # r, w, x = selector.select([self.request, chan], [], [])
-            for key, mask in selector.select():
-                fileObj, fd, events, data = key
-
-                match fileObj:
-                    case self.request:
-                        data = self.request.recv(1024)
-                        if len(data) == 0:
-                            break       # break out of for loop
-                        chan.send(data)
-                    case chan:
-                        data = chan.recv(1024)
-                        if len(data) == 0:
-                            break       # break out of for loop
-                        self.request.send(data)
-            else:
-                continue    # continue while loop if no break
-            break  # break while loop if for loop broken
-
         peername = self.request.getpeername()
+        relay(self.request, chan, self.buffer_size, self.share)
+
         chan.close()
         self.request.close()
         verbose("Tunnel closed from %r" % (peername,))
@@ -127,16 +137,187 @@ class Handler(socketserver.BaseRequestHandler):
             self.request.send(data)
 
 
+class LoopForwardServer:
+    """
+    Alternative to ForwardServer which doesn't use a thread per connection.
+    Accepted sockets and their direct-tcpip channels are all handled by a single EventLoop which can be shared between
+    many servers. The destination is resolved through the DNS cache and channels are opened with a ChannelOpener, so
+    neither a slow lookup nor a slow server response blocks the loop.
+    All connections through the server are limited by share, if given.
+    """
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, server_address: tuple[str, int], chain_host: str, chain_port: int,
+                 ssh_transport: paramiko.Transport, loop: EventLoop, buffer_size: int = DEFAULT_BUFFER_SIZE,
+                 open_timeout: float = DEFAULT_OPEN_TIMEOUT, share: Share = None,
+                 attempt_delay: float = CONNECTION_ATTEMPT_DELAY, remote_dns: bool = False):
+        self.chain_host = chain_host
+        self.chain_port = chain_port
+        self.ssh_transport = ssh_transport
+        self.loop = loop
+        self.buffer_size = buffer_size
+        self.open_timeout = open_timeout
+        self.share = share
+        self.attempt_delay = attempt_delay
+        self.remote_dns = remote_dns
+        self.tunnels: set[Relay] = set()
+        self.openers: set[ChannelOpener] = set()
+        self.accept_timer: TimerHandle = None
+        self.ready_event = threading.Event()
+        self.closed_event = threading.Event()
+        self.closed = False
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if self.allow_reuse_address:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(server_address)
+        self.socket.listen(self.request_queue_size)
+        self.socket.setblocking(False)
+        self.server_address = self.socket.getsockname()
+        self.loop.start()
+        self.loop.call_soon(self._start)
+
+    def _start(self):
+        self.loop.register(self.socket, selectors.EVENT_READ, self._accept)
+        self.ready_event.set()
+
+    def wait_started(self, timeout: int = None):
+        if not self.ready_event.wait(timeout=timeout):
+            raise TunnelNotStartedException(
+                f'Could not start tunnel on {":".join(str(i) for i in self.server_address)} after {timeout} seconds')
+
+    def _accept(self, listening_sock: socket.socket, mask: int):
+        while True:
+            try:
+                sock, address = self.socket.accept()
+            except BlockingIOError:
+                return
+            except OSError as e:
+                # The connection stays queued, so accepting again straight away would only fail again
+                verbose("Accepting connections on %s:%d failed, pausing for %s seconds: %s"
+                        % (self.server_address[0], self.server_address[1], ACCEPT_RETRY_DELAY, repr(e)))
+                self.loop.unregister(self.socket)
+                self.accept_timer = self.loop.call_later(ACCEPT_RETRY_DELAY, self._resume_accepting)
+                return
+            if self.remote_dns:
+                self._open_channel(sock, address)
+            else:
+                dns_cache.resolve_async(self.chain_host).add_done_callback(partial(self._resolved, sock, address))
+
+    def _resume_accepting(self):
+        self.accept_timer = None
+        if not self.closed:
+            self.loop.register(self.socket, selectors.EVENT_READ, self._accept)
+
+    def _resolved(self, sock: socket.socket, address: tuple, future: Future):
+        self.loop.call_soon(self._open_channel, sock, address, future)
+
+    def _open_channel(self, sock: socket.socket, address: tuple, resolved: Future = None):
+        if self.closed:
+            sock.close()
+            return
+        opener = ChannelOpener(self.loop, self.ssh_transport,
+                               destination_addresses(self.chain_host, self.chain_port, resolved), address,
+                               self.attempt_delay, self.open_timeout)
+        self.openers.add(opener)
+        opener.start().add_done_callback(partial(self._attach, sock, opener))
+
+    def _attach(self, sock: socket.socket, opener: ChannelOpener, future):
+        self.openers.discard(opener)
+        if future.cancelled():
+            sock.close()
+            return
+        try:
+            chan = future.result()[0]
+        except (paramiko.SSHException, OSError) as e:
+            verbose(
+                "Incoming request to %s:%d failed: %s"
+                % (self.chain_host, self.chain_port, repr(e))
+            )
+            sock.close()
+            return
+        if chan is None:
+            verbose(
+                "Incoming request to %s:%d was rejected by the SSH server."
+                % (self.chain_host, self.chain_port)
+            )
+            sock.close()
+            return
+        if self.closed:
+            chan.close()
+            sock.close()
+            return
+        verbose(
+            "Connected!  Tunnel open %r -> %r -> %r"
+            % (
+                sock.getpeername(),
+                chan.getpeername(),
+                (self.chain_host, self.chain_port),
+            )
+        )
+        tunnel = Relay(self.loop, sock, chan, self.buffer_size,
+                       on_close=partial(self._tunnel_closed, sock.getpeername()), share=self.share)
+        self.tunnels.add(tunnel)
+        tunnel.start()
+
+    def _tunnel_closed(self, peername: tuple[str, int], tunnel: Relay):
+        self.tunnels.discard(tunnel)
+        verbose("Tunnel closed from %r" % (peername,))
+
+    def _close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.accept_timer:
+            self.accept_timer.cancel()
+        self.loop.unregister(self.socket)
+        self.socket.close()
+        for opener in list(self.openers):
+            opener.cancel()
+        for tunnel in list(self.tunnels):
+            tunnel.close()
+        self.closed_event.set()
+
+    def shutdown(self):
+        if self.loop.in_loop_thread() or not self.loop.running:
+            self._close()
+        else:
+            self.loop.call_soon(self._close)
+            self.closed_event.wait()
+
+
 def create_forward_server(local_port: int, remote_host: str, remote_port: int, transport: paramiko.Transport,
-                          local_host: str = "") -> ForwardServer:
-    return ForwardServer((local_host, local_port), partial(Handler, remote_host, remote_port, transport))
+                          local_host: str = "", loop: EventLoop = None, buffer_size: int = DEFAULT_BUFFER_SIZE,
+                          open_timeout: float = DEFAULT_OPEN_TIMEOUT, share: Share = None,
+                          attempt_delay: float = CONNECTION_ATTEMPT_DELAY,
+                          remote_dns: bool = False) -> ForwardServer | LoopForwardServer:
+    if loop:
+        return LoopForwardServer((local_host, local_port), remote_host, remote_port, transport, loop, buffer_size,
+                                 open_timeout, share, attempt_delay, remote_dns)
+    return ForwardServer((local_host, local_port),
+                         partial(Handler, remote_host, remote_port, transport, buffer_size=buffer_size,
+                                 open_timeout=open_timeout, share=share, attempt_delay=attempt_delay,
+                                 remote_dns=remote_dns))
 
 
 def forward_tunnel(local_port: int, remote_host: str, remote_port: int, transport: paramiko.Transport,
-                   local_host: str = "") -> ForwardServer:
-    server = create_forward_server(local_port, remote_host, remote_port, transport, local_host)
-    thread = threading.Thread(target=server.serve_forever, daemon=True)
-    thread.start()
+                   local_host: str = "", loop: EventLoop = None, buffer_size: int = DEFAULT_BUFFER_SIZE,
+                   open_timeout: float = DEFAULT_OPEN_TIMEOUT, share: Share = None,
+                   attempt_delay: float = CONNECTION_ATTEMPT_DELAY,
+                   remote_dns: bool = False) -> ForwardServer | LoopForwardServer:
+    """
+    Start forwarding local_host:local_port to remote_host:remote_port over the transport.
+    If an EventLoop is given, all connections are handled in that loop, otherwise each connection gets its own thread.
+    remote_host is resolved locally and its addresses tried with Happy Eyeballs, a new attempt every attempt_delay
+    seconds. It is left for the server to resolve if remote_dns is True or it can't be resolved locally.
+    Connections are closed if a channel to the destination can't be opened within open_timeout seconds.
+    Traffic through the tunnel is limited by share, such as one from the Client's traffic scheduler.
+    """
+    server = create_forward_server(local_port, remote_host, remote_port, transport, local_host, loop, buffer_size,
+                                   open_timeout, share, attempt_delay, remote_dns)
+    if not loop:
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
     return server
 
 
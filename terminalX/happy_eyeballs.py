@@ -0,0 +1,206 @@
+"""
+Opening channels to destinations with more than one address, as in Happy Eyeballs (RFC 8305).
+
+Rather than trying each address in turn and waiting for each to fail, a new attempt is started every
+attempt_delay seconds, or as soon as the previous one fails, alternating between address families, and the first
+channel to open is used. Attempts which haven't started when one succeeds are never made. An SSH channel open can't
+be withdrawn once requested, so any other attempt which succeeds later has its channel closed straight away.
+
+Paramiko only opens channels by blocking until the server answers, which for a blackholed address is the whole
+timeout. Each attempt waits in a thread of its own rather than in the shared executor, where a few blackholed
+attempts would hold every worker and leave the attempts which would succeed, and anything else using the executor,
+queued behind them.
+"""
+
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+import itertools
+import threading
+import time
+from typing import Optional
+
+import paramiko
+from paramiko.ssh_exception import NoValidConnectionsError
+
+from .event_loop import EventLoop, TimerHandle
+
+
+CONNECTION_ATTEMPT_DELAY = 0.25         # Recommended by RFC 8305
+DEFAULT_OPEN_TIMEOUT = 30
+
+Address = tuple[int, tuple]             # Address family and address
+
+
+def interleave(addresses: list[Address]) -> list[Address]:
+    """
+    Addresses ordered to alternate between families, starting with the family of the first address
+    """
+    families: dict[int, list[Address]] = {}
+    for address in addresses:
+        families.setdefault(address[0], []).append(address)
+    return [address for group in itertools.zip_longest(*families.values()) for address in group if address]
+
+
+def start_attempt(transport: paramiko.Transport, kind: str, addr: tuple, src_addr: tuple, timeout: float) -> Future:
+    """
+    Open a channel in a new daemon thread, the future is set with the channel or the error
+    """
+    future = Future()
+    future.set_running_or_notify_cancel()
+
+    def attempt():
+        try:
+            future.set_result(transport.open_channel(kind, addr, src_addr, timeout=timeout))
+        except Exception as e:
+            future.set_exception(e)
+
+    threading.Thread(target=attempt, name='terminalX-channel-open', daemon=True).start()
+    return future
+
+
+def _close_channel(future: Future):
+    if not future.cancelled() and not future.exception():
+        future.result().close()
+
+
+def _failure(errors: dict[tuple, Exception]) -> Exception:
+    if len(errors) == 1:
+        return next(iter(errors.values()))
+    if errors:
+        return NoValidConnectionsError(errors)
+    return OSError("No addresses to connect to")
+
+
+def open_channel(transport: paramiko.Transport, addresses: list[Address], src_addr: tuple,
+                 attempt_delay: float = CONNECTION_ATTEMPT_DELAY, timeout: float = DEFAULT_OPEN_TIMEOUT,
+                 kind: str = "direct-tcpip") -> tuple[paramiko.Channel, int, tuple]:
+    """
+    Open a channel to whichever of addresses answers first, blocking until it is open.
+
+    :raises: TimeoutError: if no channel was opened within timeout seconds
+    :raises: the error of the only attempt if there was one, otherwise `.NoValidConnectionsError`
+    """
+    if len(addresses) == 1:
+        af, addr = addresses[0]
+        return transport.open_channel(kind, addr, src_addr, timeout=timeout), af, addr
+    candidates = deque(interleave(addresses))
+    deadline = time.monotonic() + timeout
+    attempts: dict[Future, Address] = {}
+    errors = {}
+    try:
+        while candidates or attempts:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"Timed out opening a channel after {timeout} seconds")
+            if candidates:
+                af, addr = candidates.popleft()
+                attempts[start_attempt(transport, kind, addr, src_addr, remaining)] = af, addr
+            done, _ = wait(attempts, timeout=min(attempt_delay, remaining) if candidates else remaining,
+                           return_when=FIRST_COMPLETED)
+            for future in done:
+                af, addr = attempts.pop(future)
+                try:
+                    return future.result(), af, addr
+                except Exception as e:      # Whatever went wrong, another address may work
+                    errors[addr] = e
+        if time.monotonic() >= deadline:    # The last attempts gave up at the deadline themselves
+            raise TimeoutError(f"Timed out opening a channel after {timeout} seconds")
+        raise _failure(errors)
+    finally:
+        for future in attempts:
+            future.add_done_callback(_close_channel)
+
+
+class ChannelOpener:
+    """
+    Happy Eyeballs driven by an EventLoop, so nothing waits for attempts to finish.
+    The outcome is set on future, from the loop thread, as a tuple of the channel, address family and address.
+    start and cancel must be called from the loop thread.
+    """
+
+    def __init__(self, loop: EventLoop, transport: paramiko.Transport, addresses: list[Address], src_addr: tuple,
+                 attempt_delay: float = CONNECTION_ATTEMPT_DELAY, timeout: float = DEFAULT_OPEN_TIMEOUT,
+                 kind: str = "direct-tcpip"):
+        self.loop = loop
+        self.transport = transport
+        self.candidates = deque(interleave(addresses))
+        self.src_addr = src_addr
+        self.attempt_delay = attempt_delay
+        self.timeout = timeout
+        self.kind = kind
+        self.future: Future = Future()
+        self.attempts: dict[Future, Address] = {}
+        self.errors = {}
+        self.deadline = 0.0
+        self._next_attempt_timer: Optional[TimerHandle] = None
+        self._timeout_timer: Optional[TimerHandle] = None
+
+    def __repr__(self) -> str:
+        return f'<ChannelOpener(candidates={len(self.candidates)}, attempts={len(self.attempts)})>'
+
+    @property
+    def done(self) -> bool:
+        return self.future.done()
+
+    def start(self) -> Future:
+        self.deadline = time.monotonic() + self.timeout
+        self._timeout_timer = self.loop.call_later(self.timeout, self._timed_out)
+        self._next_attempt()
+        return self.future
+
+    def _next_attempt(self):
+        if self._next_attempt_timer:
+            self._next_attempt_timer.cancel()
+            self._next_attempt_timer = None
+        if self.done:
+            return
+        if not self.candidates:
+            if not self.attempts:
+                self._finish(error=_failure(self.errors))
+            return
+        af, addr = self.candidates.popleft()
+        future = start_attempt(self.transport, self.kind, addr, self.src_addr,
+                               max(self.deadline - time.monotonic(), 0))
+        self.attempts[future] = af, addr
+        future.add_done_callback(lambda f: self.loop.call_soon(self._attempt_done, f))
+        if self.candidates:
+            self._next_attempt_timer = self.loop.call_later(self.attempt_delay, self._next_attempt)
+
+    def _attempt_done(self, future: Future):
+        af, addr = self.attempts.pop(future)
+        if self.done:
+            _close_channel(future)
+            return
+        try:
+            channel = future.result()
+        except Exception as e:      # Whatever went wrong, another address may work
+            self.errors[addr] = e
+            self._next_attempt()    # Don't wait for the delay when an attempt fails
+            return
+        self._finish(result=(channel, af, addr))
+
+    def _timed_out(self):
+        self._finish(error=TimeoutError(f"Timed out opening a channel after {self.timeout} seconds"))
+
+    def _stop(self):
+        self.candidates.clear()
+        for timer in (self._next_attempt_timer, self._timeout_timer):
+            if timer:
+                timer.cancel()
+
+    def _finish(self, result: tuple = None, error: Exception = None):
+        if self.done:
+            return
+        self._stop()
+        if error:
+            self.future.set_exception(error)
+        else:
+            self.future.set_result(result)
+
+    def cancel(self):
+        """
+        Stop making attempts and close any channel which is opened after all
+        """
+        if not self.done:
+            self._stop()
+            self.future.cancel()
@@ -0,0 +1,119 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from typing import AsyncIterator, Iterable, Iterator, Optional
+
+from .async_client import AsyncClient, CommandResult
+from .connections import Client, NotConnectedException, SSHConfigurationException
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class HostResult:
+    client: Client
+    command: str
+    result: Optional[CommandResult] = None
+    error: Optional[BaseException] = None
+    connect_time: float = 0
+    elapsed: float = 0
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.result.exit_status == 0
+
+    @property
+    def host(self) -> str:
+        return self.client.full_name()
+
+
+class MultiClient:
+    """
+    Runs a command on many hosts at once, yielding the result from each host as soon as it finishes.
+
+    At most max_concurrency hosts are connecting or running the command at any one time. Connections are made in a
+    thread pool of the same size. A failure or timeout on one host is recorded in its HostResult and doesn't affect
+    the others.
+
+    Hosts without connect timeouts of their own are given timeout, so a connect which has been given up on can't hold
+    its thread for longer. When a host times out while connecting its client is closed, which also ends a connect
+    waiting for the server, and closed again if the connect finishes after all.
+    """
+
+    def __init__(self, clients: Iterable[Client], max_concurrency: int = 100, timeout: float = None,
+                 connect_kwargs: dict = None):
+        self.clients = list(clients)
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.connect_kwargs = connect_kwargs or {}
+
+    def _with_timeouts(self, client: Client) -> Client:
+        if not self.timeout:
+            return client
+        return replace(client, timeout=client.timeout or self.timeout,
+                       banner_timeout=client.banner_timeout or self.timeout,
+                       auth_timeout=client.auth_timeout or self.timeout)
+
+    async def _run_on_host(self, client: Client, command: str, semaphore: asyncio.Semaphore,
+                           executor: ThreadPoolExecutor) -> HostResult:
+        host_result = HostResult(client, command)
+        async with semaphore:
+            start = time.monotonic()
+            async_client = AsyncClient(self._with_timeouts(client), executor=executor)
+            connecting = executor.submit(async_client.client.connect, **self.connect_kwargs)
+            try:
+                await asyncio.wait_for(self._connect_and_exec(async_client, connecting, command, host_result),
+                                       self.timeout)
+            except (Exception, NotConnectedException, SSHConfigurationException) as e:
+                logger.info('%s failed on %s: %r', command, client.full_name(), e)
+                host_result.error = e
+            finally:
+                host_result.elapsed = time.monotonic() - start
+                if connecting.done():
+                    await async_client.close()
+                else:
+                    connecting.add_done_callback(lambda f: async_client.client.close())
+                    await asyncio.get_running_loop().run_in_executor(None, async_client.client.close)
+        return host_result
+
+    async def _connect_and_exec(self, async_client: AsyncClient, connecting: Future, command: str,
+                                host_result: HostResult):
+        start = time.monotonic()
+        await asyncio.wrap_future(connecting)
+        host_result.connect_time = time.monotonic() - start
+        host_result.result = await async_client.exec(command)
+
+    async def run(self, command: str) -> AsyncIterator[HostResult]:
+        """
+        Run command on all hosts, yielding results in the order they complete
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        executor = ThreadPoolExecutor(max_workers=self.max_concurrency)
+        tasks = [asyncio.create_task(self._run_on_host(client, command, semaphore, executor))
+                 for client in self.clients]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+            executor.shutdown(wait=False, cancel_futures=True)     # Don't block the loop for connects still running
+
+    def run_sync(self, command: str) -> Iterator[HostResult]:
+        """
+        Blocking version of run, for use outside of an event loop
+        """
+        loop = asyncio.new_event_loop()
+        results = self.run(command)
+        try:
+            while True:
+                try:
+                    yield loop.run_until_complete(results.__anext__())
+                except StopAsyncIteration:
+                    break
+        finally:
+            loop.run_until_complete(results.aclose())
+            loop.close()
@@ -18,7 +18,18 @@
 # From https://github.com/paramiko/paramiko/pull/1873/files#diff-12d25726b6e93483154a1601bc1da4a363c48e9c7f4792238d3effde4bd01e93
 
 
+from collections import OrderedDict
+from concurrent.futures import Future
+from functools import partial
 import socket
+import threading
+import time
+from typing import Callable
+from weakref import WeakKeyDictionary
+
+import paramiko
+
+from .executors import executor
 
 
 def families_and_addresses(hostname, port):
@@ -52,3 +63,149 @@ def ip_addr_to_str(addr):
     if ":" in addr[0]:
         return "[{}]:{}".format(addr[0], addr[1])
     return "{}:{}".format(addr[0], addr[1])
+
+
+DNS_CACHE_TTL = 60                  # Seconds to keep addresses, getaddrinfo doesn't say how long they are valid for
+DNS_NEGATIVE_TTL = 5                # Seconds to remember that a name couldn't be resolved
+DNS_CACHE_SIZE = 1024
+
+Resolver = Callable[[str], Future]  # Resolves a hostname to (family, address) pairs without waiting for the answer
+
+
+def system_resolver(hostname: str) -> Future:
+    """
+    Resolve hostname with getaddrinfo in the shared executor
+    """
+    return executor.submit(lambda: list(families_and_addresses(hostname, 0)))
+
+
+def with_port(addresses: list[tuple[int, tuple]], port: int) -> list[tuple[int, tuple]]:
+    """
+    Addresses with the port replaced, keeping IPv6 flow info and scope id
+    """
+    return [(family, (address[0], port) + tuple(address[2:])) for family, address in addresses]
+
+
+class DNSCache:
+    """
+    Caches resolved addresses and failures to resolve, keyed by hostname.
+
+    Lookups of a name which is already being resolved share the same query instead of making another. The resolver
+    is called with the lock released and must not block, the default runs getaddrinfo in the shared executor but
+    any other resolver returning a Future may be used. At most max_entries names are kept, the least recently used
+    are dropped first.
+    """
+
+    def __init__(self, resolver: Resolver = system_resolver, ttl: float = DNS_CACHE_TTL,
+                 negative_ttl: float = DNS_NEGATIVE_TTL, max_entries: int = DNS_CACHE_SIZE):
+        self.resolver = resolver
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.entries: OrderedDict[str, tuple[float, Future]] = OrderedDict()
+        self.pending: dict[str, Future] = {}
+        self.lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f'<DNSCache(entries={len(self.entries)}, pending={len(self.pending)})>'
+
+    def resolve_async(self, hostname: str) -> Future:
+        """
+        A Future for the (family, address) pairs of hostname, with port 0. Done already if the answer is cached.
+        """
+        hostname = hostname.lower()
+        with self.lock:
+            entry = self.entries.get(hostname)
+            if entry:
+                if entry[0] > time.monotonic():
+                    self.entries.move_to_end(hostname)
+                    return entry[1]
+                del self.entries[hostname]
+            future = self.pending.get(hostname)
+            if future:
+                return future
+            self.pending[hostname] = future = Future()
+        try:
+            lookup = self.resolver(hostname)
+        except Exception as e:
+            lookup = Future()
+            lookup.set_exception(e)
+        lookup.add_done_callback(partial(self._resolved, hostname, future))
+        return future
+
+    def _resolved(self, hostname: str, future: Future, lookup: Future):
+        error = lookup.exception()
+        ttl = self.negative_ttl if error else self.ttl
+        with self.lock:
+            del self.pending[hostname]
+            if ttl > 0:
+                self.entries[hostname] = (time.monotonic() + ttl, future)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        if error:
+            future.set_exception(error)
+        else:
+            future.set_result(lookup.result())
+
+    def resolve(self, hostname: str, port: int, timeout: float = None) -> list[tuple[int, tuple]]:
+        """
+        Pairs of address families and addresses to try for connecting, waiting for the answer if it isn't cached
+        """
+        return with_port(self.resolve_async(hostname).result(timeout), port)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+dns_cache = DNSCache()
+
+
+class RemoteListeners:
+    """
+    Ports the server listens on for a transport ("tcpip-forward"), each with its own handler for the connections
+    forwarded from it. Paramiko keeps only one handler per transport, so one dispatcher is registered for all of them
+    which passes each forwarded channel on by the port it arrived at.
+    listen and cancel block until the server answers.
+    """
+
+    def __init__(self, transport: paramiko.Transport):
+        self.transport = transport
+        self.handlers: dict[int, Callable[[paramiko.Channel, tuple], None]] = {}
+
+    def listen(self, handler: Callable[[paramiko.Channel, tuple], None], address: str = "", port: int = 0) -> int:
+        """
+        Ask the server to listen on address and port, any free port if it is 0, and return the port.
+        handler is called with each forwarded channel and the address it came from, in the transport's thread.
+        """
+        port = self.transport.request_port_forward(address, port, self._dispatch)
+        self.handlers[port] = handler
+        return port
+
+    def _dispatch(self, channel: paramiko.Channel, origin: tuple, server: tuple):
+        handler = self.handlers.get(server[1])
+        if handler:
+            handler(channel, origin)
+        else:
+            channel.close()
+
+    def cancel(self, port: int, address: str = ""):
+        self.handlers.pop(port, None)
+        if self.transport.is_active():
+            # Not transport.cancel_port_forward, which removes the handler for every other port too
+            self.transport.global_request("cancel-tcpip-forward", (address, port), wait=True)
+
+
+_remote_listeners: WeakKeyDictionary[paramiko.Transport, RemoteListeners] = WeakKeyDictionary()
+_remote_listeners_lock = threading.Lock()
+
+
+def remote_listeners(transport: paramiko.Transport) -> RemoteListeners:
+    """
+    The RemoteListeners shared by everything listening on the server through transport
+    """
+    with _remote_listeners_lock:
+        listeners = _remote_listeners.get(transport)
+        if not listeners:
+            listeners = _remote_listeners[transport] = RemoteListeners(transport)
+        return listeners
@@ -0,0 +1,235 @@
+import logging
+import threading
+import time
+from dataclasses import replace
+from typing import Hashable, Optional, TYPE_CHECKING
+
+import paramiko
+
+if TYPE_CHECKING:
+    from .connections import Client
+
+
+logger = logging.getLogger(__name__)
+
+
+class TransportPoolClosedException(BaseException):
+    pass
+
+
+def pool_key(client: 'Client') -> Hashable:
+    """
+    Clients with the same key can share an authenticated transport: same destination, user and route to get there
+    """
+    jump_hosts = tuple((jump['host'], jump.get('port') or client.port, jump.get('username') or client.username)
+                       for jump in client.jump_hosts or [])
+    proxy = (client.proxy_command, client.proxy_version, client.proxy_host, client.proxy_port, client.proxy_username)
+    return client.host, client.port, client.username, proxy, jump_hosts
+
+
+class PooledTransport:
+    """
+    An authenticated transport owned by the pool, with a count of the clients currently using it.
+    """
+
+    def __init__(self, pool: 'TransportPool', key: Hashable, client: 'Client'):
+        self.pool = pool
+        self.key = key
+        self.client = client        # The client which made the connection
+        self.transport: paramiko.Transport = client.transport
+        self.leases = 0
+        self.last_used = time.monotonic()
+        self.last_checked = time.monotonic()
+
+    def __repr__(self) -> str:
+        return f'<PooledTransport({self.client.full_name()}, leases={self.leases}, channels={self.channels})>'
+
+    @property
+    def channels(self) -> int:
+        return len(self.transport._channels)
+
+    @property
+    def has_capacity(self) -> bool:
+        limit = self.pool.max_channels_per_transport
+        return limit is None or self.channels < limit
+
+    def healthy(self) -> bool:
+        """
+        Check the transport is still up. If it hasn't been checked recently, send a message over it first so a
+        dropped connection is noticed before the transport is handed out.
+        """
+        if not self.transport.is_active() or not self.transport.is_authenticated():
+            return False
+        if time.monotonic() - self.last_checked > self.pool.health_check_interval:
+            try:
+                self.transport.send_ignore()
+            except (EOFError, OSError, paramiko.SSHException):
+                return False
+            self.last_checked = time.monotonic()
+        return self.transport.is_active()
+
+    def open_session(self, timeout: float = None) -> paramiko.Channel:
+        return self.transport.open_session(timeout=timeout)
+
+    def open_channel(self, kind: str, dest_addr: tuple[str, int] = None, src_addr: tuple[str, int] = None,
+                     timeout: float = None) -> paramiko.Channel:
+        return self.transport.open_channel(kind, dest_addr=dest_addr, src_addr=src_addr, timeout=timeout)
+
+    def open_sftp(self) -> paramiko.SFTPClient:
+        return paramiko.SFTPClient.from_transport(self.transport)
+
+    def exec_command(self, command: str, bufsize: int = -1, timeout: float = None,
+                     environment: dict[str, str] = None) -> tuple[paramiko.ChannelFile, paramiko.ChannelFile,
+                                                                  paramiko.ChannelFile]:
+        """
+        Same as paramiko.SSHClient.exec_command but on a pooled transport
+        """
+        chan = self.open_session(timeout=timeout)
+        chan.settimeout(timeout)
+        if environment:
+            chan.update_environment(environment)
+        chan.exec_command(command)
+        stdin = chan.makefile_stdin("wb", bufsize)
+        stdout = chan.makefile("r", bufsize)
+        stderr = chan.makefile_stderr("r", bufsize)
+        return stdin, stdout, stderr
+
+    def lease(self) -> 'PooledTransport':
+        """
+        Take out another lease on this transport, for another client sharing it
+        """
+        with self.pool._lock:
+            return self.pool._lease(self)
+
+    def release(self):
+        self.pool.release(self)
+
+    def close(self):
+        self.client.close()
+
+
+class TransportPool:
+    """
+    Shares authenticated transports between clients connecting to the same host as the same user by the same route,
+    so new sessions, exec, sftp and direct-tcpip channels skip the TCP handshake, key exchange and authentication.
+
+    A transport is only handed out while it has fewer than max_channels_per_transport channels open, otherwise another
+    one is connected to the same host. Transports no client is using are closed after idle_timeout seconds, or as soon
+    as the last client releases them if idle_timeout is 0.
+    A keepalive is sent over pooled transports every keepalive_interval seconds and any transport which hasn't been
+    checked in the last health_check_interval seconds is checked again before it is handed out.
+    """
+
+    def __init__(self, max_channels_per_transport: Optional[int] = 10, idle_timeout: float = 300,
+                 keepalive_interval: int = 30,
+                 health_check_interval: float = 10):
+        self.max_channels_per_transport = max_channels_per_transport
+        self.idle_timeout = idle_timeout
+        self.keepalive_interval = keepalive_interval
+        self.health_check_interval = health_check_interval
+        self.transports: dict[Hashable, list[PooledTransport]] = {}
+        self._lock = threading.RLock()
+        self._connect_locks: dict[Hashable, threading.Lock] = {}
+        self._reaper: threading.Thread = None
+        self._closed = threading.Event()
+
+    def _find(self, key: Hashable) -> PooledTransport | None:
+        candidates = []
+        for pooled in list(self.transports.get(key, [])):
+            if not pooled.healthy():
+                logger.info('Discarding unhealthy pooled transport %s', pooled)
+                self._remove(pooled)
+                pooled.close()
+            elif pooled.has_capacity:
+                candidates.append(pooled)
+        return min(candidates, key=lambda p: p.channels, default=None)
+
+    def _lease(self, pooled: PooledTransport) -> PooledTransport:
+        pooled.leases += 1
+        pooled.last_used = time.monotonic()
+        return pooled
+
+    def acquire(self, client: 'Client', **connect_kwargs) -> PooledTransport:
+        """
+        Return a pooled transport for the client's host, user and route, connecting a new one if none is available.
+        connect_kwargs are passed to Client.connect when a new connection is needed.
+        Call release on the result when finished with it.
+        """
+        if self._closed.is_set():
+            raise TransportPoolClosedException('Transport pool has been closed')
+        key = pool_key(client)
+        with self._lock:
+            if pooled := self._find(key):
+                logger.debug('Reusing pooled transport %s', pooled)
+                return self._lease(pooled)
+            connect_lock = self._connect_locks.setdefault(key, threading.Lock())
+        with connect_lock:      # Concurrent requests for the same host wait for one connection instead of making many
+            with self._lock:
+                if pooled := self._find(key):
+                    return self._lease(pooled)
+            owner = replace(client, transport_pool=None, tunnels=[], socks_tunnels=[])
+            owner.connect(**connect_kwargs)
+            return self.add(owner, key)
+
+    def add(self, client: 'Client', key: Hashable = None) -> PooledTransport:
+        """
+        Hand over an already connected client's transport to the pool. The pool closes it when it is evicted.
+        """
+        pooled = PooledTransport(self, key or pool_key(client), client)
+        if self.keepalive_interval:
+            pooled.transport.set_keepalive(self.keepalive_interval)
+        with self._lock:
+            self.transports.setdefault(pooled.key, []).append(pooled)
+            self._start_reaper()
+            return self._lease(pooled)
+
+    def release(self, pooled: PooledTransport):
+        with self._lock:
+            pooled.leases -= 1
+            pooled.last_used = time.monotonic()
+            if pooled.leases <= 0 and not self.idle_timeout:
+                self._remove(pooled)
+                pooled.close()
+
+    def _remove(self, pooled: PooledTransport):
+        transports = self.transports.get(pooled.key, [])
+        if pooled in transports:
+            transports.remove(pooled)
+        if not transports:
+            self.transports.pop(pooled.key, None)
+
+    def evict_idle(self):
+        now = time.monotonic()
+        with self._lock:
+            for transports in list(self.transports.values()):
+                for pooled in list(transports):
+                    idle = pooled.leases <= 0 and now - pooled.last_used >= self.idle_timeout
+                    if idle or not pooled.transport.is_active():
+                        logger.debug('Evicting pooled transport %s', pooled)
+                        self._remove(pooled)
+                        pooled.close()
+
+    def _start_reaper(self):
+        if self.idle_timeout and not self._reaper:
+            self._reaper = threading.Thread(target=self._reap, name='terminalX-transport-pool', daemon=True)
+            self._reaper.start()
+
+    def _reap(self):
+        interval = min(self.idle_timeout, self.health_check_interval)
+        while not self._closed.wait(interval):
+            self.evict_idle()
+
+    def close(self):
+        self._closed.set()
+        with self._lock:
+            for transports in list(self.transports.values()):
+                for pooled in list(transports):
+                    self._remove(pooled)
+                    pooled.close()
+
+
+transport_pool = TransportPool()
+
+# Jump hosts only carry direct-tcpip channels, which aren't limited like sessions, so one transport per bastion is
+# shared by every client behind it and closed when the last of them is closed.
+jump_transport_pool = TransportPool(max_channels_per_transport=None, idle_timeout=0)
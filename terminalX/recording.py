@@ -0,0 +1,226 @@
+"""
+Recording shell sessions and reading them back.
+
+Two formats are supported:
+asciicast: asciinema's asciicast v2, a JSON header line then one JSON line per event, [time, kind, text]
+binary: a header line then each event as a fixed size header followed by the bytes exactly as they were received,
+    for recordings which must be replayed byte for byte whatever the encoding
+"""
+
+import codecs
+import json
+import logging
+import queue
+import struct
+import threading
+import time
+from typing import Iterator, NamedTuple, Optional
+
+from .types import File, RecordingFormat
+
+
+logger = logging.getLogger(__name__)
+
+
+BINARY_MAGIC = b'terminalX-recording 1\n'
+BINARY_EVENT = struct.Struct('<dcI')        # Seconds since the start, kind, length of the data which follows
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+OUTPUT = 'o'
+INPUT = 'i'
+
+
+class UnknownRecordingFormat(BaseException):
+    pass
+
+
+class Event(NamedTuple):
+    time: float
+    kind: str
+    data: bytes
+
+
+class Recorder:
+    """
+    Appends events to a recording from a writer thread, so the thread receiving data only has to queue it.
+    Everything queued is written in one go and the file is flushed whenever the queue is empty.
+    """
+
+    def __init__(self, path: File, width: int, height: int, format: RecordingFormat = "asciicast",
+                 term: str = None, encoding: str = 'utf-8'):
+        if format not in ("asciicast", "binary"):
+            raise UnknownRecordingFormat(f'{format} is not a recognised recording format')
+        self.path = path
+        self.format = format
+        self.encoding = encoding
+        self.decoders = {kind: codecs.getincrementaldecoder(encoding)(errors='replace') for kind in (OUTPUT, INPUT)}
+        self.start = time.monotonic()
+        self.queue: queue.SimpleQueue[Optional[Event]] = queue.SimpleQueue()
+        self.closed = False
+        self._lock = threading.Lock()
+        self.file = open(path, 'wb', buffering=WRITE_BUFFER_SIZE)
+        header = {'version': 2, 'width': width, 'height': height, 'timestamp': int(time.time())}
+        if term:
+            header['env'] = {'TERM': term}
+        if format == "binary":
+            self.file.write(BINARY_MAGIC)
+        self.file.write(json.dumps(header).encode() + b'\n')
+        self.thread = threading.Thread(target=self._write_events, name='terminalX-recorder', daemon=True)
+        self.thread.start()
+
+    def __repr__(self) -> str:
+        return f'<Recorder({self.path}, format={self.format})>'
+
+    def output(self, data: bytes):
+        self.queue.put(Event(time.monotonic() - self.start, OUTPUT, data))
+
+    def input(self, data: bytes):
+        self.queue.put(Event(time.monotonic() - self.start, INPUT, data))
+
+    def _encode(self, event: Event) -> bytes:
+        if self.format == "binary":
+            return BINARY_EVENT.pack(event.time, event.kind.encode(), len(event.data)) + event.data
+        text = self.decoders[event.kind].decode(event.data)
+        return json.dumps([round(event.time, 6), event.kind, text], ensure_ascii=False).encode() + b'\n'
+
+    def _finish_text(self) -> bytes:
+        """
+        Events for anything the decoders are still holding, such as a multibyte character cut off at the end
+        """
+        if self.format == "binary":
+            return b''
+        now = round(time.monotonic() - self.start, 6)
+        return b''.join(json.dumps([now, kind, text], ensure_ascii=False).encode() + b'\n'
+                        for kind, decoder in self.decoders.items() if (text := decoder.decode(b'', final=True)))
+
+    def _write_events(self):
+        try:
+            while event := self.queue.get():
+                self.file.write(self._encode(event))
+                while True:
+                    try:
+                        event = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if not event:
+                        self.file.write(self._finish_text())
+                        return
+                    self.file.write(self._encode(event))
+                self.file.flush()
+            self.file.write(self._finish_text())
+        except OSError as e:
+            logger.error('Stopped recording to %s: %s', self.path, e)
+        finally:
+            self.file.close()
+
+    def close(self):
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+        self.queue.put(None)
+        self.thread.join()
+
+    def __enter__(self) -> 'Recorder':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class RecordingReader:
+    """
+    Reads the header and events of a recording in either format.
+    Text in asciicast recordings is encoded with encoding, so events always hold bytes.
+    """
+
+    def __init__(self, path: File, encoding: str = 'utf-8'):
+        self.path = path
+        self.encoding = encoding
+        self.file = open(path, 'rb')
+        first_line = self.file.readline()
+        if first_line == BINARY_MAGIC:
+            self.format = "binary"
+            first_line = self.file.readline()
+        else:
+            self.format = "asciicast"
+        try:
+            self.header: dict = json.loads(first_line)
+        except ValueError:
+            self.file.close()
+            raise UnknownRecordingFormat(f'{path} is not a recording')
+
+    def __repr__(self) -> str:
+        return f'<RecordingReader({self.path}, format={self.format})>'
+
+    @property
+    def width(self) -> int:
+        return self.header.get('width', 80)
+
+    @property
+    def height(self) -> int:
+        return self.header.get('height', 24)
+
+    def __iter__(self) -> Iterator[Event]:
+        if self.format == "binary":
+            while header := self.file.read(BINARY_EVENT.size):
+                event_time, kind, length = BINARY_EVENT.unpack(header)
+                yield Event(event_time, kind.decode(), self.file.read(length))
+        else:
+            for line in self.file:
+                if line.strip():
+                    event_time, kind, text = json.loads(line)
+                    yield Event(event_time, kind, text.encode(self.encoding, errors='replace'))
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self) -> 'RecordingReader':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class ReplayChannel:
+    """
+    Stands in for a shell channel, receiving the output from a recording instead of a server.
+    With speed 0 output is returned as fast as it is read, otherwise each event is held back until its time in
+    the recording divided by speed. Anything sent is discarded.
+    """
+
+    def __init__(self, reader: RecordingReader, speed: float = 0):
+        self.reader = reader
+        self.speed = speed
+        self.events = iter(reader)
+        self.pending = b''
+        self.start = time.monotonic()
+        self.closed = False
+
+    def recv(self, size: int) -> bytes:
+        data = self.pending
+        while not data:
+            event = next(self.events, None)
+            if not event:
+                self.closed = True
+                return b''
+            if event.kind != OUTPUT:
+                continue
+            if self.speed and (delay := self.start + event.time / self.speed - time.monotonic()) > 0:
+                time.sleep(delay)
+            data = event.data
+        self.pending = data[size:]
+        return data[:size]
+
+    def send(self, data: bytes) -> int:
+        return len(data)
+
+    def sendall(self, data: bytes):
+        pass
+
+    def resize_pty(self, width: int = 80, height: int = 24, width_pixels: int = 0, height_pixels: int = 0):
+        pass
+
+    def close(self):
+        self.closed = True
+        self.reader.close()
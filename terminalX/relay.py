@@ -0,0 +1,288 @@
+"""
+Buffers and loops for passing data between sockets and paramiko channels, shared by tunnels, SOCKS and X11.
+"""
+
+from functools import partial
+import selectors
+import socket
+from typing import Callable
+
+import paramiko
+
+from .event_loop import EventLoop, TimerHandle
+from .shaping import Share
+
+
+DEFAULT_BUFFER_SIZE = 65536
+
+Endpoint = socket.socket | paramiko.Channel
+
+
+def recv_into(endpoint: Endpoint, view: memoryview) -> int:
+    """
+    Read directly into view for sockets.
+    Paramiko channels don't support recv_into so for those data is received and copied in.
+    """
+    if isinstance(endpoint, paramiko.Channel):
+        data = endpoint.recv(len(view))
+        view[:len(data)] = data
+        return len(data)
+    return endpoint.recv_into(view)
+
+
+def send(endpoint: Endpoint, view: memoryview) -> int:
+    """
+    Send as much of view as possible without copying for sockets.
+    Paramiko channels only accept bytes and can't send more than one packet at a time, so only that much is copied.
+    """
+    if isinstance(endpoint, paramiko.Channel):
+        return endpoint.send(bytes(view[:endpoint.out_max_packet_size]))
+    return endpoint.send(view)
+
+
+class RelayBuffer:
+    """
+    Preallocated buffer holding data read from one endpoint which is waiting to be written to another.
+    Data is read in with recv_into and written out from memoryview slices, so no intermediate bytes objects are created
+    for sockets. Anything not accepted by a partial write is kept for the next drain.
+    """
+
+    def __init__(self, size: int = DEFAULT_BUFFER_SIZE):
+        self.size = size
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    def __bool__(self) -> bool:
+        return self.end > self.start
+
+    @property
+    def free(self) -> int:
+        return self.size - len(self)
+
+    def _make_space(self):
+        if self.start == self.end:
+            self.start = self.end = 0
+        elif self.end == self.size:
+            pending = self.end - self.start
+            self.view[:pending] = self.view[self.start:self.end]
+            self.start = 0
+            self.end = pending
+
+    def fill(self, source: Endpoint, limit: int = None) -> int:
+        """
+        Read as much as there is space for from source, or up to limit bytes. Returns 0 on EOF.
+        """
+        self._make_space()
+        received = recv_into(source, self.view[self.end:self.end + limit if limit else self.size])
+        self.end += received
+        return received
+
+    def drain(self, dest: Endpoint) -> int:
+        """
+        Write as much pending data to dest as it will accept. Returns the number of bytes written.
+        """
+        sent = send(dest, self.view[self.start:self.end])
+        self.start += sent
+        if self.start == self.end:
+            self.start = self.end = 0
+        return sent
+
+    def drain_all(self, dest: Endpoint):
+        """
+        Keep writing until everything pending has been written, for blocking endpoints.
+        """
+        while self:
+            if not self.drain(dest):
+                raise ConnectionError('Endpoint closed before all data could be written')
+
+    def release(self):
+        self.view.release()
+
+
+def shutdown_write(endpoint: Endpoint):
+    """
+    Half-close: tell the other end no more data is coming while still allowing data to be received
+    """
+    if isinstance(endpoint, paramiko.Channel):
+        endpoint.shutdown_write()
+    else:
+        endpoint.shutdown(socket.SHUT_WR)
+
+
+class Direction:
+    """
+    One direction of a Relay, from source to dest through a buffer
+    """
+
+    def __init__(self, source: Endpoint, dest: Endpoint, buffer_size: int, share: Share = None):
+        self.source = source
+        self.dest = dest
+        self.buffer = RelayBuffer(buffer_size)
+        self.share = share
+        self.eof = False            # Source has nothing more to send
+        self.done = False           # EOF has been passed on to dest
+        self.throttled = False      # The share has refused to let any more be read for now
+
+    @property
+    def want_read(self) -> bool:
+        return not self.eof and not self.throttled and self.buffer.free > 0
+
+    @property
+    def want_write(self) -> bool:
+        return bool(self.buffer)
+
+    def read(self):
+        limit = None
+        if self.share:
+            limit = self.share.grant(self.buffer.free)
+            if not limit:
+                self.throttled = True
+                return
+        received = 0
+        try:
+            received = self.buffer.fill(self.source, limit)
+            if not received:
+                self.eof = True
+        except (BlockingIOError, socket.timeout):
+            pass
+        finally:
+            if limit:
+                self.share.give_back(limit - received)
+
+    def write(self):
+        while self.buffer:
+            try:
+                if not self.buffer.drain(self.dest):
+                    raise ConnectionError('Endpoint closed before all data could be written')
+            except (BlockingIOError, socket.timeout):
+                break
+            if isinstance(self.dest, paramiko.Channel) and not self.dest.send_ready():
+                break
+        if self.eof and not self.buffer and not self.done:
+            self.done = True
+            shutdown_write(self.dest)
+
+
+class Relay:
+    """
+    Non-blocking bidirectional relay between two endpoints, driven by an EventLoop.
+
+    How much can be buffered in each direction is capped by the buffer size. A side is only read from while there
+    is space in the buffer for that direction, so a slow consumer pushes back on a fast producer instead of filling
+    memory. Sockets are registered for write readiness while they have data waiting. Channels can't be selected for
+    writing so a poller checks their send window instead.
+
+    EOF from one side is passed on as a half-close once everything before it has been written, while the other
+    direction carries on until it reaches EOF too. Both endpoints are closed when both directions are finished, when
+    a channel has been closed by the server and everything it sent has been passed on, or when either endpoint fails.
+
+    With a share, reads in both directions are limited to what the share grants. A direction which is refused stops
+    reading until a timer for the share's delay lets it try again.
+    """
+
+    def __init__(self, loop: EventLoop, a: Endpoint, b: Endpoint, buffer_size: int = DEFAULT_BUFFER_SIZE,
+                 on_close: Callable[['Relay'], None] = None, share: Share = None):
+        self.loop = loop
+        self.a = a
+        self.b = b
+        self.on_close = on_close
+        self.share = share
+        self.a_to_b = Direction(a, b, buffer_size, share)
+        self.b_to_a = Direction(b, a, buffer_size, share)
+        self.closed = False
+        self._throttle_timer: TimerHandle = None
+        self._callbacks = {a: partial(self._on_event, self.a_to_b, self.b_to_a),
+                           b: partial(self._on_event, self.b_to_a, self.a_to_b)}
+
+    def start(self):
+        """
+        Must be called from the loop thread
+        """
+        self.a.setblocking(False)
+        self.b.setblocking(False)
+        self._update()
+
+    def _on_event(self, read_direction: Direction, write_direction: Direction, fileobj: Endpoint, mask: int):
+        try:
+            if mask & selectors.EVENT_WRITE:
+                write_direction.write()
+            if mask & selectors.EVENT_READ:
+                read_direction.read()
+                read_direction.write()
+        except OSError:
+            self.close()
+            return
+        self._update()
+
+    def _poll_channels(self):
+        try:
+            for direction in (self.a_to_b, self.b_to_a):
+                if direction.want_write and isinstance(direction.dest, paramiko.Channel) and \
+                        direction.dest.send_ready():
+                    direction.write()
+        except OSError:
+            self.close()
+            return
+        self._update()
+
+    def _channel_finished(self) -> bool:
+        return any(direction.done and isinstance(direction.source, paramiko.Channel) and direction.source.closed
+                   for direction in (self.a_to_b, self.b_to_a))
+
+    def _update(self):
+        if self.closed:
+            return
+        if self.a_to_b.done and self.b_to_a.done or self._channel_finished():
+            self.close()
+            return
+        poll = False
+        for read_direction, write_direction in ((self.a_to_b, self.b_to_a), (self.b_to_a, self.a_to_b)):
+            endpoint = read_direction.source
+            events = selectors.EVENT_READ if read_direction.want_read else 0
+            if write_direction.want_write:
+                if isinstance(endpoint, paramiko.Channel):
+                    poll = True
+                else:
+                    events |= selectors.EVENT_WRITE
+            self.loop.set_events(endpoint, events, self._callbacks[endpoint])
+        if poll:
+            self.loop.add_poller(self._poll_channels)
+        else:
+            self.loop.remove_poller(self._poll_channels)
+        if not self._throttle_timer and (self.a_to_b.throttled or self.b_to_a.throttled):
+            self._throttle_timer = self.loop.call_later(self.share.delay(), self._unthrottle)
+
+    def _unthrottle(self):
+        self._throttle_timer = None
+        self.a_to_b.throttled = self.b_to_a.throttled = False
+        self._update()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self._throttle_timer:
+            self._throttle_timer.cancel()
+        self.loop.remove_poller(self._poll_channels)
+        for endpoint in (self.a, self.b):
+            self.loop.unregister(endpoint)
+            endpoint.close()
+        self.a_to_b.buffer.release()
+        self.b_to_a.buffer.release()
+        if self.on_close:
+            self.on_close(self)
+
+
+def relay(a: Endpoint, b: Endpoint, buffer_size: int = DEFAULT_BUFFER_SIZE, share: Share = None):
+    """
+    Pass data in both directions between two endpoints in the current thread until both have finished sending,
+    then close them.
+    """
+    loop = EventLoop()
+    Relay(loop, a, b, buffer_size, on_close=lambda r: loop.stop(), share=share).start()
+    loop.run_forever()
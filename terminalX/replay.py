@@ -0,0 +1,47 @@
+from dataclasses import dataclass
+import time
+
+from .connections import Client
+from .recording import RecordingReader, ReplayChannel
+from .types import File
+
+
+@dataclass
+class ReplayClient(Client):
+    """
+    Client whose shell plays back a recording instead of connecting to a server, so receiving, emulating and rendering
+    a session can be repeated and profiled without a network. Anything sent to the shell is discarded.
+    speed 0 replays as fast as possible, 1 at the speed it was recorded.
+    """
+    recording: File = None
+    speed: float = 0
+
+    def connect(self, *args, **kwargs) -> None:
+        pass
+
+    def open_shell(self, width: int = None, height: int = None, width_pixels: int = 0, height_pixels: int = 0,
+                   history: int = 100):
+        """
+        The size of the terminal defaults to the size it was when it was recorded
+        """
+        reader = RecordingReader(self.recording, self.encoding)
+        self.ssh_shell = ReplayChannel(reader, self.speed)
+        self.shell_opened(width or reader.width, height or reader.height, history)
+
+    def close(self):
+        super().close()
+        if self.ssh_shell:
+            self.ssh_shell.close()
+
+
+def replay(client: ReplayClient) -> tuple[int, float]:
+    """
+    Receive the whole recording on the current thread, returning the number of bytes received and how many seconds it
+    took
+    """
+    client.open_shell()
+    size = 0
+    start = time.perf_counter()
+    while client.shell_active:
+        size += len(client.receive())
+    return size, time.perf_counter() - start
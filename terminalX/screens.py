@@ -0,0 +1,349 @@
+"""
+Screen backends which keep the emulated terminal up to date with the output of a shell.
+
+A backend is a factory returning a screen and the stream which parses output into it. The screen must provide the
+pyte.Screen interface used by Client: display, dirty, cursor, buffer, lines, columns, resize, prev_page and next_page.
+"""
+
+from array import array, typecodes
+import marshal
+import math
+from typing import Any, Callable, Iterator, Optional
+
+import pyte
+from pyte import charsets, modes
+from pyte.screens import Char, History, Margins
+from wcwidth import wcwidth
+
+from .scrollback import Scrollback
+from .types import ScreenBackend
+
+
+ScreenFactory = Callable[[int, int, int], tuple[pyte.Screen, pyte.Stream]]
+
+TEXT_TYPECODE = 'w' if 'w' in typecodes else 'u'     # 'u' is deprecated from Python 3.13
+PLACEHOLDER = '\0'          # Marks a cell whose text isn't a single code point, kept in Row.extra instead
+ROW_OVERHEAD = 250          # Approximate size of a Row and its arrays without any cells
+
+
+def pyte_screen(width: int, height: int, history: int) -> tuple[pyte.HistoryScreen, pyte.Stream]:
+    screen = pyte.HistoryScreen(width, height, history=history)
+    return screen, pyte.Stream(screen)
+
+
+class Row:
+    """
+    One line of a FastScreen, with the same mapping interface as the dicts of Char pyte uses for lines.
+
+    Text is held in a unicode array and attributes in an array of indexes into the screen's style table, rather than
+    a Char per cell. Cells which have never been written have style 0 and read as the row default.
+    """
+    __slots__ = ('screen', 'default', 'text', 'styles', 'extra', 'wide')
+
+    def __init__(self, screen: 'FastScreen', default: Char):
+        self.screen = screen
+        self.default = default
+        self.text = array(TEXT_TYPECODE, ' ' * screen.columns)
+        self.styles = array('H', [0]) * screen.columns
+        self.extra: dict[int, str] = {}
+        self.wide = False           # Contains double width or combined characters so can't be displayed directly
+
+    def _grow(self, size: int):
+        if (missing := size - len(self.text)) > 0:
+            self.text.extend(' ' * missing)
+            self.styles.extend(array('H', [0]) * missing)
+
+    def __contains__(self, x: int) -> bool:
+        return x < len(self.styles) and self.styles[x] != 0
+
+    def __iter__(self) -> Iterator[int]:
+        return (x for x, style in enumerate(self.styles) if style)
+
+    def __len__(self) -> int:
+        return len(self.styles) - self.styles.count(0)
+
+    def keys(self) -> Iterator[int]:
+        return iter(self)
+
+    def items(self) -> Iterator[tuple[int, Char]]:
+        return ((x, self[x]) for x in self)
+
+    def __getitem__(self, x: int) -> Char:
+        if x >= len(self.styles) or not (style := self.styles[x]):
+            return self.default
+        data = self.text[x]
+        if data == PLACEHOLDER:
+            data = self.extra[x]
+        return self.screen.style_table[style]._replace(data=data)
+
+    def __setitem__(self, x: int, char: Char):
+        self._grow(x + 1)
+        self.styles[x] = self.screen.style_id(char)
+        data = char.data
+        if len(data) == 1 and data != PLACEHOLDER:
+            self.text[x] = data
+            if self.extra:
+                self.extra.pop(x, None)
+        else:
+            self.text[x] = PLACEHOLDER
+            self.extra[x] = data
+            self.wide = True
+        if not self.wide and data and wcwidth(data[0]) != 1:
+            self.wide = True
+
+    def pop(self, x: int, default: Char = None) -> Optional[Char]:
+        if x not in self:
+            return default
+        char = self[x]
+        self.styles[x] = 0
+        self.text[x] = ' '
+        if self.extra:
+            self.extra.pop(x, None)
+        return char
+
+    def __delitem__(self, x: int):
+        if x not in self:
+            raise KeyError(x)
+        self.pop(x)
+
+    def write(self, x: int, text: str, style: int):
+        """
+        Write single width text with one style, which must fit in the row
+        """
+        end = x + len(text)
+        self._grow(end)
+        self.text[x:end] = array(TEXT_TYPECODE, text)
+        self.styles[x:end] = array('H', [style]) * len(text)
+        if self.extra:
+            for column in range(x, end):
+                self.extra.pop(column, None)
+
+    @property
+    def size(self) -> int:
+        return ROW_OVERHEAD + len(self.text) * (self.text.itemsize + self.styles.itemsize)
+
+    def state(self) -> tuple:
+        """
+        Contents of the row as built-in types, without the cells at the end which have never been written
+        """
+        end = (len(self.styles.tobytes().rstrip(b'\0')) + 1) // self.styles.itemsize
+        return (self.text[:end].tounicode(), self.styles[:end].tobytes(), self.extra or None, self.wide,
+                self.screen.style_id(self.default), self.default.data)
+
+    @classmethod
+    def restore(cls, screen: 'FastScreen', state: tuple) -> 'Row':
+        text, styles, extra, wide, default_style, default_data = state
+        row = cls(screen, screen.style_table[default_style]._replace(data=default_data))
+        row.text[:len(text)] = array(TEXT_TYPECODE, text)
+        row.styles[:len(text)] = array('H', styles)
+        row.extra = extra or {}
+        row.wide = wide
+        return row
+
+    def display(self, columns: int) -> str:
+        if not self.wide:
+            return self.text[:columns].tounicode().ljust(columns)
+        chars = [self[x].data for x in range(columns)]
+        is_wide_char = False
+        for x, char in enumerate(chars):
+            if is_wide_char:
+                chars[x] = ''       # Stub after a double width character
+            is_wide_char = not is_wide_char and bool(char) and wcwidth(char[0]) == 2
+        return ''.join(chars)
+
+
+class RowCodec:
+    """
+    Encodes pages of a FastScreen's rows for its scrollback
+    """
+
+    def __init__(self, screen: 'FastScreen'):
+        self.screen = screen
+
+    def encode(self, rows: list[Row]) -> bytes:
+        return marshal.dumps([row.state() for row in rows])
+
+    def decode(self, data: bytes) -> list[Row]:
+        return [Row.restore(self.screen, state) for state in marshal.loads(data)]
+
+    def size(self, row: Row) -> int:
+        return row.size
+
+
+class RowBuffer(dict[int, Row]):
+    """
+    Lines of a FastScreen, created when first used like pyte's defaultdict
+    """
+
+    def __init__(self, screen: 'FastScreen'):
+        super().__init__()
+        self.screen = screen
+
+    def __missing__(self, y: int) -> Row:
+        row = self[y] = Row(self.screen, self.screen.default_char)
+        return row
+
+
+class FastScreen(pyte.Screen):
+    """
+    pyte screen with compact rows, history and a fast path for text.
+
+    Runs of printable ASCII in the default character set are written into a row in one slice assignment rather than
+    one Char at a time. Everything else, including escape sequences, is handled by pyte.Screen.
+    Like pyte.HistoryScreen, lines scrolled off the screen are kept in history for prev_page and next_page, and any
+    new output returns to the bottom of the history. History is held in Scrollbacks, so long histories are stored
+    compactly and can spill to disk. Any other keyword arguments are passed on to them.
+    Unlike pyte.HistoryScreen, lines pushed off the bottom of the screen by a reverse index aren't kept.
+    """
+
+    def __init__(self, columns: int, lines: int, history: int = 100, ratio: float = .5, **scrollback: Any):
+        codec = RowCodec(self)
+        self.history = History(Scrollback(codec, history, **scrollback), Scrollback(codec, history, **scrollback),
+                               float(ratio), history, history)
+        self.style_table: list[Char] = [None]       # Style 0 means the row default
+        self.style_ids: dict[Char, int] = {}
+        super().__init__(columns, lines)
+        self.buffer = RowBuffer(self)
+
+    def style_id(self, char: Char) -> int:
+        style = char._replace(data='')
+        if (style_id := self.style_ids.get(style)) is None:
+            style_id = self.style_ids[style] = len(self.style_table)
+            self.style_table.append(style)
+        return style_id
+
+    @property
+    def display(self) -> list[str]:
+        return [self.buffer[y].display(self.columns) for y in range(self.lines)]
+
+    def draw(self, data: str) -> None:
+        if self.charset or self.g0_charset is not charsets.LAT1_MAP or modes.IRM in self.mode or \
+                modes.DECAWM not in self.mode or not (data.isascii() and data.isprintable()):
+            super().draw(data)
+            return
+        style = self.style_id(self.cursor.attrs)
+        offset = 0
+        while offset < len(data):
+            if self.cursor.x == self.columns:
+                self.dirty.add(self.cursor.y)
+                self.carriage_return()
+                self.linefeed()
+            x = self.cursor.x
+            count = min(self.columns - x, len(data) - offset)
+            self.buffer[self.cursor.y].write(x, data[offset:offset + count], style)
+            self.cursor.x = x + count
+            offset += count
+        self.dirty.add(self.cursor.y)
+
+    def erase_in_line(self, how: int = 0, private: bool = False) -> None:
+        self.dirty.add(self.cursor.y)
+        if how == 0:
+            start, end = self.cursor.x, self.columns
+        elif how == 1:
+            start, end = 0, self.cursor.x + 1
+        else:
+            start, end = 0, self.columns
+        end = min(end, self.columns)
+        row = self.buffer[self.cursor.y]
+        if start < end and self.cursor.attrs.data == ' ':
+            row.write(start, ' ' * (end - start), self.style_id(self.cursor.attrs))
+        else:
+            for x in range(start, end):
+                row[x] = self.cursor.attrs
+
+    # History, as in pyte.HistoryScreen
+
+    def to_bottom(self):
+        """
+        Return to the bottom of the history, called before new output is drawn
+        """
+        while self.history.position < self.history.size and self.history.bottom:
+            self.next_page()
+
+    def _update_cursor_visibility(self):
+        self.cursor.hidden = not (self.history.position == self.history.size and modes.DECTCEM in self.mode)
+
+    def _reset_history(self) -> None:
+        self.history.top.clear()
+        self.history.bottom.clear()
+        self.history = self.history._replace(position=self.history.size)
+
+    def reset(self) -> None:
+        super().reset()
+        self._reset_history()
+
+    def resize(self, lines: Optional[int] = None, columns: Optional[int] = None) -> None:
+        # HistoryScreen returns to the bottom before the lines dropped when shrinking and again afterwards
+        if lines and lines < self.lines:
+            self.to_bottom()
+        super().resize(lines, columns)
+        self.to_bottom()
+
+    def erase_in_display(self, how: int = 0, *args, **kwargs) -> None:
+        super().erase_in_display(how, *args, **kwargs)
+        if how == 3:
+            self._reset_history()
+
+    def index(self) -> None:
+        top, bottom = self.margins or Margins(0, self.lines - 1)
+        if self.cursor.y == bottom:
+            self.history.top.append(self.buffer[top])
+        super().index()
+
+    def prev_page(self) -> None:
+        if self.history.position > self.lines and self.history.top:
+            mid = min(len(self.history.top), int(math.ceil(self.lines * self.history.ratio)))
+            self.history.bottom.extend(self.buffer[y] for y in range(self.lines - 1, self.lines - mid - 1, -1))
+            self.history = self.history._replace(position=self.history.position - mid)
+            for y in range(self.lines - 1, mid - 1, -1):
+                self.buffer[y] = self.buffer[y - mid]
+            for y in range(mid - 1, -1, -1):
+                self.buffer[y] = self.history.top.pop()
+            self.dirty = set(range(self.lines))
+        self._update_cursor_visibility()
+
+    def next_page(self) -> None:
+        if self.history.position < self.history.size and self.history.bottom:
+            mid = min(len(self.history.bottom), int(math.ceil(self.lines * self.history.ratio)))
+            self.history.top.extend(self.buffer[y] for y in range(mid))
+            self.history = self.history._replace(position=self.history.position + mid)
+            for y in range(self.lines - mid):
+                self.buffer[y] = self.buffer[y + mid]
+            for y in range(self.lines - mid, self.lines):
+                self.buffer[y] = self.history.bottom.pop()
+            self.dirty = set(range(self.lines))
+        self._update_cursor_visibility()
+
+
+class FastStream(pyte.Stream):
+    """
+    Returns the screen to the bottom of its history once per feed rather than once per event
+    """
+
+    def feed(self, data: str) -> None:
+        self.listener.to_bottom()
+        super().feed(data)
+
+
+def fast_screen(width: int, height: int, history: int, **scrollback: Any) -> tuple[FastScreen, FastStream]:
+    """
+    Options for the scrollback such as memory_limit can be set with functools.partial(fast_screen, ...)
+    """
+    screen = FastScreen(width, height, history=history, **scrollback)
+    return screen, FastStream(screen)
+
+
+screen_backends: dict[str, ScreenFactory] = {
+    'pyte': pyte_screen,
+    'fast': fast_screen,
+}
+
+
+def register_screen_backend(name: str, factory: ScreenFactory):
+    screen_backends[name] = factory
+
+
+def create_screen(backend: ScreenBackend | str | ScreenFactory, width: int, height: int,
+                  history: int) -> tuple[pyte.Screen, pyte.Stream]:
+    factory = backend if callable(backend) else screen_backends[backend]
+    return factory(width, height, history)
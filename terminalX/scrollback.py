@@ -0,0 +1,346 @@
+"""
+Scrollback storage for screens with long histories.
+
+Lines are kept as they are until enough have been added to fill a page, then pages of lines are encoded into one
+bytes object and optionally compressed. When a session's pages use more memory than its limit, or all sessions
+together use more than the global budget, the oldest pages are moved to a memory mapped temporary file.
+"""
+
+from bisect import bisect_right
+from collections import deque
+from dataclasses import dataclass
+import mmap
+import tempfile
+import threading
+from typing import Any, Generic, Iterable, Optional, Protocol, TypeVar
+import weakref
+import zlib
+
+
+Line = TypeVar('Line')
+
+DEFAULT_PAGE_SIZE = 256
+DEFAULT_MEMORY_LIMIT = 4 * 1024 * 1024              # Per session
+DEFAULT_GLOBAL_MEMORY_LIMIT = 256 * 1024 * 1024     # Across all sessions in the process
+COMPRESSION_LEVEL = 1           # Most of the saving of higher levels for a fraction of the time
+COMPACT_MIN_SIZE = 1024 * 1024  # Don't bother reclaiming less than this much unused space in a spill file
+COMPACT_CHUNK_SIZE = 1024 * 1024    # Most of a spill file to hold in memory at once while compacting it
+
+
+class LineCodec(Protocol[Line]):
+    def encode(self, lines: list[Line]) -> bytes:
+        ...
+
+    def decode(self, data: bytes) -> list[Line]:
+        ...
+
+    def size(self, line: Line) -> int:
+        """
+        Approximate memory used by a line before it is encoded
+        """
+
+
+@dataclass
+class Page:
+    first: int                  # Sequence number of the first line
+    count: int
+    data: Optional[bytes]       # None once spilled to disk
+    length: int
+    offset: int = None          # Position in the spill file
+    skip: int = 0               # Lines at the start which have been dropped from the scrollback
+
+    @property
+    def spilled(self) -> bool:
+        return self.data is None
+
+
+class SpillFile:
+    """
+    Temporary file holding the oldest pages of one scrollback, read back through a memory map.
+    Pages are always added after and removed from either end of the ones already there, so the used part of the
+    file is one contiguous region. Space freed at the start is reclaimed once it is over half the file.
+    """
+
+    def __init__(self, directory: str = None):
+        self.file = tempfile.TemporaryFile(prefix='terminalX-scrollback-', dir=directory)
+        self.map: mmap.mmap = None
+        self.start = 0
+        self.end = 0
+
+    def write(self, data: bytes) -> int:
+        offset = self.end
+        self.file.seek(offset)
+        self.file.write(data)
+        self.end += len(data)
+        return offset
+
+    def read(self, offset: int, length: int) -> bytes:
+        if not self.map or len(self.map) < offset + length:
+            self._unmap()
+            self.file.flush()
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.map[offset:offset + length]
+
+    def free(self, page: Page):
+        if page.offset == self.start:
+            self.start += page.length
+        elif page.offset + page.length == self.end:
+            self.end = page.offset
+        if self.start >= self.end:
+            self.start = self.end = 0
+            self.truncate()
+
+    def compact(self, pages: Iterable[Page]) -> bool:
+        """
+        Move pages to the start of the file if the free space before them is too large.
+        Returns True if the pages were moved.
+        """
+        length = self.end - self.start
+        if self.start < COMPACT_MIN_SIZE or self.start < length:
+            return False
+        self._unmap()
+        # The free space is at least as large as what is moved into it, so a chunk is never overwritten before it's read
+        for position in range(0, length, COMPACT_CHUNK_SIZE):
+            self.file.seek(self.start + position)
+            chunk = self.file.read(min(COMPACT_CHUNK_SIZE, length - position))
+            self.file.seek(position)
+            self.file.write(chunk)
+        for page in pages:
+            page.offset -= self.start
+        self.start, self.end = 0, length
+        self.truncate()
+        return True
+
+    def truncate(self):
+        self._unmap()
+        self.file.truncate(self.end)
+
+    def _unmap(self):
+        if self.map:
+            self.map.close()
+            self.map = None
+
+    def close(self):
+        self._unmap()
+        self.file.close()
+
+
+class Scrollback(Generic[Line]):
+    """
+    Stack of lines with a maximum length, like a deque with maxlen which lines are only appended to and popped from
+    the right. When it is full, lines are dropped from the left.
+
+    The most recent lines are kept as they are so paging back and forth near the bottom doesn't need any decoding.
+    Once there are more than two pages of them, the oldest page is encoded with codec and stored as bytes,
+    compressed if compress is True. The oldest encoded pages are spilled to disk when the scrollback uses more than
+    memory_limit bytes or the budget is exceeded.
+    Any line can be read by index, with 0 the oldest, and the most recently decoded page is cached for the next
+    access.
+    """
+
+    def __init__(self, codec: LineCodec[Line], maxlen: int, page_size: int = DEFAULT_PAGE_SIZE,
+                 compress: bool = True, memory_limit: Optional[int] = DEFAULT_MEMORY_LIMIT,
+                 budget: Optional['MemoryBudget'] = None, spill_directory: str = None):
+        self.codec = codec
+        self.maxlen = maxlen
+        self.page_size = page_size
+        self.compress = compress
+        self.memory_limit = memory_limit
+        self.budget = memory_budget if budget is None else budget
+        self.spill_directory = spill_directory
+        self.pages: list[Page] = []
+        self.firsts: list[int] = []         # First sequence number of each page, for bisecting
+        self.tail: deque[Line] = deque()
+        self.tail_memory = 0
+        self.pages_memory = 0
+        self.dropped = 0                    # Sequence number of the oldest line
+        self.length = 0
+        self.spill_file: SpillFile = None
+        self._cache: tuple[Page, list[Line]] = None
+        self.lock = threading.RLock()
+        if self.budget:
+            self.budget.add(self)
+
+    def __repr__(self) -> str:
+        return f'<Scrollback(lines={self.length}, pages={len(self.pages)}, memory={self.memory})>'
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __bool__(self) -> bool:
+        return self.length > 0
+
+    @property
+    def memory(self) -> int:
+        return self.tail_memory + self.pages_memory
+
+    def append(self, line: Line):
+        with self.lock:
+            self.tail.append(line)
+            self.tail_memory += self.codec.size(line)
+            self.length += 1
+            if self.length > self.maxlen:
+                self._drop_oldest()
+            sealed = len(self.tail) >= 2 * self.page_size
+            if sealed:
+                self._seal()
+        if sealed and self.budget:
+            self.budget.enforce()
+
+    def extend(self, lines: Iterable[Line]):
+        for line in lines:
+            self.append(line)
+
+    def pop(self) -> Line:
+        with self.lock:
+            if not self.length:
+                raise IndexError('pop from an empty scrollback')
+            if not self.tail:
+                self._unseal()
+            line = self.tail.pop()
+            self.tail_memory -= self.codec.size(line)
+            self.length -= 1
+            return line
+
+    def __getitem__(self, index: int) -> Line:
+        with self.lock:
+            if index < 0:
+                index += self.length
+            if not 0 <= index < self.length:
+                raise IndexError('scrollback index out of range')
+            in_pages = self.length - len(self.tail)
+            if index >= in_pages:
+                return self.tail[index - in_pages]
+            sequence = self.dropped + index
+            page = self.pages[bisect_right(self.firsts, sequence) - 1]
+            return self._decoded(page)[sequence - page.first]
+
+    def clear(self):
+        with self.lock:
+            self.dropped += self.length
+            self.pages.clear()
+            self.firsts.clear()
+            self.tail.clear()
+            self.tail_memory = self.pages_memory = self.length = 0
+            self._cache = None
+            if self.spill_file:
+                self.spill_file.close()
+                self.spill_file = None
+
+    def close(self):
+        self.clear()
+        if self.budget:
+            self.budget.remove(self)
+
+    def _drop_oldest(self):
+        self.length -= 1
+        self.dropped += 1
+        if not self.pages:
+            self.tail_memory -= self.codec.size(self.tail.popleft())
+            return
+        page = self.pages[0]
+        page.skip += 1
+        if page.skip == page.count:
+            self._remove_page(0)
+
+    def _seal(self):
+        lines = [self.tail.popleft() for _ in range(self.page_size)]
+        self.tail_memory -= sum(self.codec.size(line) for line in lines)
+        data = self.codec.encode(lines)
+        if self.compress:
+            data = zlib.compress(data, COMPRESSION_LEVEL)
+        first = self.pages[-1].first + self.pages[-1].count if self.pages else self.dropped
+        page = Page(first, len(lines), data, len(data))
+        self.pages.append(page)
+        self.firsts.append(page.first)
+        self.pages_memory += page.length
+        self._cache = (page, lines)
+        self._limit_memory()
+
+    def _unseal(self):
+        page = self.pages[-1]
+        lines = self._decoded(page)
+        self._remove_page(len(self.pages) - 1)
+        lines = lines[page.skip:]
+        self.tail.extendleft(reversed(lines))
+        self.tail_memory += sum(self.codec.size(line) for line in lines)
+
+    def _remove_page(self, index: int):
+        page = self.pages.pop(index)
+        self.firsts.pop(index)
+        if page.spilled:
+            self.spill_file.free(page)
+        else:
+            self.pages_memory -= page.length
+        if self._cache and self._cache[0] is page:
+            self._cache = None
+
+    def _decoded(self, page: Page) -> list[Line]:
+        if self._cache and self._cache[0] is page:
+            return self._cache[1]
+        data = self.spill_file.read(page.offset, page.length) if page.spilled else page.data
+        if self.compress:
+            data = zlib.decompress(data)
+        lines = self.codec.decode(data)
+        self._cache = (page, lines)
+        return lines
+
+    def _limit_memory(self):
+        if self.memory_limit is not None:
+            while self.pages_memory + self.tail_memory > self.memory_limit and self.spill_oldest():
+                pass
+
+    def spill_oldest(self) -> int:
+        """
+        Move the oldest page still in memory to the spill file. Returns the number of bytes freed.
+        """
+        with self.lock:
+            page = next((page for page in self.pages if not page.spilled), None)
+            if not page:
+                return 0
+            if not self.spill_file:
+                self.spill_file = SpillFile(self.spill_directory)
+            page.offset = self.spill_file.write(page.data)
+            page.data = None
+            self.pages_memory -= page.length
+            self.spill_file.compact(page for page in self.pages if page.spilled)
+            return page.length
+
+
+class MemoryBudget:
+    """
+    Limit on the memory used by all scrollbacks sharing the budget. While the total is over the limit, pages are
+    spilled from whichever scrollback is using the most.
+    """
+
+    def __init__(self, limit: Optional[int] = DEFAULT_GLOBAL_MEMORY_LIMIT):
+        self.limit = limit
+        self.scrollbacks: weakref.WeakSet[Scrollback[Any]] = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    @property
+    def used(self) -> int:
+        return sum(scrollback.memory for scrollback in list(self.scrollbacks))
+
+    def add(self, scrollback: Scrollback):
+        with self._lock:
+            self.scrollbacks.add(scrollback)
+
+    def remove(self, scrollback: Scrollback):
+        with self._lock:
+            self.scrollbacks.discard(scrollback)
+
+    def enforce(self):
+        if self.limit is None:
+            return
+        with self._lock:
+            used = self.used
+            candidates = sorted(self.scrollbacks, key=lambda s: s.pages_memory, reverse=True)
+            for scrollback in candidates:
+                while used > self.limit and (freed := scrollback.spill_oldest()):
+                    used -= freed
+                if used <= self.limit:
+                    break
+
+
+memory_budget = MemoryBudget()
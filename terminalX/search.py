@@ -0,0 +1,257 @@
+"""
+Full text search over the output of a session.
+
+Output is split into lines with escape sequences removed. Lines are grouped into blocks and each block is indexed by
+the trigrams (three character substrings) of the distinct words it contains, lowercased. A regex is only run over the
+blocks which contain every trigram of the literal text the pattern requires, and over the lines which haven't filled a
+block yet.
+"""
+
+from array import array
+import codecs
+import re
+import threading
+from typing import Iterator, NamedTuple, Optional
+
+from .recording import OUTPUT, RecordingReader
+from .types import File
+
+
+BLOCK_LINES = 32
+DEFAULT_MAX_LINES = 100000
+MAX_LINE_LENGTH = 65536         # Output without line breaks, such as from full screen programs, is split here
+
+ESCAPE_SEQUENCE = re.compile(
+    r'\x1b(?:\[[0-?]*[ -/]*[@-~]'                   # CSI, such as colours and cursor movement
+    r'|\][^\x07\x1b\n]*(?:\x07|\x1b\\)?'            # OSC, such as window titles
+    r'|[()*+][0-9A-Za-z]'                           # Character set selection
+    r'|[ -/]*[0-~])'                                # Anything else
+    r'|[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]'            # Control characters other than tab, CR and LF
+)
+LINE_END_RETURNS = re.compile(r'\r+$', re.MULTILINE)
+WORD = re.compile(r'\S{3,}')
+META_CHARACTERS = set('.^$*+?{}[]()\\|')
+
+
+class SearchNotEnabled(BaseException):
+    message = "Output isn't being indexed. Set index_output on the Client before opening the shell"
+
+
+class SearchMatch(NamedTuple):
+    line: int           # Number of the line in the session's output, from 0
+    start: int          # Columns of the match in the line
+    end: int
+    text: str           # The whole line
+
+
+def clean_lines(text: str) -> list[str]:
+    """
+    Lines of output as they would most likely look: without escape sequences and, where a line was overwritten after
+    a carriage return, only the last text written
+    """
+    lines = LINE_END_RETURNS.sub('', ESCAPE_SEQUENCE.sub('', text)).split('\n')
+    if '\r' in text:
+        lines = [line.rsplit('\r', 1)[-1] for line in lines]
+    return lines
+
+
+def trigrams(text: str) -> set[str]:
+    """
+    Trigrams within each word of text. Any literal text a line contains has a subset of that line's trigrams.
+    """
+    return {word[i:i + 3] for word in set(WORD.findall(text.lower())) for i in range(len(word) - 2)}
+
+
+def _skip_group(pattern: str, i: int) -> int:
+    """
+    Index after the group, set or repeat count starting at pattern[i]
+    """
+    if pattern[i] == '{':
+        end = pattern.find('}', i)
+        return end + 1 if end >= 0 else len(pattern)
+    if pattern[i] == '[':
+        i += 1
+        if pattern[i:i + 1] == '^':
+            i += 1
+        if pattern[i:i + 1] == ']':
+            i += 1          # A ] straight after the opening bracket is part of the set
+        while i < len(pattern) and pattern[i] != ']':
+            i += 2 if pattern[i] == '\\' else 1
+        return i + 1
+    depth = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == '\\':
+            i += 2
+            continue
+        if char == '[':
+            i = _skip_group(pattern, i)
+            continue
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+            if not depth:
+                return i + 1
+        i += 1
+    return i
+
+
+def required_literals(pattern: re.Pattern) -> list[str]:
+    """
+    Runs of literal text which any match of pattern must contain. Returns nothing when that can't be easily worked
+    out, such as for patterns with alternatives.
+    """
+    source = pattern.pattern
+    if not isinstance(source, str) or '|' in source or pattern.flags & re.VERBOSE:
+        return []
+    literals, run, i = [], [], 0
+    while i < len(source):
+        char = source[i]
+        if char in '*?{':
+            if run:
+                run.pop()       # The character before is optional
+            if char == '{':
+                i = _skip_group(source, i) - 1
+            char = None
+        elif char == '\\':
+            escaped = source[i + 1:i + 2]
+            char = escaped if escaped and not escaped.isalnum() else None
+            i += 1
+        elif char in '([':
+            i = _skip_group(source, i) - 1
+            char = None
+        elif char in META_CHARACTERS:
+            char = None
+        if char is None:
+            literals.append(''.join(run))
+            run = []
+        else:
+            run.append(char)
+        i += 1
+    literals.append(''.join(run))
+    return [literal for literal in literals if len(literal) >= 3]
+
+
+class OutputIndex:
+    """
+    Lines of a session's output with a trigram index, fed text as it is received.
+
+    Complete blocks of BLOCK_LINES lines are indexed when they are filled, so the cost of indexing is one set of
+    trigrams per block. Once there are more than max_lines lines, the oldest blocks are dropped.
+
+    feed and search can be called from different threads. search only holds the lock while it gathers the text to
+    search, so a slow regex doesn't hold up the output being fed in.
+    """
+
+    def __init__(self, max_lines: int = DEFAULT_MAX_LINES):
+        self.max_blocks = max(1, max_lines // BLOCK_LINES)
+        self.blocks: list[str] = []         # Text of each indexed block, its lines joined by line feeds
+        self.first_block = 0                # Number of the oldest block still kept
+        self.postings: dict[str, array] = {}
+        self.lines: list[str] = []          # Lines which haven't filled a block yet
+        self.pending = ''                   # The line currently being received
+        self.lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f'<OutputIndex(lines={len(self)})>'
+
+    def __len__(self) -> int:
+        """
+        Number of the next line, including any which have been dropped
+        """
+        return (self.first_block + len(self.blocks)) * BLOCK_LINES + len(self.lines)
+
+    def feed(self, text: str):
+        with self.lock:
+            self._feed(text)
+
+    def _feed(self, text: str):
+        if '\n' not in text and len(self.pending) + len(text) <= MAX_LINE_LENGTH:
+            self.pending += text
+            return
+        text = self.pending + text
+        end = text.rfind('\n')
+        self.pending = text[end + 1:]
+        lines = clean_lines(text[:end]) if end >= 0 else []
+        while len(self.pending) > MAX_LINE_LENGTH:
+            lines.extend(clean_lines(self.pending[:MAX_LINE_LENGTH]))
+            self.pending = self.pending[MAX_LINE_LENGTH:]
+        self.lines.extend(lines)
+        while len(self.lines) >= BLOCK_LINES:
+            self._add_block('\n'.join(self.lines[:BLOCK_LINES]))
+            del self.lines[:BLOCK_LINES]
+
+    def _add_block(self, text: str):
+        number = self.first_block + len(self.blocks)
+        self.blocks.append(text)
+        for trigram in trigrams(text):
+            if (posting := self.postings.get(trigram)) is None:
+                posting = self.postings[trigram] = array('I')
+            posting.append(number)
+        if len(self.blocks) > self.max_blocks:
+            dropped = len(self.blocks) - self.max_blocks
+            del self.blocks[:dropped]
+            self.first_block += dropped
+            if self.first_block % self.max_blocks == 0:
+                self._reindex()     # Remove dropped blocks from the postings now and again
+
+    def _reindex(self):
+        self.postings.clear()
+        for number, text in enumerate(self.blocks, self.first_block):
+            for trigram in trigrams(text):
+                self.postings.setdefault(trigram, array('I')).append(number)
+
+    def candidate_blocks(self, pattern: re.Pattern) -> Iterator[int]:
+        """
+        Numbers of the blocks which may contain a match, in order
+        """
+        required = set().union(*(trigrams(literal) for literal in required_literals(pattern)))
+        if not required:
+            yield from range(self.first_block, self.first_block + len(self.blocks))
+            return
+        postings = [self.postings.get(trigram) for trigram in required]
+        if not all(postings):
+            return
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates.intersection_update(posting)
+        yield from sorted(number for number in candidates if number >= self.first_block)
+
+    def search(self, pattern: str | re.Pattern, flags: int = 0, limit: Optional[int] = None) -> list[SearchMatch]:
+        """
+        Find matches for a regex in the output, oldest first. ^ and $ match at the start and end of each line.
+        """
+        pattern = re.compile(pattern, flags | re.MULTILINE) if isinstance(pattern, str) else pattern
+        matches = []
+        with self.lock:
+            sections = [(number * BLOCK_LINES, self.blocks[number - self.first_block])
+                        for number in self.candidate_blocks(pattern)]
+            unindexed = self.lines + clean_lines(self.pending) if self.pending else self.lines
+            if unindexed:
+                sections.append((len(self) - len(self.lines), '\n'.join(unindexed)))
+        for first_line, text in sections:
+            for match in pattern.finditer(text):
+                line_start = text.rfind('\n', 0, match.start()) + 1
+                line_end = text.find('\n', line_start)
+                line = text[line_start:line_end if line_end >= 0 else len(text)]
+                matches.append(SearchMatch(first_line + text.count('\n', 0, line_start), match.start() - line_start,
+                                           match.end() - line_start, line))
+                if limit and len(matches) >= limit:
+                    return matches
+        return matches
+
+
+def index_recording(path: File, encoding: str = 'utf-8', max_lines: int = DEFAULT_MAX_LINES) -> OutputIndex:
+    """
+    Index the output in a recording
+    """
+    index = OutputIndex(max_lines)
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    with RecordingReader(path, encoding) as reader:
+        for event in reader:
+            if event.kind == OUTPUT:
+                index.feed(decoder.decode(event.data))
+    index.feed(decoder.decode(b'', final=True))
+    return index
@@ -0,0 +1,490 @@
+"""
+Parallel, pipelined SFTP transfers of files and directory trees.
+
+Files are split into ranges which are transferred concurrently over several SFTP channels, which can be on one
+transport or on several. Within each range many read or write requests are kept in flight at once so throughput on
+high latency links is limited by bandwidth rather than by a round trip per request.
+
+Local regular files are read and written through memory maps of one window of requests at a time, so uploads send
+memoryview slices of the file without copying them into bytes objects first and memory use doesn't grow with the
+size of the file.
+"""
+
+from contextlib import contextmanager
+import json
+import logging
+import mmap
+import os
+import posixpath
+import queue
+import stat
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import BinaryIO, Callable, Iterator, Optional
+
+import paramiko
+
+from .types import File
+
+
+logger = logging.getLogger(__name__)
+
+
+CHUNK_SIZE = 32768                      # Largest read or write paramiko sends in a single SFTP request
+DEFAULT_MAX_REQUESTS = 64
+DEFAULT_MIN_RANGE_SIZE = 8 * 1024 * 1024
+RESUME_SUFFIX = '.partial'
+JOURNAL_BYTES = 64 * 1024 * 1024        # The journal is saved after this much more of a file has been transferred
+JOURNAL_INTERVAL = 10                   # or after this many seconds, whichever comes first
+
+ProgressCallback = Callable[[str, int, int], None]
+
+
+@dataclass
+class Range:
+    start: int                          # Next offset to transfer, moved on as data is written
+    end: int
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+
+@dataclass
+class FileTransfer:
+    source: str
+    dest: str
+    size: int
+    mtime: int
+    atime: int
+    ranges: list[Range] = field(default_factory=list)
+    transferred: int = 0
+    journal: bool = False               # Progress is recorded so the transfer can be resumed if it fails
+    regular: bool = True                # Local end is a regular file which can be mapped, seeked and resized
+    journaled: int = 0                  # Bytes transferred when the journal was last saved
+    journaled_at: float = field(default_factory=time.monotonic)
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def state(self) -> dict:
+        return {'size': self.size, 'mtime': self.mtime,
+                'ranges': [[r.start, r.end] for r in self.ranges if len(r)]}
+
+    def checkpoint(self) -> dict:
+        """
+        The state to save in the journal, noting that it has been saved. Call with the lock held.
+        """
+        self.journaled = self.transferred
+        self.journaled_at = time.monotonic()
+        return self.state()
+
+    def journal_due(self) -> bool:
+        with self.lock:
+            return self.journal and (self.transferred - self.journaled >= JOURNAL_BYTES or
+                                     time.monotonic() - self.journaled_at >= JOURNAL_INTERVAL)
+
+
+def split_ranges(size: int, parts: int, min_range_size: int) -> list[Range]:
+    """
+    Split size bytes into at most parts ranges of at least min_range_size bytes, aligned to the request size
+    """
+    if not size:
+        return [Range(0, 0)]
+    parts = max(1, min(parts, size // max(min_range_size, 1)))
+    range_size = -(-size // parts)
+    range_size += -range_size % CHUNK_SIZE
+    return [Range(start, min(start + range_size, size)) for start in range(0, size, range_size)]
+
+
+def window_length(window: list[tuple[int, int]]) -> int:
+    return window[-1][0] + window[-1][1] - window[0][0]
+
+
+def windows(rng: Range, max_requests: int) -> Iterator[list[tuple[int, int]]]:
+    """
+    Split the remainder of a range into lists of (offset, length) requests, max_requests at a time
+    """
+    window = []
+    for offset in range(rng.start, rng.end, CHUNK_SIZE):
+        window.append((offset, min(CHUNK_SIZE, rng.end - offset)))
+        if len(window) == max_requests:
+            yield window
+            window = []
+    if window:
+        yield window
+
+
+def preallocate(f: BinaryIO, size: int):
+    """
+    Set the size of a new file, reserving disk space for all of it where the platform and filesystem allow, so running
+    out of space is found before transferring rather than part way through
+    """
+    f.truncate(size)
+    if size and hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(f.fileno(), 0, size)
+        except OSError:
+            pass        # Not supported by the filesystem, the file is left sparse
+
+
+@contextmanager
+def mapped(f: BinaryIO, offset: int, length: int, writable: bool) -> Iterator[memoryview]:
+    """
+    Map length bytes of a regular file from offset, returning a memoryview of them
+    """
+    aligned = offset - offset % mmap.ALLOCATIONGRANULARITY
+    access = mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ
+    mm = mmap.mmap(f.fileno(), length + offset - aligned, access=access, offset=aligned)
+    view = memoryview(mm)
+    window = view[offset - aligned:]
+    failed = False
+    try:
+        yield window
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        window.release()
+        view.release()
+        try:
+            mm.close()
+        except BufferError:
+            if not failed:
+                raise
+            # Slices made by whatever failed are still referenced by the traceback, the map is unmapped once they
+            # are freed rather than hiding the error
+
+
+def _release(data: Optional[bytes | memoryview]):
+    if isinstance(data, memoryview):
+        data.release()
+
+
+class SFTPTransfer:
+    """
+    Transfer files and directory trees over a set of SFTP channels.
+
+    Every channel is used by one worker thread at a time. Files of at least min_range_size bytes are split into
+    ranges to be transferred over several channels at once, and up to max_requests reads or writes are kept in flight
+    per channel. Directory trees transfer many files at the same time the same way.
+
+    progress is called with the source path, bytes transferred so far and file size each time more of a file has been
+    transferred. It is called from the worker threads.
+
+    If resume is True, a transfer of a large file which fails part of the way through leaves a journal of the ranges
+    still to be done next to the destination, which the next transfer of the same unchanged file continues from.
+    The journal is updated as the transfer goes too, so most of the progress is kept even if the process is killed.
+    Files which have already been transferred with the same size and modification time are skipped.
+
+    Local regular files are accessed with mmap unless use_mmap is False. Downloaded files are created at their full
+    size before any data is written and if preallocate is True disk space is reserved for them too. Anything which
+    isn't a regular file, such as a pipe or device, is read or written sequentially over a single channel.
+    """
+
+    def __init__(self, sftp_clients: list[paramiko.SFTPClient], max_requests: int = DEFAULT_MAX_REQUESTS,
+                 min_range_size: int = DEFAULT_MIN_RANGE_SIZE, progress: ProgressCallback = None,
+                 resume: bool = True, preserve_times: bool = True, use_mmap: bool = True, preallocate: bool = True):
+        if not sftp_clients:
+            raise ValueError('At least one SFTP client is needed')
+        self.sftp_clients = sftp_clients
+        self.max_requests = max_requests
+        self.min_range_size = min_range_size
+        self.progress = progress
+        self.resume = resume
+        self.preserve_times = preserve_times
+        self.use_mmap = use_mmap
+        self.preallocate = preallocate
+        self._available: queue.Queue[paramiko.SFTPClient] = queue.Queue()
+        for sftp in sftp_clients:
+            self._available.put(sftp)
+        self._executor = ThreadPoolExecutor(len(sftp_clients), thread_name_prefix='terminalX-sftp')
+
+    @property
+    def sftp(self) -> paramiko.SFTPClient:
+        return self.sftp_clients[0]
+
+    def _update_progress(self, transfer: FileTransfer, rng: Range, count: int):
+        with transfer.lock:
+            rng.start += count
+            transfer.transferred += count
+            transferred = transfer.transferred
+        if self.progress:
+            self.progress(transfer.source, transferred, transfer.size)
+
+    def _run(self, transfers: list[FileTransfer], worker: Callable[[paramiko.SFTPClient, FileTransfer, Range], None],
+             finish: Callable[[FileTransfer, bool], None]):
+        futures: dict[Future, FileTransfer] = {}
+        for transfer in transfers:
+            for rng in transfer.ranges:
+                futures[self._executor.submit(self._with_channel, worker, transfer, rng)] = transfer
+        wait(futures)
+        errors: dict[int, BaseException] = {}
+        for future, transfer in futures.items():
+            if future.exception():
+                errors.setdefault(id(transfer), future.exception())
+        for transfer in transfers:
+            finish(transfer, id(transfer) not in errors)
+        for error in errors.values():
+            raise error
+
+    def _with_channel(self, worker: Callable[[paramiko.SFTPClient, FileTransfer, Range], None],
+                      transfer: FileTransfer, rng: Range):
+        sftp = self._available.get()
+        try:
+            worker(sftp, transfer, rng)
+        finally:
+            self._available.put(sftp)
+
+    def _plan(self, source: str, dest: str, attrs: os.stat_result | paramiko.SFTPAttributes,
+              journal: Optional[dict], dest_attrs: os.stat_result | paramiko.SFTPAttributes | None,
+              regular: bool = True) -> FileTransfer:
+        transfer = FileTransfer(source, dest, attrs.st_size, int(attrs.st_mtime), int(attrs.st_atime),
+                                regular=regular)
+        if not regular:
+            transfer.ranges = [Range(0, transfer.size)]
+            return transfer
+        transfer.journal = self.resume and transfer.size >= self.min_range_size
+        if self.resume and dest_attrs:
+            if journal and journal.get('size') == transfer.size and journal.get('mtime') == transfer.mtime and \
+                    dest_attrs.st_size == transfer.size:
+                transfer.ranges = [Range(start, end) for start, end in journal['ranges']]
+                transfer.transferred = transfer.size - sum(len(r) for r in transfer.ranges)
+                logger.info('Resuming transfer of %s to %s, %s of %s bytes done', source, dest,
+                            transfer.transferred, transfer.size)
+                return transfer
+            if not journal and dest_attrs.st_size == transfer.size and int(dest_attrs.st_mtime) == transfer.mtime:
+                logger.debug('%s is already up to date', dest)
+                transfer.transferred = transfer.size
+                return transfer
+        transfer.ranges = split_ranges(transfer.size, len(self.sftp_clients), self.min_range_size)
+        return transfer
+
+    # Downloads
+
+    def _get_plan(self, remotepath: str, localpath: str, attrs: paramiko.SFTPAttributes) -> FileTransfer:
+        journal_path = Path(localpath + RESUME_SUFFIX)
+        journal = None
+        if self.resume and journal_path.exists():
+            try:
+                journal = json.loads(journal_path.read_text())
+            except ValueError:
+                pass
+        try:
+            dest_attrs = os.stat(localpath)
+        except FileNotFoundError:
+            dest_attrs = None
+        regular = not dest_attrs or stat.S_ISREG(dest_attrs.st_mode)
+        transfer = self._plan(remotepath, localpath, attrs, journal, dest_attrs, regular)
+        if regular and transfer.ranges and not transfer.transferred:
+            with open(localpath, 'wb') as f:
+                if self.preallocate:
+                    preallocate(f, transfer.size)
+                else:
+                    f.truncate(transfer.size)
+            self._save_local_journal(transfer)
+        return transfer
+
+    def _save_local_journal(self, transfer: FileTransfer):
+        if transfer.journal:
+            with transfer.lock:
+                Path(transfer.dest + RESUME_SUFFIX).write_text(json.dumps(transfer.checkpoint()))
+
+    def _get_range(self, sftp: paramiko.SFTPClient, transfer: FileTransfer, rng: Range):
+        mode = 'r+b' if transfer.regular else 'wb'
+        with sftp.open(transfer.source, 'rb') as remote, open(transfer.dest, mode) as local:
+            for window in windows(rng, self.max_requests):
+                if transfer.journal_due():
+                    self._save_local_journal(transfer)
+                offset = window[0][0]
+                if transfer.regular and self.use_mmap:
+                    with mapped(local, offset, window_length(window), writable=True) as view:
+                        position = 0
+                        for data in remote.readv(window):
+                            view[position:position + len(data)] = data
+                            position += len(data)
+                            self._update_progress(transfer, rng, len(data))
+                    continue
+                if transfer.regular:
+                    local.seek(offset)
+                for data in remote.readv(window):
+                    local.write(data)
+                    self._update_progress(transfer, rng, len(data))
+        self._save_local_journal(transfer)
+
+    def _get_finished(self, transfer: FileTransfer, success: bool):
+        journal_path = Path(transfer.dest + RESUME_SUFFIX)
+        if not success:
+            try:
+                self._save_local_journal(transfer)
+            except OSError:     # Don't hide why the transfer failed
+                logger.exception('Failed to save the progress of %s', transfer.dest)
+            return
+        journal_path.unlink(missing_ok=True)
+        if self.preserve_times and transfer.regular:
+            os.utime(transfer.dest, (transfer.atime, transfer.mtime))
+
+    def get(self, remotepath: str, localpath: File):
+        """
+        Download one file
+        """
+        self._run([self._get_plan(remotepath, str(localpath), self.sftp.stat(remotepath))],
+                  self._get_range, self._get_finished)
+
+    def _walk_remote(self, remotepath: str) -> Iterator[tuple[str, paramiko.SFTPAttributes]]:
+        for attrs in self.sftp.listdir_attr(remotepath):
+            path = posixpath.join(remotepath, attrs.filename)
+            if stat.S_ISLNK(attrs.st_mode):
+                try:
+                    attrs = self.sftp.stat(path)
+                except FileNotFoundError:
+                    logger.warning('Skipping broken link %s', path)
+                    continue
+            yield path, attrs
+            if stat.S_ISDIR(attrs.st_mode):
+                yield from self._walk_remote(path)
+
+    def get_tree(self, remotepath: str, localpath: File):
+        """
+        Download a directory and everything in it, creating localpath if needed
+        """
+        localpath = Path(localpath)
+        localpath.mkdir(parents=True, exist_ok=True)
+        transfers = []
+        for path, attrs in self._walk_remote(remotepath):
+            dest = localpath.joinpath(*posixpath.relpath(path, remotepath).split('/'))
+            if stat.S_ISDIR(attrs.st_mode):
+                dest.mkdir(exist_ok=True)
+            elif stat.S_ISREG(attrs.st_mode):
+                transfers.append(self._get_plan(path, str(dest), attrs))
+        self._run(transfers, self._get_range, self._get_finished)
+
+    # Uploads
+
+    def _remote_stat(self, path: str) -> Optional[paramiko.SFTPAttributes]:
+        try:
+            return self.sftp.stat(path)
+        except FileNotFoundError:
+            return None
+
+    def _put_plan(self, localpath: str, remotepath: str, attrs: os.stat_result) -> FileTransfer:
+        journal_path = remotepath + RESUME_SUFFIX
+        journal = None
+        dest_attrs = self._remote_stat(remotepath)
+        if self.resume and dest_attrs and self._remote_stat(journal_path):
+            try:
+                with self.sftp.open(journal_path, 'r') as f:
+                    journal = json.loads(f.read())
+            except ValueError:
+                pass
+        transfer = self._plan(localpath, remotepath, attrs, journal, dest_attrs, stat.S_ISREG(attrs.st_mode))
+        if transfer.ranges and not transfer.transferred:
+            with self.sftp.open(remotepath, 'wb') as f:
+                f.truncate(transfer.size)
+            self._save_remote_journal(self.sftp, transfer)
+        return transfer
+
+    def _save_remote_journal(self, sftp: paramiko.SFTPClient, transfer: FileTransfer):
+        if transfer.journal:
+            with transfer.lock, sftp.open(transfer.dest + RESUME_SUFFIX, 'w') as f:
+                f.write(json.dumps(transfer.checkpoint()))
+
+    def _put_window(self, remote: paramiko.SFTPFile, chunks: Iterator[bytes | memoryview]):
+        """
+        Send a window of writes without waiting for each to be acknowledged, then wait for all of them
+        """
+        remote.set_pipelined(True)
+        data = last = None
+        try:
+            for data in chunks:
+                if last is not None:
+                    remote.write(last)
+                    _release(last)
+                last = data
+            remote.set_pipelined(False)     # An unpipelined write waits for all earlier ones to be acknowledged too
+            if last is not None:
+                remote.write(last)
+        finally:
+            # Views of a map left in the traceback would stop it closing, hiding the error with a BufferError
+            _release(data)
+            _release(last)
+
+    def _put_range(self, sftp: paramiko.SFTPClient, transfer: FileTransfer, rng: Range):
+        if not transfer.regular:
+            return self._put_stream(sftp, transfer, rng)
+        with open(transfer.source, 'rb') as local, sftp.open(transfer.dest, 'r+b', bufsize=0) as remote:
+            for window in windows(rng, self.max_requests):
+                if transfer.journal_due():
+                    self._save_remote_journal(sftp, transfer)
+                offset = window[0][0]
+                length = window_length(window)
+                remote.seek(offset)
+                if self.use_mmap:
+                    with mapped(local, offset, length, writable=False) as view:
+                        self._put_window(remote, (view[o - offset:o - offset + n] for o, n in window))
+                else:
+                    local.seek(offset)
+                    self._put_window(remote, (local.read(n) for o, n in window))
+                self._update_progress(transfer, rng, length)
+        self._save_remote_journal(sftp, transfer)
+
+    def _put_stream(self, sftp: paramiko.SFTPClient, transfer: FileTransfer, rng: Range):
+        with open(transfer.source, 'rb') as local, sftp.open(transfer.dest, 'wb', bufsize=0) as remote:
+            while data := local.read(CHUNK_SIZE * self.max_requests):
+                view = memoryview(data)
+                self._put_window(remote, (view[i:i + CHUNK_SIZE] for i in range(0, len(data), CHUNK_SIZE)))
+                self._update_progress(transfer, rng, len(data))
+
+    def _put_finished(self, transfer: FileTransfer, success: bool):
+        if not success:
+            try:
+                self._save_remote_journal(self.sftp, transfer)
+            except (OSError, paramiko.SSHException):    # Don't hide why the transfer failed
+                logger.exception('Failed to save the progress of %s', transfer.dest)
+            return
+        if transfer.journal:
+            try:
+                self.sftp.remove(transfer.dest + RESUME_SUFFIX)
+            except FileNotFoundError:
+                pass
+        if self.preserve_times:
+            self.sftp.utime(transfer.dest, (transfer.atime, transfer.mtime))
+
+    def put(self, localpath: File, remotepath: str):
+        """
+        Upload one file
+        """
+        localpath = str(localpath)
+        self._run([self._put_plan(localpath, remotepath, os.stat(localpath))], self._put_range, self._put_finished)
+
+    def _remote_mkdir(self, path: str):
+        if not self._remote_stat(path):
+            self.sftp.mkdir(path)
+
+    def put_tree(self, localpath: File, remotepath: str):
+        """
+        Upload a directory and everything in it, creating remotepath if needed
+        """
+        self._remote_mkdir(remotepath)
+        transfers = []
+        for root, dirs, files in os.walk(localpath):
+            remote_root = posixpath.join(remotepath, *Path(os.path.relpath(root, localpath)).parts)
+            for name in dirs:
+                self._remote_mkdir(posixpath.join(remote_root, name))
+            for name in files:
+                path = os.path.join(root, name)
+                attrs = os.stat(path)
+                if stat.S_ISREG(attrs.st_mode):
+                    transfers.append(self._put_plan(path, posixpath.join(remote_root, name), attrs))
+        self._run(transfers, self._put_range, self._put_finished)
+
+    def close(self):
+        self._executor.shutdown()
+        for sftp in self.sftp_clients:
+            sftp.close()
+
+    def __enter__(self) -> 'SFTPTransfer':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,213 @@
+"""
+Bandwidth limits for relayed connections.
+
+A Scheduler hands out the bytes relays may read. Each Share of it, such as one per SOCKS user or tunnel, can have its
+own rate limit, and the Scheduler can have a total rate which all shares compete for. When the total is used up,
+shares are served fairly, as in start-time fair queuing: a share which has been granted more than a quantum beyond
+the share which has been granted least, each counted in proportion to its weight, is refused until the others catch
+up. Shares which haven't asked for anything recently, or which are held back by their own rate, don't count and catch
+up to the others when they next ask, rather than being owed what they didn't use.
+
+A Scheduler can itself be limited by a share of another Scheduler, its parent, so a SOCKS proxy's users divide what
+the proxy is given by the Client's scheduler.
+"""
+
+import threading
+import time
+
+from .types import TrafficPriority
+
+
+DEFAULT_QUANTUM = 32768         # Most bytes granted at once, so no share gets far ahead of the others
+MIN_GRANT = 4096                # Wait until at least this much can be granted before trying again
+MIN_DELAY = 0.005
+ACTIVE_WINDOW = 0.25            # Seconds since a share last asked for it to be counted in the fair share
+
+PRIORITY_WEIGHTS: dict[TrafficPriority, int] = {
+    "interactive": 8,
+    "x11": 4,
+    "tunnel": 2,
+    "bulk": 1,
+}
+
+
+class TokenBucket:
+    """
+    Allows rate bytes a second on average, and bursts of up to burst bytes. Not thread-safe by itself.
+    """
+
+    def __init__(self, rate: float, burst: float = None):
+        self.rate = rate
+        self.burst = burst or max(rate, DEFAULT_QUANTUM)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def __repr__(self) -> str:
+        return f'<TokenBucket(rate={self.rate}, tokens={int(self.tokens)})>'
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self, now: float = None) -> int:
+        self._refill(now or time.monotonic())
+        return int(self.tokens)
+
+    def take(self, n: int, now: float = None) -> int:
+        """
+        Take up to n tokens, returning how many were taken
+        """
+        taken = min(n, self.available(now))
+        self.tokens -= taken
+        return max(taken, 0)
+
+    def charge(self, n: int):
+        """
+        Take n tokens even if there aren't that many, so what is taken next has to wait for them
+        """
+        self.tokens -= n
+
+    def give_back(self, n: int):
+        self.tokens = min(self.burst, self.tokens + n)
+
+    def delay(self, n: int, now: float = None) -> float:
+        """
+        Seconds until n tokens will be available
+        """
+        self._refill(now or time.monotonic())
+        return max(0.0, (min(n, self.burst) - self.tokens) / self.rate)
+
+
+class Share:
+    """
+    One user's part of a Scheduler. grant is called before each read and give_back with anything not read.
+    Traffic which mustn't wait, such as keystrokes, is charged instead so everything else makes room for it.
+    Safe to use from any thread.
+    """
+
+    def __init__(self, scheduler: 'Scheduler', name: str, rate: float = None, burst: float = None, weight: int = 1):
+        self.scheduler = scheduler
+        self.name = name
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.weight = weight
+        self.served = 0             # Bytes granted while competing with other shares
+        self.last_active = 0.0
+        self.capped = False         # Its own rate was what limited the last grant
+
+    def __repr__(self) -> str:
+        return f'<Share({self.name!r}, weight={self.weight}, served={self.served})>'
+
+    @property
+    def virtual_time(self) -> float:
+        return self.served / self.weight
+
+    def _catch_up(self, now: float):
+        if self.capped or now - self.last_active > ACTIVE_WINDOW:
+            self.served = max(self.served, self.scheduler._least_virtual_time(now) * self.weight)
+
+    def grant(self, n: int) -> int:
+        """
+        How much of n bytes may be read now, 0 if reading should wait for delay seconds
+        """
+        scheduler = self.scheduler
+        with scheduler.lock:
+            now = time.monotonic()
+            self._catch_up(now)
+            self.last_active = now
+            n = min(n, scheduler.quantum)
+            if self.bucket:
+                available = self.bucket.available(now)
+                self.capped = available < n
+                n = min(n, available)
+            if scheduler.bucket and n > 0:
+                if self.virtual_time > scheduler._least_virtual_time(now) + scheduler.quantum:
+                    return 0
+                n = min(n, scheduler.bucket.available(now))
+        if n > 0 and scheduler.parent:
+            n = scheduler.parent.grant(n)
+        if n <= 0:
+            return 0
+        with scheduler.lock:
+            self._charge(n)
+        return n
+
+    def _charge(self, n: int):
+        for bucket in (self.bucket, self.scheduler.bucket):
+            if bucket:
+                bucket.charge(n)
+        if self.scheduler.bucket:
+            self.served += n
+
+    def charge(self, n: int):
+        """
+        Count n bytes which have been sent without asking. The share doesn't become active, as it never waits for the
+        others to catch up with it.
+        """
+        with self.scheduler.lock:
+            self._catch_up(time.monotonic())
+            self._charge(n)
+        if self.scheduler.parent:
+            self.scheduler.parent.charge(n)
+
+    def give_back(self, n: int):
+        if n <= 0:
+            return
+        with self.scheduler.lock:
+            if self.bucket:
+                self.bucket.give_back(n)
+            if self.scheduler.bucket:
+                self.scheduler.bucket.give_back(n)
+                self.served -= n
+        if self.scheduler.parent:
+            self.scheduler.parent.give_back(n)
+
+    def delay(self) -> float:
+        """
+        Seconds to wait after being refused before asking again
+        """
+        with self.scheduler.lock:
+            now = time.monotonic()
+            buckets = [bucket for bucket in (self.bucket, self.scheduler.bucket) if bucket]
+            delay = max([MIN_DELAY] + [bucket.delay(MIN_GRANT, now) for bucket in buckets])
+        if self.scheduler.parent:
+            delay = max(delay, self.scheduler.parent.delay())
+        return delay
+
+
+class Scheduler:
+    """
+    Shares rate bytes a second fairly between its shares, or just applies the limits of each share if rate is None.
+    Everything granted is also limited by parent, if there is one.
+    """
+
+    def __init__(self, rate: float = None, burst: float = None, quantum: int = DEFAULT_QUANTUM,
+                 parent: Share = None):
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.quantum = quantum
+        self.parent = parent
+        self.shares: set[Share] = set()
+        self.lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f'<Scheduler(shares={len(self.shares)}, bucket={self.bucket})>'
+
+    def share(self, name: str, rate: float = None, burst: float = None, weight: int = 1) -> Share:
+        share = Share(self, name, rate, burst, weight)
+        with self.lock:
+            self.shares.add(share)
+        return share
+
+    def remove(self, share: Share):
+        with self.lock:
+            self.shares.discard(share)
+
+    def priority_share(self, name: str, priority: TrafficPriority, rate: float = None, burst: float = None) -> Share:
+        """
+        A share weighted for its priority class, so interactive traffic is served before X11, tunnels and bulk
+        """
+        return self.share(name, rate, burst, PRIORITY_WEIGHTS[priority])
+
+    def _least_virtual_time(self, now: float) -> float:
+        active = [share.virtual_time for share in self.shares
+                  if now - share.last_active <= ACTIVE_WINDOW and not share.capped]
+        return min(active, default=0)
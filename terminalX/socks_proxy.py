@@ -21,18 +21,31 @@ SOCKS5 server implementation.
 """
 
 from errno import ECONNREFUSED, EHOSTUNREACH, ENETDOWN, ENETUNREACH
+from functools import partial
 
-import select
+import hmac
+import os
+import selectors
 import socket
 import struct
 import threading
+from typing import Container, NamedTuple, Optional
 
 from socketserver import StreamRequestHandler, ThreadingTCPServer
 
+import paramiko
 from paramiko.common import DEBUG, asbytes
 from paramiko.py3compat import BytesIO, byte_chr, byte_ord, u
-from paramiko.ssh_exception import NoValidConnectionsError
-from .paramiko_util import families_and_addresses, ip_addr_to_str
+from paramiko.ssh_exception import NoValidConnectionsError, SSHException
+from .event_loop import EventLoop
+from .executors import executor
+from .happy_eyeballs import CONNECTION_ATTEMPT_DELAY, DEFAULT_OPEN_TIMEOUT, ChannelOpener, open_channel
+from .hashing import verify_hash
+from .paramiko_util import dns_cache, families_and_addresses, ip_addr_to_str, remote_listeners, with_port
+from .relay import DEFAULT_BUFFER_SIZE, Relay, relay
+from .shaping import Scheduler, Share
+from .socks_udp import UDPAssociation, UDPChannel, helper_command
+from .types import SOCKSUser
 from paramiko.util import (
     get_logger,
     ClosingContextManager
@@ -42,10 +55,17 @@ from paramiko.util import (
 SOCKS5_VERSION = 0x05
 
 SOCKS5_CMD_CONNECT = 0x01
+SOCKS5_CMD_BIND = 0x02
+SOCKS5_CMD_UDP_ASSOCIATE = 0x03
 
 SOCKS5_NO_AUTH_REQUIRED = 0x00
+SOCKS5_USERNAME_PASSWORD = 0x02
 SOCKS5_NO_ACCEPTABLE_METHOD = 0xff
 
+SOCKS5_AUTH_VERSION = 0x01      # Of the username/password negotiation in RFC 1929
+SOCKS5_AUTH_SUCCEEDED = 0x00
+SOCKS5_AUTH_FAILED = 0x01
+
 SOCKS5_ATYP_IPV4 = 0x01
 SOCKS5_ATYP_DOMAINNAME = 0x03
 SOCKS5_ATYP_IPV6 = 0x04
@@ -62,6 +82,258 @@ SOCKS5_TTL_EXPIRED = 0x06
 SOCKS5_COMMAND_NOT_SUPPORTED = 0x07
 SOCKS5_ADDRESS_TYPE_NOT_SUPPORTED = 0x08
 
+SOCKS5_REQUEST_HEADER = struct.Struct("!BBBB")     # Version, command, reserved, address type
+SOCKS5_PORT = struct.Struct("!H")
+
+HANDSHAKE_TIMEOUT = 30          # Seconds a client of a LoopSOCKSProxy has to send its request
+BIND_TIMEOUT = 120              # Seconds to wait for a connection after a BIND request
+RECEIVE_SIZE = 4096             # Enough for any greeting and request
+
+
+class SOCKSRequest(NamedTuple):
+    version: int
+    command: int
+    reserved: int
+    address_type: int
+    host: Optional[str]         # None if the address type isn't supported
+    port: Optional[int]
+
+    def addresses(self, remote_dns: bool = False) -> list[tuple[int, tuple]]:
+        """
+        Address families and addresses to try for connecting.
+        Domain names are resolved through the DNS cache, or left for the server to resolve if remote_dns is True.
+        """
+        if self.address_type == SOCKS5_ATYP_DOMAINNAME:
+            if remote_dns:
+                return [(socket.AF_UNSPEC, (self.host, self.port))]
+            return dns_cache.resolve(self.host, self.port)
+        family = socket.AF_INET if self.address_type == SOCKS5_ATYP_IPV4 else socket.AF_INET6
+        return [(family, (self.host, self.port))]
+
+
+def parse_greeting(data: bytes | bytearray) -> Optional[tuple[int, set[int], int]]:
+    """
+    The version and authentication methods offered at the start of data and the length of the greeting,
+    or None if data doesn't hold the whole greeting yet
+    """
+    if len(data) < 2:
+        return None
+    end = 2 + data[1]
+    if len(data) < end:
+        return None
+    return data[0], set(data[2:end]), end
+
+
+def parse_auth(data: bytes | bytearray) -> Optional[tuple[int, str, str, int]]:
+    """
+    The version, username and password of the username/password request at the start of data and the length of the
+    request, or None if data doesn't hold the whole request yet
+    """
+    if len(data) < 2:
+        return None
+    password_start = 2 + data[1] + 1
+    if len(data) < password_start:
+        return None
+    end = password_start + data[password_start - 1]
+    if len(data) < end:
+        return None
+    return data[0], u(bytes(data[2:password_start - 1])), u(bytes(data[password_start:end])), end
+
+
+def parse_address(data: bytes | bytearray, offset: int) -> Optional[tuple[int, Optional[str], Optional[int], int]]:
+    """
+    The address type, host and port encoded at offset in data and the offset after them, or None if data doesn't
+    hold the whole address yet. The host and port are None if the address type isn't supported.
+    """
+    if len(data) < offset + 1:
+        return None
+    address_type = data[offset]
+    start = offset + 1
+    if address_type == SOCKS5_ATYP_IPV4:
+        end = start + 4
+    elif address_type == SOCKS5_ATYP_DOMAINNAME:
+        if len(data) < start + 1:
+            return None
+        start += 1
+        end = start + data[start - 1]
+    elif address_type == SOCKS5_ATYP_IPV6:
+        end = start + 16
+    else:
+        return address_type, None, None, start
+    if len(data) < end + SOCKS5_PORT.size:
+        return None
+    address = bytes(data[start:end])
+    if address_type == SOCKS5_ATYP_IPV4:
+        host = socket.inet_ntoa(address)
+    elif address_type == SOCKS5_ATYP_IPV6:
+        host = socket.inet_ntop(socket.AF_INET6, address)
+    else:
+        host = u(address)
+    return address_type, host, SOCKS5_PORT.unpack_from(data, end)[0], end + SOCKS5_PORT.size
+
+
+def parse_request(data: bytes | bytearray) -> Optional[tuple[SOCKSRequest, int]]:
+    """
+    The request at the start of data and its length, or None if data doesn't hold the whole request yet
+    """
+    if len(data) < SOCKS5_REQUEST_HEADER.size:
+        return None
+    version, command, reserved = data[:3]
+    address = parse_address(data, 3)
+    if not address:
+        return None
+    address_type, host, port, end = address
+    return SOCKSRequest(version, command, reserved, address_type, host, port), end
+
+
+def address_family(host: str) -> Optional[int]:
+    """
+    AF_INET or AF_INET6 if host is an IP address, otherwise None
+    """
+    for family in (socket.AF_INET, socket.AF_INET6):
+        try:
+            socket.inet_pton(family, host)
+            return family
+        except (OSError, ValueError):
+            pass
+    return None
+
+
+def encode_address(af: int = None, addr: tuple = None) -> bytes:
+    """
+    An IP address and port as they are encoded in SOCKS messages. Any other address is encoded as 0.0.0.0:0.
+    """
+    if af not in (socket.AF_INET, socket.AF_INET6) or not addr:
+        address_type, address, port = SOCKS5_ATYP_IPV4, bytes(4), 0
+    elif af == socket.AF_INET:
+        address_type, address, port = SOCKS5_ATYP_IPV4, socket.inet_aton(addr[0]), addr[1]
+    else:
+        address_type, address, port = SOCKS5_ATYP_IPV6, socket.inet_pton(socket.AF_INET6, addr[0]), addr[1]
+    return bytes((address_type,)) + address + SOCKS5_PORT.pack(port)
+
+
+def build_reply(status: int = SOCKS5_SUCCEEDED, af: int = None, addr: tuple = None) -> bytes:
+    """
+    Reply to a request, with the address the connection was made to if it succeeded and it is known
+    """
+    return bytes((SOCKS5_VERSION, status, SOCKS5_RESERVED)) + encode_address(af, addr)
+
+
+def request_status(request: SOCKSRequest, commands: Container[int] = (SOCKS5_CMD_CONNECT,)) -> int:
+    """
+    SOCKS5_SUCCEEDED if a request for one of commands can be attempted, otherwise the status to reply with
+    """
+    if request.version != SOCKS5_VERSION or request.reserved != SOCKS5_RESERVED:
+        return SOCKS5_GENERAL_SERVER_FAILURE
+    if request.command not in commands:
+        return SOCKS5_COMMAND_NOT_SUPPORTED
+    if request.host is None:
+        return SOCKS5_ADDRESS_TYPE_NOT_SUPPORTED
+    return SOCKS5_SUCCEEDED
+
+
+def error_status(error: Exception) -> int:
+    """
+    The status to reply with when connecting failed with error
+    """
+    if isinstance(error, paramiko.ChannelException):
+        if error.code == paramiko.common.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED:
+            return SOCKS5_CONNECTION_NOT_ALLOWED
+        if error.code == paramiko.common.OPEN_FAILED_CONNECT_FAILED:
+            return SOCKS5_CONNECTION_REFUSED
+    elif isinstance(error, NoValidConnectionsError):
+        statuses = {error_status(e) for e in error.errors.values()}
+        if len(statuses) == 1:
+            return statuses.pop()
+    elif isinstance(error, socket.timeout):
+        return SOCKS5_TTL_EXPIRED
+    elif isinstance(error, socket.error):
+        if error.errno == ECONNREFUSED:
+            return SOCKS5_CONNECTION_REFUSED
+        if error.errno == EHOSTUNREACH:
+            return SOCKS5_HOST_UNREACHABLE
+        if error.errno in (ENETDOWN, ENETUNREACH):
+            return SOCKS5_NETWORK_UNREACHABLE
+    return SOCKS5_GENERAL_SERVER_FAILURE
+
+
+class SOCKSUsers:
+    """
+    Who may use a proxy and the limits on each of them.
+
+    If users are configured, clients must authenticate with a username and password, checked with
+    hashing.verify_hash. That is slow by design, so once a user's password has been verified a keyed digest of it is
+    kept and checked for the user's next connections instead. Without users, connections are counted and shaped by
+    the client's host. When any rates are set, relays are given a Share of a Scheduler which shares rate fairly
+    between users, all within the proxy's own share of a Client's traffic if there is one.
+    """
+
+    def __init__(self, users: dict[str, SOCKSUser] = None, rate: float = None, share: Share = None):
+        self.users = users or {}
+        self.scheduler = Scheduler(rate, parent=share)
+        self.shaping = bool(rate or share) or any(user.get("rate") for user in self.users.values())
+        self.connections: dict[str, int] = {}
+        self.shares: dict[str, Share] = {}
+        self.verified: dict[str, bytes] = {}
+        self.key = os.urandom(32)
+        self.lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return "<SOCKSUsers(users={}, connections={})>".format(len(self.users), sum(self.connections.values()))
+
+    @property
+    def auth_required(self) -> bool:
+        return bool(self.users)
+
+    def verify(self, username: str, password: str) -> bool:
+        user = self.users.get(username)
+        if not user:
+            return False
+        digest = hmac.new(self.key, password.encode("utf-8"), "sha256").digest()
+        verified = self.verified.get(username)
+        if verified and hmac.compare_digest(verified, digest):
+            return True
+        if verify_hash(password, user["password_hash"]):
+            self.verified[username] = digest
+            return True
+        return False
+
+    def acquire(self, name: str) -> bool:
+        """
+        Count a connection for the user, unless they already have as many as they are allowed
+        """
+        with self.lock:
+            limit = self.users.get(name, {}).get("max_connections")
+            count = self.connections.get(name, 0)
+            if limit is not None and count >= limit:
+                return False
+            self.connections[name] = count + 1
+            return True
+
+    def release(self, name: str):
+        with self.lock:
+            count = self.connections.get(name, 0) - 1
+            if count > 0:
+                self.connections[name] = count
+                return
+            self.connections.pop(name, None)
+            share = self.shares.pop(name, None)
+        if share:
+            self.scheduler.remove(share)
+
+    def share(self, name: str) -> Optional[Share]:
+        """
+        The share of bandwidth for the user's connections, None if there are no rates to apply
+        """
+        if not self.shaping:
+            return None
+        with self.lock:
+            share = self.shares.get(name)
+            if not share:
+                user = self.users.get(name, {})
+                share = self.shares[name] = self.scheduler.share(name, user.get("rate"), user.get("burst"))
+            return share
+
 
 class SOCKSMessage:
     """
@@ -284,8 +556,10 @@ class SOCKS5RequestHandler(StreamRequestHandler, object):
             return
 
         auth_methods = {m.get_char() for _ in range(num_methods)}
+        users = self.server.users
+        method = SOCKS5_USERNAME_PASSWORD if users.auth_required else SOCKS5_NO_AUTH_REQUIRED
 
-        if SOCKS5_NO_AUTH_REQUIRED not in auth_methods:
+        if method not in auth_methods:
             m = SOCKSMessage()
             m.add_char(SOCKS5_VERSION)
             m.add_char(SOCKS5_NO_ACCEPTABLE_METHOD)
@@ -294,9 +568,25 @@ class SOCKS5RequestHandler(StreamRequestHandler, object):
 
         m = SOCKSMessage()
         m.add_char(SOCKS5_VERSION)
-        m.add_char(SOCKS5_NO_AUTH_REQUIRED)
+        m.add_char(method)
         self.request.sendall(m.asbytes())
 
+        user = self.client_address[0]
+        if users.auth_required:
+            m = SOCKSMessage(self.request)
+            auth_version = m.get_char()
+            username = m.get_string()
+            password = m.get_string()
+            verified = auth_version == SOCKS5_AUTH_VERSION and users.verify(username, password)
+            m = SOCKSMessage()
+            m.add_char(SOCKS5_AUTH_VERSION)
+            m.add_char(SOCKS5_AUTH_SUCCEEDED if verified else SOCKS5_AUTH_FAILED)
+            self.request.sendall(m.asbytes())
+            if not verified:
+                self._log(DEBUG, "Authentication failed for {}".format(username))
+                return
+            user = username
+
         m = SOCKSMessage(self.request)
         version = m.get_char()
         cmd = m.get_char()
@@ -322,7 +612,7 @@ class SOCKS5RequestHandler(StreamRequestHandler, object):
         elif address_type == SOCKS5_ATYP_DOMAINNAME:
             hostname = m.get_string()
             port = m.get_short()
-            af_and_addrs = families_and_addresses(hostname, port)
+            af_and_addrs = self._resolve(hostname, port)
         elif address_type == SOCKS5_ATYP_IPV6:
             address = socket.inet_ntop(socket.AF_INET6, m.get_bytes(16))
             port = m.get_short()
@@ -331,22 +621,18 @@ class SOCKS5RequestHandler(StreamRequestHandler, object):
             self._send_response(status=SOCKS5_ADDRESS_TYPE_NOT_SUPPORTED)
             return
 
+        if not users.acquire(user):
+            self._log(DEBUG, "Too many connections for {}".format(user))
+            self._send_response(status=SOCKS5_CONNECTION_NOT_ALLOWED)
+            return
+
+        self.share = users.share(user)
         channel = None
         try:
             channel, af, addr = self._open_channel(af_and_addrs)
-        except NoValidConnectionsError as e:
+        except (SSHException, socket.error) as e:
             self._log(DEBUG, str(e))
-            self._send_response(status=SOCKS5_GENERAL_SERVER_FAILURE)
-            return
-        except socket.error as e:
-            if e.errno == ECONNREFUSED:
-                self._send_response(status=SOCKS5_CONNECTION_REFUSED)
-            elif e.errno == EHOSTUNREACH:
-                self._send_response(status=SOCKS5_HOST_UNREACHABLE)
-            elif e.errno in (ENETDOWN, ENETUNREACH):
-                self._send_response(status=SOCKS5_NETWORK_UNREACHABLE)
-            else:
-                self._send_response(status=SOCKS5_GENERAL_SERVER_FAILURE)
+            self._send_response(status=error_status(e))
             return
         else:
             self._log(
@@ -362,6 +648,16 @@ class SOCKS5RequestHandler(StreamRequestHandler, object):
         finally:
             if channel:
                 channel.close()
+            users.release(user)
+
+    def _resolve(self, hostname, port):
+        """
+        Resolve hostname when the addresses are first needed, or leave it for the server to resolve.
+        """
+        if self.server.remote_dns:
+            yield socket.AF_UNSPEC, (hostname, port)
+        else:
+            yield from dns_cache.resolve(hostname, port)
 
     def _open_channel(self, fa):
         """
@@ -372,33 +668,8 @@ class SOCKS5RequestHandler(StreamRequestHandler, object):
             `.NoValidConnectionsError` - if there was any other error
             connecting or establishing a channel
         """
-
-        errors = {}
-        for af, addr in fa:
-            try:
-                channel = self.server.ssh_transport.open_channel(
-                    "direct-tcpip",
-                    dest_addr=addr,
-                    src_addr=self.request.getpeername()
-                )
-                return channel, af, addr
-            except socket.error as e:
-                # Raise anything that isn't a straight up connection error
-                # (such as a resolution error)
-                if e.errno not in (ECONNREFUSED, EHOSTUNREACH):
-                    raise
-                # Capture anything else so we know how the run looks once
-                # iteration is complete. Retain info about which attempt
-                # this was.
-                errors[addr] = e
-
-        # Make sure we explode usefully if no address family attempts
-        # succeeded. We've no way of knowing which error is the "right"
-        # one, so we construct a hybrid exception containing all the real
-        # ones, of a subclass that client code should still be watching for
-        # (socket.error)
-        if errors:
-            raise NoValidConnectionsError(errors)
+        return open_channel(self.server.ssh_transport, list(fa), self.request.getpeername(),
+                            self.server.attempt_delay, self.server.open_timeout)
 
     def _send_response(self, af=None, addr=None, status=SOCKS5_SUCCEEDED):
         """
@@ -408,31 +679,7 @@ class SOCKS5RequestHandler(StreamRequestHandler, object):
         :param tuple(str, int) addr: address tuple
         :param status:
         """
-        m = SOCKSMessage()
-        m.add_char(SOCKS5_VERSION)
-        m.add_char(status)
-        m.add_char(SOCKS5_RESERVED)
-
-        if not af or not addr:
-            m.add_char(SOCKS5_ATYP_IPV4)
-            m.add_int(0)
-            m.add_short(0)
-        elif af == socket.AF_INET:
-            addr_unpacked = struct.unpack("!I", socket.inet_aton(addr[0]))[0]
-            m.add_char(SOCKS5_ATYP_IPV4)
-            m.add_int(addr_unpacked)
-            m.add_short(addr[1])
-        else:
-            hi, lo = struct.unpack(
-                "!QQ",
-                socket.inet_pton(socket.AF_INET6, addr[0])
-            )
-            m.add_char(SOCKS5_ATYP_IPV6)
-            m.add_int64(hi)
-            m.add_int64(lo)
-            m.add_short(addr[1])
-
-        self.request.sendall(m.asbytes())
+        self.request.sendall(build_reply(status, af, addr))
 
     def _forward_data(self, socks_client, channel):
         """
@@ -442,18 +689,7 @@ class SOCKS5RequestHandler(StreamRequestHandler, object):
         :param .SocketType socks_client: Socket used by the requesting client
         :param .Channel channel: SSH channel to the destination
         """
-        buf_size = 4096
-
-        while True:
-            r, _, _ = select.select([socks_client, channel], [], [])
-
-            if socks_client in r:
-                if channel.send(socks_client.recv(buf_size)) <= 0:
-                    break
-
-            if channel in r:
-                if socks_client.send(channel.recv(buf_size)) <= 0:
-                    break
+        relay(socks_client, channel, self.server.buffer_size, self.share)
 
     def _log(self, level, msg, *args):
         self.logger.log(level, msg, *args)
@@ -467,6 +703,11 @@ class IPv6EnabledTCPServer(ThreadingTCPServer, object):
     daemon_threads = True
     allow_reuse_address = True
     ssh_transport = None
+    buffer_size = DEFAULT_BUFFER_SIZE
+    attempt_delay = CONNECTION_ATTEMPT_DELAY
+    open_timeout = DEFAULT_OPEN_TIMEOUT
+    remote_dns = False
+    users: SOCKSUsers = None
 
     def __init__(
         self,
@@ -503,7 +744,11 @@ class SOCKSProxy(ClosingContextManager):
     Instances of this class may be used as context managers.
     """
 
-    def __init__(self, transport, bind_address="localhost", port=1080):
+    def __init__(self, transport, bind_address="localhost", port=1080,
+                 buffer_size=DEFAULT_BUFFER_SIZE,
+                 attempt_delay=CONNECTION_ATTEMPT_DELAY,
+                 open_timeout=DEFAULT_OPEN_TIMEOUT,
+                 remote_dns=False, users=None, rate=None, share=None):
         """
         Start a SOCKS proxy and make it available on a local socket.
 
@@ -512,11 +757,27 @@ class SOCKSProxy(ClosingContextManager):
         :param str bind_address: the interface to bind to
         :param int port: the port to bind to. Use 0 if you want to use a
             random, unused port
+        :param int buffer_size: size of the buffer used for each direction
+            of each relayed connection
+        :param float attempt_delay: seconds to wait for a channel to one
+            address of a destination before also trying the next
+        :param float open_timeout: seconds to wait for a channel to open
+        :param bool remote_dns: pass domain names on for the server to
+            resolve instead of resolving them locally
+        :param dict users: usernames allowed to connect, with their password
+            hashes and limits. Anyone can connect if there are none
+        :param float rate: bytes a second to share fairly between users
+        :param .Share share: limits all traffic through the proxy
         """
         self.server = IPv6EnabledTCPServer(
             (bind_address, port), SOCKS5RequestHandler
         )
         self.server.ssh_transport = transport
+        self.server.buffer_size = buffer_size
+        self.server.attempt_delay = attempt_delay
+        self.server.open_timeout = open_timeout
+        self.server.remote_dns = remote_dns
+        self.server.users = SOCKSUsers(users, rate, share)
         threading.Thread(target=self.server.serve_forever).start()
 
     def close(self):
@@ -546,4 +807,498 @@ class SOCKSProxy(ClosingContextManager):
         """
         return "<paramiko.SOCKSProxy({})>".format(
             ip_addr_to_str(self.get_address())
-        )
\ No newline at end of file
+        )
+
+GREETING = "greeting"
+AUTHENTICATING = "authenticating"   # Waiting for the username and password
+VERIFYING = "verifying"             # Waiting for the password to be checked
+REQUEST = "request"
+CONNECTING = "connecting"
+REPLYING = "replying"           # Waiting for the reply to be written before relaying
+FAILING = "failing"             # Waiting for the reply to be written before closing
+ASSOCIATING = "associating"     # Waiting for the UDP channel to open
+ASSOCIATED = "associated"       # Relaying datagrams until the client closes its connection
+BINDING = "binding"             # Waiting for the server to start listening
+BOUND = "bound"                 # Waiting for a connection to the port the server is listening on
+
+
+class SOCKS5Connection:
+    """
+    One client of a LoopSOCKSProxy, from its greeting until its connection is relayed, or for as long as its UDP
+    association lasts.
+
+    Everything received is appended to a buffer which is parsed whenever a whole message has arrived, so a client can
+    send its greeting and request in any number of pieces, or in one go. Reading stops while the channel is being
+    opened, anything which arrived after the request is sent on the channel once it is open.
+
+    For BIND, the server is asked to listen on any free port. The first reply gives that port with the server's
+    address, the second the address a connection came from, which is then relayed like any other.
+    """
+
+    def __init__(self, server: 'LoopSOCKSProxy', sock: socket.socket, address: tuple):
+        self.server = server
+        self.loop = server.loop
+        self.sock = sock
+        self.address = address
+        self.state = GREETING
+        self.received = bytearray()
+        self.outgoing = bytearray()
+        self.channel: paramiko.Channel = None
+        self.opener: ChannelOpener = None
+        self.association: UDPAssociation = None
+        self.bind_request: SOCKSRequest = None
+        self.bind_port: int = None
+        self.user = address[0]
+        self.acquired = False           # Whether the connection is counted against the user's limit
+        self.closed = False
+        self.timeout = self.loop.call_later(HANDSHAKE_TIMEOUT, self.close)
+
+    def __repr__(self) -> str:
+        return "<SOCKS5Connection({}, {})>".format(ip_addr_to_str(self.address), self.state)
+
+    def start(self):
+        self.sock.setblocking(False)
+        self._update()
+
+    def _on_event(self, sock: socket.socket, mask: int):
+        if mask & selectors.EVENT_WRITE:
+            self._flush()
+        if mask & selectors.EVENT_READ and not self.closed:
+            try:
+                data = sock.recv(RECEIVE_SIZE)
+            except BlockingIOError:
+                return
+            except OSError:
+                data = b""
+            if not data:
+                self.close()
+                return
+            self.received += data
+            self._parse()
+        self._update()
+
+    def _parse(self):
+        if self.state == ASSOCIATED:
+            self.received.clear()       # Nothing more is expected on the connection, it only keeps the association
+            return
+        if self.state == GREETING:
+            greeting = parse_greeting(self.received)
+            if not greeting:
+                return
+            version, methods, length = greeting
+            del self.received[:length]
+            if version != SOCKS5_VERSION:
+                self.server._log(DEBUG, "Request for unsupported SOCKS version {}".format(version))
+                self._fail(SOCKS5_GENERAL_SERVER_FAILURE)
+                return
+            auth_required = self.server.users.auth_required
+            method = SOCKS5_USERNAME_PASSWORD if auth_required else SOCKS5_NO_AUTH_REQUIRED
+            if method not in methods:
+                self.state = FAILING
+                self._send(bytes((SOCKS5_VERSION, SOCKS5_NO_ACCEPTABLE_METHOD)))
+                return
+            self._send(bytes((SOCKS5_VERSION, method)))
+            self.state = AUTHENTICATING if auth_required else REQUEST
+        if self.state == AUTHENTICATING:
+            auth = parse_auth(self.received)
+            if not auth:
+                return
+            version, username, password, length = auth
+            del self.received[:length]
+            self.state = VERIFYING
+            if version != SOCKS5_AUTH_VERSION:
+                self._verified(username, None)
+                return
+            future = executor.submit(self.server.users.verify, username, password)
+            future.add_done_callback(lambda f: self.loop.call_soon(self._verified, username, f))
+            return
+        if self.state == REQUEST:
+            parsed = parse_request(self.received)
+            if not parsed:
+                return
+            request, length = parsed
+            del self.received[:length]
+            status = request_status(request, self.server.commands)
+            if status != SOCKS5_SUCCEEDED:
+                self._fail(status)
+                return
+            if not self.server.users.acquire(self.user):
+                self.server._log(DEBUG, "Too many connections for {}".format(self.user))
+                self._fail(SOCKS5_CONNECTION_NOT_ALLOWED)
+                return
+            self.acquired = True
+            if request.command == SOCKS5_CMD_UDP_ASSOCIATE:
+                self._associate()
+                return
+            if request.command == SOCKS5_CMD_BIND:
+                self._bind(request)
+                return
+            self.state = CONNECTING
+            self.timeout.cancel()       # The channel opener has its own deadline
+            if request.address_type == SOCKS5_ATYP_DOMAINNAME and not self.server.remote_dns:
+                future = dns_cache.resolve_async(request.host)
+                future.add_done_callback(lambda f: self.loop.call_soon(self._resolved, request.port, f))
+            else:
+                self._open(request.addresses(remote_dns=True))
+
+    def _verified(self, username: str, future):
+        if self.closed:
+            return
+        if future and not future.exception() and future.result():
+            self.user = username
+            self._send(bytes((SOCKS5_AUTH_VERSION, SOCKS5_AUTH_SUCCEEDED)))
+            self.state = REQUEST
+            self._parse()
+        else:
+            self.server._log(DEBUG, "Authentication failed for {}".format(username))
+            self.state = FAILING
+            self._send(bytes((SOCKS5_AUTH_VERSION, SOCKS5_AUTH_FAILED)))
+        self._update()
+
+    def _resolved(self, port: int, future):
+        if self.closed:
+            return
+        try:
+            addresses = with_port(future.result(), port)
+        except OSError as e:
+            self._failed(e)
+            return
+        self._open(addresses)
+
+    def _open(self, addresses: list[tuple[int, tuple]]):
+        self.opener = self.server._channel_opener(addresses, self.address)
+        self.opener.start().add_done_callback(self._channel_opened)
+
+    def _failed(self, error: Exception):
+        self.server._log(DEBUG, "SOCKS request from {} failed: {!r}".format(ip_addr_to_str(self.address), error))
+        self._fail(error_status(error))
+        self._update()
+
+    def _channel_opened(self, future):
+        if future.cancelled() or self.closed:
+            return
+        try:
+            channel, af, addr = future.result()
+        except Exception as e:
+            self._failed(e)
+            return
+        self.server._log(DEBUG, "Established direct-tcpip channel with {}".format(ip_addr_to_str(addr)))
+        self.channel = channel
+        self.state = REPLYING
+        self._send(build_reply(SOCKS5_SUCCEEDED, af, addr))
+        self._update()
+
+    def _associate(self):
+        self.state = ASSOCIATING
+        ready = self.server._udp_channel().open()
+        ready.add_done_callback(lambda f: self.loop.call_soon(self._udp_channel_ready, f))
+
+    def _udp_channel_ready(self, future):
+        if self.closed:
+            return
+        try:
+            udp_channel = future.result()
+            self.association = UDPAssociation(udp_channel, self.sock.getsockname()[0], self.address[0],
+                                              on_close=self.close)
+        except Exception as e:
+            self._failed(e)
+            return
+        self.server._log(DEBUG, "UDP association for {} on {}".format(ip_addr_to_str(self.address),
+                                                                     ip_addr_to_str(self.association.address)))
+        self.timeout.cancel()
+        self.state = ASSOCIATED
+        self._send(build_reply(SOCKS5_SUCCEEDED, self.association.sock.family, self.association.address))
+        self._update()
+
+    def _bind(self, request: SOCKSRequest):
+        self.state = BINDING
+        self.bind_request = request
+        listeners = remote_listeners(self.server.ssh_transport)
+        future = executor.submit(listeners.listen, lambda *args: self.loop.call_soon(self._bind_accepted, *args))
+        future.add_done_callback(lambda f: self.loop.call_soon(self._listening, f))
+
+    def _listening(self, future):
+        try:
+            self.bind_port = future.result()
+        except Exception as e:
+            if not self.closed:
+                self._failed(e)
+            return
+        if self.closed:
+            self._stop_listening()
+            return
+        self.timeout.cancel()
+        self.timeout = self.loop.call_later(BIND_TIMEOUT, self.close)
+        self.state = BOUND
+        host = self.server._server_host()
+        self._send(build_reply(SOCKS5_SUCCEEDED, address_family(host), (host, self.bind_port)))
+        self._update()
+
+    def _bind_accepted(self, channel: paramiko.Channel, origin: tuple):
+        expected = self.bind_request.host
+        if self.closed or self.state != BOUND or (
+                address_family(expected) and expected not in ("0.0.0.0", "::") and origin[0] != expected):
+            channel.close()
+            return
+        self.server._log(DEBUG, "BIND connection from {}".format(ip_addr_to_str(origin)))
+        self._stop_listening()
+        self.channel = channel
+        self.state = REPLYING
+        self._send(build_reply(SOCKS5_SUCCEEDED, address_family(origin[0]), origin))
+        self._update()
+
+    def _stop_listening(self):
+        if self.bind_port:
+            executor.submit(remote_listeners(self.server.ssh_transport).cancel, self.bind_port)
+            self.bind_port = None
+
+    def _fail(self, status: int):
+        self.state = FAILING
+        self._send(build_reply(status))
+
+    def _send(self, data: bytes):
+        self.outgoing += data
+        self._flush()
+
+    def _flush(self):
+        try:
+            sent = self.sock.send(self.outgoing)
+        except BlockingIOError:
+            return
+        except OSError:
+            self.close()
+            return
+        del self.outgoing[:sent]
+        if self.outgoing:
+            return
+        if self.state == FAILING:
+            self.close()
+        elif self.state == REPLYING:
+            self._relay()
+
+    def _relay(self):
+        self.timeout.cancel()
+        self.loop.unregister(self.sock)
+        self.server.connections.discard(self)
+        self.closed = True          # From here on the socket and the user's count belong to the relay
+        try:
+            if self.received:
+                self.channel.sendall(bytes(self.received))
+        except OSError:
+            self.sock.close()
+            self.channel.close()
+            self.server.users.release(self.user)
+            return
+        self.server._start_relay(self.sock, self.channel, self.user)
+
+    def _update(self):
+        if self.closed:
+            return
+        events = selectors.EVENT_READ if self.state in (GREETING, AUTHENTICATING, REQUEST, ASSOCIATED) else 0
+        if self.outgoing:
+            events |= selectors.EVENT_WRITE
+        self.loop.set_events(self.sock, events, self._on_event)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.timeout.cancel()
+        self.loop.unregister(self.sock)
+        self.sock.close()
+        if self.opener:
+            self.opener.cancel()
+        if self.association:
+            self.association.close()
+        self._stop_listening()
+        if self.channel:
+            self.channel.close()
+        if self.acquired:
+            self.server.users.release(self.user)
+        self.server.connections.discard(self)
+
+
+class LoopSOCKSProxy(ClosingContextManager):
+    """
+    SOCKS5 proxy which doesn't use a thread per connection.
+
+    The handshakes of all clients and the relays of their connections are handled by a single EventLoop, which can be
+    shared with tunnels and other proxies. Names are resolved through the DNS cache and channels opened in the
+    shared executor so a slow server response doesn't block the loop.
+
+    As well as CONNECT, BIND is supported if the server allows remote port forwarding, and UDP ASSOCIATE if the
+    server can run udp_helper_command, by default the helper in udp_helper with python3.
+
+    Clients can be required to log in as one of users, each with their own limits on connections and bandwidth,
+    with rate shared fairly between them. UDP associations count as connections but their datagrams aren't shaped.
+
+    Instances of this class may be used as context managers.
+    """
+    allow_reuse_address = True
+    request_queue_size = 128
+    commands = (SOCKS5_CMD_CONNECT, SOCKS5_CMD_BIND, SOCKS5_CMD_UDP_ASSOCIATE)
+
+    def __init__(self, transport: paramiko.Transport, loop: EventLoop, bind_address: str = "localhost",
+                 port: int = 1080, buffer_size: int = DEFAULT_BUFFER_SIZE,
+                 attempt_delay: float = CONNECTION_ATTEMPT_DELAY, open_timeout: float = DEFAULT_OPEN_TIMEOUT,
+                 remote_dns: bool = False, udp_helper_command: str = None, users: dict[str, SOCKSUser] = None,
+                 rate: float = None, share: Share = None):
+        """
+        Start a SOCKS proxy and make it available on a local socket.
+
+        :param .Transport transport: an open `.Transport` which is already
+            authenticated
+        :param .EventLoop loop: the loop to handle connections in, started if it isn't running
+        :param str bind_address: the interface to bind to
+        :param int port: the port to bind to. Use 0 if you want to use a
+            random, unused port
+        :param int buffer_size: size of the buffer used for each direction
+            of each relayed connection
+        :param float attempt_delay: seconds to wait for a channel to one
+            address of a destination before also trying the next
+        :param float open_timeout: seconds to wait for a channel to open
+        :param bool remote_dns: pass domain names on for the server to
+            resolve instead of resolving them locally
+        :param str udp_helper_command: command run on the server to relay
+            datagrams for UDP associations
+        :param dict users: usernames allowed to connect, with their password
+            hashes and limits. Anyone can connect if there are none
+        :param float rate: bytes a second to share fairly between users
+        :param .Share share: limits all traffic through the proxy
+        """
+        self.logger = get_logger("paramiko.socks")
+        self.ssh_transport = transport
+        self.loop = loop
+        self.buffer_size = buffer_size
+        self.attempt_delay = attempt_delay
+        self.open_timeout = open_timeout
+        self.remote_dns = remote_dns
+        self.udp_helper_command = udp_helper_command or helper_command()
+        self.udp_channel: UDPChannel = None
+        self.users = SOCKSUsers(users, rate, share)
+        self.connections: set[SOCKS5Connection] = set()
+        self.tunnels: set[Relay] = set()
+        self.closed = False
+        self.closed_event = threading.Event()
+        family, address = next(families_and_addresses(bind_address, port), (socket.AF_INET, (bind_address, port)))
+        self.socket = socket.socket(family, socket.SOCK_STREAM)
+        if self.allow_reuse_address:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(address)
+        self.socket.listen(self.request_queue_size)
+        self.socket.setblocking(False)
+        self.server_address = self.socket.getsockname()
+        self.loop.start()
+        self.loop.call_soon(self._start)
+
+    def _start(self):
+        if not self.closed:
+            self.loop.register(self.socket, selectors.EVENT_READ, self._accept)
+
+    def _accept(self, listening_sock: socket.socket, mask: int):
+        while True:
+            try:
+                sock, address = self.socket.accept()
+            except (BlockingIOError, OSError):
+                return
+            self._log(DEBUG, "Accepting connection from {}".format(ip_addr_to_str(address)))
+            connection = SOCKS5Connection(self, sock, address)
+            self.connections.add(connection)
+            connection.start()
+
+    def _channel_opener(self, addresses: list[tuple[int, tuple]], src_addr: tuple) -> ChannelOpener:
+        return ChannelOpener(self.loop, self.ssh_transport, addresses, src_addr, self.attempt_delay,
+                             self.open_timeout)
+
+    def _udp_channel(self) -> UDPChannel:
+        """
+        The channel shared by all UDP associations, replaced if it has failed or been closed
+        """
+        if not self.udp_channel or self.udp_channel.closed:
+            self.udp_channel = UDPChannel(self.loop, self._open_udp_helper)
+        return self.udp_channel
+
+    def _open_udp_helper(self) -> paramiko.Channel:
+        channel = self.ssh_transport.open_session(timeout=self.open_timeout)
+        channel.exec_command(self.udp_helper_command)
+        return channel
+
+    def _server_host(self) -> str:
+        """
+        The address of the server, for telling BIND clients where the server is listening
+        """
+        try:
+            return self.ssh_transport.getpeername()[0]
+        except (OSError, TypeError):
+            return "0.0.0.0"
+
+    def _start_relay(self, sock: socket.socket, channel: paramiko.Channel, user: str):
+        if self.closed:
+            sock.close()
+            channel.close()
+            self.users.release(user)
+            return
+        tunnel = Relay(self.loop, sock, channel, self.buffer_size, on_close=partial(self._relay_closed, user),
+                       share=self.users.share(user))
+        self.tunnels.add(tunnel)
+        tunnel.start()
+
+    def _relay_closed(self, user: str, tunnel: Relay):
+        self.tunnels.discard(tunnel)
+        self.users.release(user)
+
+    def _close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.loop.unregister(self.socket)
+        self.socket.close()
+        for connection in list(self.connections):
+            connection.close()
+        for tunnel in list(self.tunnels):
+            tunnel.close()
+        if self.udp_channel:
+            self.udp_channel.close()
+        self.closed_event.set()
+
+    def close(self):
+        """
+        Stop accepting connections and close all connections through the proxy
+        """
+        if self.loop.in_loop_thread() or not self.loop.running:
+            self._close()
+        else:
+            self.loop.call_soon(self._close)
+            self.closed_event.wait()
+
+    def get_address(self):
+        """
+        Return a tuple with address and port the proxy is bound to.
+
+        :return: tuple containing the address the SOCKS proxy is bound to
+        :rtype: tuple(str, int)
+        """
+        return self.server_address
+
+    def _log(self, level, msg, *args):
+        self.logger.log(level, msg, *args)
+
+    def __repr__(self):
+        return "<LoopSOCKSProxy({})>".format(ip_addr_to_str(self.get_address()))
+
+
+def create_socks_proxy(transport: paramiko.Transport, bind_address: str = "localhost", port: int = 1080,
+                       buffer_size: int = DEFAULT_BUFFER_SIZE, loop: EventLoop = None,
+                       attempt_delay: float = CONNECTION_ATTEMPT_DELAY,
+                       open_timeout: float = DEFAULT_OPEN_TIMEOUT,
+                       remote_dns: bool = False, users: dict[str, SOCKSUser] = None,
+                       rate: float = None, share: Share = None) -> SOCKSProxy | LoopSOCKSProxy:
+    """
+    Start a SOCKS5 proxy over the transport.
+    If an EventLoop is given, all connections are handled in that loop, otherwise each connection gets its own thread.
+    """
+    if loop:
+        return LoopSOCKSProxy(transport, loop, bind_address, port, buffer_size, attempt_delay, open_timeout,
+                              remote_dns, users=users, rate=rate, share=share)
+    return SOCKSProxy(transport, bind_address, port, buffer_size, attempt_delay, open_timeout, remote_dns, users,
+                      rate, share)
@@ -0,0 +1,241 @@
+"""
+UDP ASSOCIATE for SOCKS proxies.
+
+SSH has no channel type for datagrams, so the datagrams of every UDP association of a proxy are carried over one
+session channel running udp_helper on the server, which sends them on and passes the replies back. Datagrams are
+framed as described in udp_helper and everything which is waiting when the channel can be written to is sent at once,
+so a burst of small datagrams costs a few channel packets rather than one each.
+"""
+
+from concurrent.futures import Future
+import itertools
+from pathlib import Path
+import selectors
+import shlex
+import socket
+import struct
+from typing import Callable, Optional
+
+import paramiko
+
+from .event_loop import EventLoop
+from .executors import executor
+from .relay import Endpoint, send
+from .udp_helper import CLOSE, DATA, HEADER, MAX_BATCH, MAX_DATAGRAM, decode_address
+
+
+UDP_HEADER = b'\x00\x00\x00'        # Reserved and fragment number, before the address of each SOCKS datagram
+MAX_PENDING = 1024 * 1024           # Datagrams are dropped rather than queued beyond this, as a congested network would
+RECEIVE_SIZE = 1024 * 1024
+
+
+def helper_command(python: str = 'python3') -> str:
+    """
+    Command which runs udp_helper on the server without it having to be installed there
+    """
+    source = Path(__file__).with_name('udp_helper.py').read_text()
+    return f'{python} -c {shlex.quote(source)}'
+
+
+class UDPChannel:
+    """
+    Carries the datagrams of any number of UDP associations over a single channel to udp_helper.
+    The channel is opened in the shared executor by open_channel when the first association is added, ready is set
+    once it is open. Everything other than the open must happen in the loop thread.
+    """
+
+    def __init__(self, loop: EventLoop, open_channel: Callable[[], Endpoint]):
+        self.loop = loop
+        self.open_channel = open_channel
+        self.channel: Optional[Endpoint] = None
+        self.ready: Future = Future()
+        self.associations: dict[int, 'UDPAssociation'] = {}
+        self.ids = itertools.count(1)
+        self.outgoing = bytearray()
+        self.received = bytearray()
+        self.closed = False
+        self.dropped = 0
+
+    def __repr__(self) -> str:
+        return f'<UDPChannel(associations={len(self.associations)}, pending={len(self.outgoing)})>'
+
+    def open(self) -> Future:
+        if not self.ready.running() and not self.ready.done():
+            self.ready.set_running_or_notify_cancel()
+            executor.submit(self.open_channel).add_done_callback(lambda f: self.loop.call_soon(self._opened, f))
+        return self.ready
+
+    def _opened(self, future: Future):
+        try:
+            channel = future.result()
+        except Exception as e:
+            self.closed = True
+            self.ready.set_exception(e)
+            return
+        if self.closed:
+            channel.close()
+            self.ready.set_exception(ConnectionError('UDP channel closed while it was being opened'))
+            return
+        self.channel = channel
+        channel.setblocking(False)
+        self.ready.set_result(self)
+        self._update()
+
+    def add(self, association: 'UDPAssociation') -> int:
+        association_id = next(self.ids)
+        self.associations[association_id] = association
+        return association_id
+
+    def remove(self, association_id: int):
+        if self.associations.pop(association_id, None) and not self.closed:
+            self.outgoing += HEADER.pack(0, CLOSE, association_id)
+            self.flush()
+
+    def send(self, association_id: int, address: bytes, payload: bytes):
+        """
+        Queue a datagram for the address, encoded as in SOCKS. Call flush once a batch has been queued.
+        """
+        if len(self.outgoing) > MAX_PENDING:
+            self.dropped += 1
+            return
+        self.outgoing += HEADER.pack(len(address) + len(payload), DATA, association_id)
+        self.outgoing += address
+        self.outgoing += payload
+
+    def flush(self):
+        if not self.channel or self.closed:
+            return
+        try:
+            while self.outgoing:
+                sent = send(self.channel, memoryview(self.outgoing))
+                if not sent:
+                    raise ConnectionError('UDP channel closed')
+                del self.outgoing[:sent]
+        except (BlockingIOError, socket.timeout):
+            pass
+        except OSError:
+            self.close()
+            return
+        self._update()
+
+    def _on_event(self, channel: Endpoint, mask: int):
+        if mask & selectors.EVENT_WRITE:
+            self.flush()
+        if mask & selectors.EVENT_READ:
+            self._receive()
+
+    def _poll(self):
+        if self.channel.send_ready():
+            self.flush()
+
+    def _receive(self):
+        try:
+            data = self.channel.recv(RECEIVE_SIZE)
+        except (BlockingIOError, socket.timeout):
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self.close()
+            return
+        self.received += data
+        offset = 0
+        with memoryview(self.received) as view:
+            while len(view) - offset >= HEADER.size:
+                length, kind, association_id = HEADER.unpack_from(view, offset)
+                start = offset + HEADER.size
+                if len(view) - start < length:
+                    break
+                offset = start + length
+                association = self.associations.get(association_id)
+                if kind == DATA and association:
+                    association.deliver(view[start:offset])
+        del self.received[:offset]
+
+    def _update(self):
+        if self.closed or not self.channel:
+            return
+        events = selectors.EVENT_READ
+        if isinstance(self.channel, paramiko.Channel):
+            if self.outgoing:
+                self.loop.add_poller(self._poll)
+            else:
+                self.loop.remove_poller(self._poll)
+        elif self.outgoing:
+            events |= selectors.EVENT_WRITE
+        self.loop.set_events(self.channel, events, self._on_event)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.channel:
+            self.loop.remove_poller(self._poll)
+            self.loop.unregister(self.channel)
+            self.channel.close()
+        for association in list(self.associations.values()):
+            association.close()
+
+
+class UDPAssociation:
+    """
+    The UDP socket a SOCKS client sends datagrams to, and receives replies from, for one UDP ASSOCIATE request.
+    Datagrams are only accepted from the host of the client's TCP connection, and after the first from the same port.
+    Fragmented datagrams aren't supported and are dropped, as RFC 1928 allows.
+    """
+
+    def __init__(self, udp_channel: UDPChannel, bind_host: str, client_host: str, on_close: Callable[[], None] = None):
+        self.udp_channel = udp_channel
+        self.loop = udp_channel.loop
+        self.client_host = client_host
+        self.client_address: Optional[tuple] = None
+        self.on_close = on_close
+        self.closed = False
+        self.sock = socket.socket(socket.AF_INET6 if ':' in bind_host else socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((bind_host, 0))
+        self.sock.setblocking(False)
+        self.address = self.sock.getsockname()
+        self.id = udp_channel.add(self)
+        self.loop.register(self.sock, selectors.EVENT_READ, self._on_readable)
+
+    def __repr__(self) -> str:
+        return f'<UDPAssociation({self.id}, client={self.client_address})>'
+
+    def _on_readable(self, sock: socket.socket, mask: int):
+        for _ in range(MAX_BATCH):
+            try:
+                data, address = sock.recvfrom(MAX_DATAGRAM)
+            except OSError:
+                break
+            if address[0] != self.client_host or self.client_address not in (None, address):
+                continue
+            self.client_address = address
+            if data[:3] != UDP_HEADER:
+                continue
+            try:
+                end = decode_address(data, 3)[2]
+            except (ValueError, IndexError, struct.error):
+                continue
+            view = memoryview(data)
+            self.udp_channel.send(self.id, view[3:end], view[end:])
+        self.udp_channel.flush()
+
+    def deliver(self, body: memoryview):
+        """
+        Send a reply to the client. body is the source address, encoded as in SOCKS, followed by the datagram.
+        """
+        if self.client_address:
+            try:
+                self.sock.sendmsg([UDP_HEADER, body], [], 0, self.client_address)
+            except OSError:
+                pass
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.loop.unregister(self.sock)
+        self.sock.close()
+        self.udp_channel.remove(self.id)
+        if self.on_close:
+            self.on_close()
@@ -1,4 +1,4 @@
-from typing import Iterable, Literal, Optional, TypedDict
+from typing import Iterable, Literal, NotRequired, Optional, TypedDict
 from pathlib import Path
 
 File = str | Path
@@ -6,11 +6,37 @@ DisabledAlgorithms = dict[str, Iterable[str]]
 StringDict = dict[str, str]
 KnownHostsPolicy = Literal["reject", "auto", "warn"]
 ProxyVersion = Literal["socks5", "socks4", "http"]
+ForwardEngine = Literal["threading", "selector"]
+ScreenBackend = Literal["pyte", "fast"]
+RecordingFormat = Literal["asciicast", "binary"]
+TrafficPriority = Literal["interactive", "x11", "tunnel", "bulk"]
 
 
 class TunnelConfig(TypedDict):
     src: tuple[Optional[str], int]
     dst: tuple[str, int]
+    engine: NotRequired[ForwardEngine]
+    buffer_size: NotRequired[int]
+    open_timeout: NotRequired[float]
+    remote_dns: NotRequired[bool]           # Let the server resolve dst
+    rate: NotRequired[float]                # Bytes a second, in both directions together
+    burst: NotRequired[float]
+    priority: NotRequired[TrafficPriority]
+
+
+class SOCKSTunnelConfig(TypedDict):
+    src: tuple[Optional[str], int]
+    engine: NotRequired[ForwardEngine]
+    rate: NotRequired[float]
+    burst: NotRequired[float]
+    priority: NotRequired[TrafficPriority]
+
+
+class SOCKSUser(TypedDict):
+    password_hash: str                      # From hashing.hash_password
+    max_connections: NotRequired[int]
+    rate: NotRequired[float]                # Bytes a second, in both directions together
+    burst: NotRequired[float]
 
 
 # Some paramaters listed as NotRequired with plan to use new feature coming in 3.11 when available
@@ -0,0 +1,140 @@
+"""
+Relays UDP datagrams for SOCKS proxies, run by the proxy on the server at the other end of an SSH session channel.
+
+    python3 -c "<this file>"
+
+Frames are read from stdin and written to stdout. Each starts with a header giving the length of its body, its kind
+and the UDP association it belongs to. The body of a data frame is the destination or source address, encoded as in
+SOCKS5 requests, followed by the datagram. Every association gets its own UDP sockets so replies go back to the
+right client. Everything which arrives while handling one batch of events is written out in one go.
+
+This file is sent to the server as it is so it must only use the standard library.
+"""
+
+import os
+import selectors
+import socket
+import struct
+
+
+HEADER = struct.Struct('!IBI')      # Length of the body, kind, association
+PORT = struct.Struct('!H')
+DATA = 0
+CLOSE = 1
+ATYP_IPV4 = 1
+ATYP_DOMAINNAME = 3
+ATYP_IPV6 = 4
+MAX_DATAGRAM = 65535
+MAX_BATCH = 64                      # Datagrams read from one socket before moving on to the others
+RESOLVED_NAMES = 256
+
+
+def decode_address(data, offset):
+    address_type = data[offset]
+    start = offset + 1
+    if address_type == ATYP_IPV4:
+        end = start + 4
+        host = socket.inet_ntop(socket.AF_INET, data[start:end])
+    elif address_type == ATYP_IPV6:
+        end = start + 16
+        host = socket.inet_ntop(socket.AF_INET6, data[start:end])
+    elif address_type == ATYP_DOMAINNAME:
+        start += 1
+        end = start + data[start - 1]
+        host = data[start:end].decode('utf-8', 'replace')
+    else:
+        raise ValueError('Unsupported address type {}'.format(address_type))
+    return host, PORT.unpack_from(data, end)[0], end + PORT.size
+
+
+def encode_address(family, address):
+    if family == socket.AF_INET6:
+        return bytes((ATYP_IPV6,)) + socket.inet_pton(socket.AF_INET6, address[0]) + PORT.pack(address[1])
+    return bytes((ATYP_IPV4,)) + socket.inet_pton(socket.AF_INET, address[0]) + PORT.pack(address[1])
+
+
+class Helper:
+    def __init__(self, stdin=0, stdout=1):
+        self.stdin = stdin
+        self.stdout = stdout
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(stdin, selectors.EVENT_READ)
+        self.received = bytearray()
+        self.output = bytearray()
+        self.sockets = {}           # (association, family): socket
+        self.resolved = {}          # (host, port): (family, address)
+
+    def run(self):
+        while True:
+            for key, mask in self.selector.select():
+                if key.fileobj == self.stdin:
+                    data = os.read(self.stdin, 1024 * 1024)
+                    if not data:
+                        return
+                    self.received += data
+                    self.handle_frames()
+                else:
+                    self.receive(key.fileobj, key.data)
+            while self.output:
+                written = os.write(self.stdout, self.output)
+                del self.output[:written]
+
+    def handle_frames(self):
+        offset = 0
+        while len(self.received) - offset >= HEADER.size:
+            length, kind, association = HEADER.unpack_from(self.received, offset)
+            start = offset + HEADER.size
+            if len(self.received) - start < length:
+                break
+            offset = start + length
+            if kind == DATA:
+                self.send(association, bytes(self.received[start:offset]))
+            elif kind == CLOSE:
+                self.close(association)
+        del self.received[:offset]
+
+    def resolve(self, host, port):
+        key = (host, port)
+        if key not in self.resolved:
+            if len(self.resolved) >= RESOLVED_NAMES:
+                self.resolved.clear()
+            family, _, _, _, address = socket.getaddrinfo(host, port, 0, socket.SOCK_DGRAM)[0]
+            self.resolved[key] = (family, address)
+        return self.resolved[key]
+
+    def send(self, association, body):
+        try:
+            host, port, end = decode_address(body, 0)
+            family, address = self.resolve(host, port)
+            sock = self.sockets.get((association, family))
+            if not sock:
+                sock = socket.socket(family, socket.SOCK_DGRAM)
+                sock.setblocking(False)
+                self.sockets[(association, family)] = sock
+                self.selector.register(sock, selectors.EVENT_READ, association)
+            sock.sendto(body[end:], address)
+        except (OSError, ValueError, IndexError, struct.error):
+            pass        # Datagrams which can't be delivered are dropped, as they would be by the network
+
+    def receive(self, sock, association):
+        for _ in range(MAX_BATCH):
+            try:
+                data, address = sock.recvfrom(MAX_DATAGRAM)
+            except OSError:
+                return
+            body = encode_address(sock.family, address) + data
+            self.output += HEADER.pack(len(body), DATA, association) + body
+
+    def close(self, association):
+        for key in [key for key in self.sockets if key[0] == association]:
+            sock = self.sockets.pop(key)
+            self.selector.unregister(sock)
+            sock.close()
+
+
+def main():
+    Helper().run()
+
+
+if __name__ == '__main__':
+    main()
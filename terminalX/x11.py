@@ -1,25 +1,49 @@
 #!/usr/bin/env python
 # With thanks to https://stackoverflow.com/questions/12354047/x11-forwarding-with-paramiko dnozay answer
 
+import binascii
+from concurrent.futures import Future
+import errno
+import functools
 import os
+import selectors
+import shutil
+import struct
+import sys
 import threading
+import time
 from .executors import executor
 from functools import partial
 import socket
-import selectors
 import logging
 import paramiko
 import subprocess
+from typing import Callable, NamedTuple, Optional
+from .event_loop import EventLoop, TimerHandle
+from .relay import DEFAULT_BUFFER_SIZE, Relay
+from .shaping import Share
 
 logger = logging.getLogger(__name__)
 
 
-if os.name == "nt" or not hasattr(socket, 'AF_UNIX'):
-    x11_server = ('127.0.0.1', 6000)
-    x11_family = socket.AF_INET
-else:
-    x11_server = '/tmp/.X11-unix/X0'
-    x11_family = socket.AF_UNIX
+X11_BUFFER_SIZE = 4 * DEFAULT_BUFFER_SIZE
+
+_x11_loop: Optional[EventLoop] = None
+_x11_loop_lock = threading.Lock()
+
+
+X11_DISPLAY_OFFSET = 6000        # TCP port of display 0
+X11_UNIX_DIR = '/tmp/.X11-unix'
+X11_POOL_SIZE = 2               # Connections to the local display kept open ready for new X11 channels
+X11_POOL_MAX_AGE = 10           # Seconds before an unused pooled connection is dropped, before the X server drops it
+X11_START_TIMEOUT = 10          # Seconds to keep trying to connect while an X server which was started comes up
+X11_START_RETRY = 0.25
+MIT_MAGIC_COOKIE = 'MIT-MAGIC-COOKIE-1'
+X11_SETUP_HEADER_SIZE = 12      # Byte order, major and minor version and the lengths of the authorization
+
+FAMILY_LOCAL = 256              # Xauthority address families
+FAMILY_WILD = 65535
+XAUTH_SHORT = struct.Struct('>H')
 
 
 class X11ServerConnectionFailure(BaseException):
@@ -29,6 +53,134 @@ class X11ServerConnectionFailure(BaseException):
         self.message += error
 
 
+class DisplayAddress(NamedTuple):
+    family: int
+    address: str | tuple
+
+
+class XAuthEntry(NamedTuple):
+    family: int
+    address: bytes
+    number: str
+    name: str
+    data: bytes
+
+
+def local_display() -> str:
+    """
+    The display X11 channels are relayed to, from $DISPLAY, otherwise display 0 of this machine
+    """
+    return os.environ.get('DISPLAY') or (':0' if hasattr(socket, 'AF_UNIX') and os.name != 'nt' else 'localhost:0')
+
+
+@functools.lru_cache(maxsize=16)
+def parse_display(display: str) -> tuple[int, tuple[DisplayAddress, ...]]:
+    """
+    The number of a display and the addresses to connect to it on, from a name such as :0, unix:0, localhost:10.0,
+    or the path of a socket ending with the display number, as XQuartz sets. Local displays are tried as abstract
+    sockets first where there are any, then in X11_UNIX_DIR. Names are only parsed and resolved once.
+    """
+    host, separator, number = display.rpartition(':')
+    if not separator:
+        raise ValueError(f'{display} is not an X11 display name')
+    number = int(number.split('.')[0])
+    if host.startswith('/'):
+        return number, (DisplayAddress(socket.AF_UNIX, display),)
+    if host in ('', 'unix') and hasattr(socket, 'AF_UNIX'):
+        path = f'{X11_UNIX_DIR}/X{number}'
+        abstract = [DisplayAddress(socket.AF_UNIX, '\0' + path)] if sys.platform.startswith('linux') else []
+        return number, tuple(abstract + [DisplayAddress(socket.AF_UNIX, path)])
+    host = host.strip('[]') if host not in ('', 'unix') else 'localhost'
+    addresses = socket.getaddrinfo(host, X11_DISPLAY_OFFSET + number, type=socket.SOCK_STREAM)
+    return number, tuple(DisplayAddress(family, address) for family, _, _, _, address in addresses)
+
+
+def xauthority_path() -> str:
+    return os.environ.get('XAUTHORITY') or os.path.expanduser('~/.Xauthority')
+
+
+@functools.lru_cache(maxsize=4)
+def _read_xauthority(path: str, modified: float) -> tuple[XAuthEntry, ...]:
+    entries = []
+    with open(path, 'rb') as f:
+        data = f.read()
+    offset = 0
+    try:
+        while offset < len(data):
+            family, = XAUTH_SHORT.unpack_from(data, offset)
+            offset += XAUTH_SHORT.size
+            fields = []
+            for _ in range(4):
+                length, = XAUTH_SHORT.unpack_from(data, offset)
+                offset += XAUTH_SHORT.size
+                fields.append(data[offset:offset + length])
+                offset += length
+            address, number, name, cookie = fields
+            entries.append(XAuthEntry(family, address, number.decode(), name.decode(), cookie))
+    except struct.error:
+        pass            # A truncated file, use the entries before the end
+    return tuple(entries)
+
+
+def read_xauthority(path: str = None) -> tuple[XAuthEntry, ...]:
+    """
+    Entries in the Xauthority file, only read again when it has been modified
+    """
+    path = path or xauthority_path()
+    try:
+        return _read_xauthority(path, os.stat(path).st_mtime)
+    except OSError:
+        return ()
+
+
+def xauth_cookie(display: str = None) -> Optional[tuple[str, bytes]]:
+    """
+    The authorization name and data for connecting to the display, None if there is none in the Xauthority file
+    """
+    try:
+        number, addresses = parse_display(display or local_display())
+    except (OSError, ValueError):
+        return None
+    local = addresses[0].family == getattr(socket, 'AF_UNIX', None)
+    hostname = socket.gethostname().encode()
+    for entry in read_xauthority():
+        if entry.number != str(number) or entry.name != MIT_MAGIC_COOKIE:
+            continue
+        if entry.family == FAMILY_WILD or not local or entry.family == FAMILY_LOCAL and entry.address == hostname:
+            return entry.name, entry.data
+    return None
+
+
+def replace_cookie(setup: bytes | bytearray, fake_cookie: bytes, cookie: Optional[tuple[str, bytes]]):
+    """
+    The connection setup sent by an X11 client with the fake cookie given to the server replaced by the real one,
+    and the length of the setup. None if setup is incomplete.
+
+    :raises: ValueError: if the client didn't send the fake cookie
+    """
+    if len(setup) < X11_SETUP_HEADER_SIZE:
+        return None
+    byte_order = '>' if setup[0] == ord('B') else '<'
+    name_length, data_length = struct.unpack_from(byte_order + 'HH', setup, 6)
+    name_end = X11_SETUP_HEADER_SIZE + _pad(name_length)
+    end = name_end + _pad(data_length)
+    if len(setup) < end:
+        return None
+    name = bytes(setup[X11_SETUP_HEADER_SIZE:X11_SETUP_HEADER_SIZE + name_length]).decode('latin-1')
+    data = bytes(setup[name_end:name_end + data_length])
+    if name != MIT_MAGIC_COOKIE or data != fake_cookie:
+        raise ValueError('X11 connection rejected because of wrong authentication')
+    name, data = cookie or ('', b'')
+    header = setup[:6] + struct.pack(byte_order + 'HHH', len(name), len(data), 0)
+    encoded = name.encode('latin-1')
+    return bytes(header) + encoded + bytes(_pad(len(encoded)) - len(encoded)) + data + \
+        bytes(_pad(len(data)) - len(data)), end
+
+
+def _pad(length: int) -> int:
+    return (length + 3) & ~3
+
+
 potential_x11_servers: dict[str, tuple[list[str], list[str]]]
 
 if os.name == "nt":
@@ -44,6 +196,8 @@ else:
 
 
 x11_server_processes: list[subprocess.Popen] = []
+_x11_server_started: Optional[Future] = None
+_x11_server_lock = threading.Lock()
 
 
 def terminate_x11_servers():
@@ -51,106 +205,385 @@ def terminate_x11_servers():
         p.terminate()
 
 
-def start_x11_server() -> bool:
-    path = None
-    args = []
+@functools.cache
+def find_x11_server() -> Optional[list[str]]:
+    """
+    The command to start the first X server found, looked for once per process
+    """
     for k, v in potential_x11_servers.items():
-        path, args = v
-        where = 'where' if os.name == 'nt' else 'which'
-        if subprocess.run([where, k]).returncode == 0:
-            path = k            # X Server Application is in Windows Path
-            break
-        else:
-            try:
-                path = next(filter(os.path.exists, path))
-                break
-            except StopIteration:
-                continue
-    if path:
-        args = [path] + args
+        paths, args = v
+        if shutil.which(k):
+            return [k] + args       # X Server Application is in the path
+        path = next(filter(os.path.exists, paths), None)
+        if path:
+            return [path] + args
+    return None
+
+
+def start_x11_server() -> bool:
+    args = find_x11_server()
+    if args:
         x11_server_processes.append(subprocess.Popen(args))
         return True
     return False
 
 
-def connect_to_x11_server(x11_try_start_server: bool = False) -> socket.socket:
-    local_x11_socket = socket.socket(family=x11_family)
-    for i in range(0, 2):
+def ensure_x11_server() -> Future:
+    """
+    Start an X server in the executor the first time it is needed. The result is whether one was started.
+    """
+    global _x11_server_started
+    with _x11_server_lock:
+        if not _x11_server_started:
+            _x11_server_started = executor.submit(start_x11_server)
+        return _x11_server_started
+
+
+def _probe_display(display: str):
+    try:
+        connect_to_x11_server(display=display).close()
+    except X11ServerConnectionFailure:
+        ensure_x11_server()
+
+
+def connect_to_x11_server(x11_try_start_server: bool = False, display: str = None) -> socket.socket:
+    """
+    Connect to the local display, blocking until connected
+    """
+    display = display or local_display()
+    deadline = time.monotonic() + X11_START_TIMEOUT
+    error = None
+    try:
+        addresses = parse_display(display)[1]
+    except (OSError, ValueError) as e:
+        raise X11ServerConnectionFailure(str(e))
+    while True:
+        for family, address in addresses:
+            local_x11_socket = socket.socket(family=family)
+            try:
+                logger.debug('Connecting to X11 server %s', address)
+                local_x11_socket.connect(address)
+                return local_x11_socket
+            except OSError as e:
+                local_x11_socket.close()
+                error = e
+        if not x11_try_start_server or not ensure_x11_server().result() or time.monotonic() > deadline:
+            raise X11ServerConnectionFailure(str(error))
+        time.sleep(X11_START_RETRY)
+
+
+class DisplayPool:
+    """
+    Connections to the local display opened ahead of time, so a new X11 channel doesn't have to wait for a connect.
+
+    Connections are only kept while an X11Session for the display is open. The pool is filled when the first is
+    added and after each connection is taken, and is closed with the last session. Pooled connections which the server
+    closes, or which have been waiting for X11_POOL_MAX_AGE, are dropped without being replaced, so an idle pool
+    doesn't keep reconnecting to the X server. The address which worked last is tried first. Must be used from the
+    loop thread.
+    """
+
+    def __init__(self, loop: EventLoop, display: str, size: int = X11_POOL_SIZE, max_age: float = X11_POOL_MAX_AGE):
+        self.loop = loop
+        self.display = display
+        self.size = size
+        self.max_age = max_age
+        self.idle: dict[socket.socket, TimerHandle] = {}
+        self.warming = 0
+        self.preferred = 0
+        self.sessions: set['X11Session'] = set()
+        self.closed = False
+
+    def __repr__(self) -> str:
+        return f'<DisplayPool({self.display}, sessions={len(self.sessions)}, idle={len(self.idle)})>'
+
+    def add(self, session: 'X11Session'):
+        self.sessions.add(session)
+        self._refill()
+
+    def remove(self, session: 'X11Session'):
+        self.sessions.discard(session)
+        if not self.sessions:
+            self.close()
+
+    def get(self, callback: Callable[[Optional[socket.socket], Optional[OSError]], None]):
+        """
+        Call callback with a connection to the display, or the error if it couldn't be connected to
+        """
+        if self.idle:
+            local_x11_socket, timer = self.idle.popitem()
+            timer.cancel()
+            self.loop.unregister(local_x11_socket)
+            callback(local_x11_socket, None)
+            self._refill()
+            return
+        self._connect(partial(self._connected, callback))
+
+    def _connected(self, callback, local_x11_socket: Optional[socket.socket], error: Optional[OSError]):
+        callback(local_x11_socket, error)
+        if local_x11_socket:
+            self._refill()
+
+    def _refill(self):
+        if self.closed or not self.sessions:
+            return
+        for _ in range(self.size - len(self.idle) - self.warming):     # Counted once, as failures come back at once
+            self.warming += 1
+            self._connect(self._warmed)
+
+    def _warmed(self, local_x11_socket: Optional[socket.socket], error: Optional[OSError]):
+        self.warming -= 1
+        if not local_x11_socket:
+            return
+        if self.closed:
+            local_x11_socket.close()
+            return
+        self.idle[local_x11_socket] = self.loop.call_later(self.max_age, self._drop, local_x11_socket)
+        # Only readable if the server has closed it
+        self.loop.register(local_x11_socket, selectors.EVENT_READ, lambda sock, mask: self._drop(sock))
+
+    def _drop(self, local_x11_socket: socket.socket):
+        timer = self.idle.pop(local_x11_socket, None)
+        if timer:
+            timer.cancel()
+            self.loop.unregister(local_x11_socket)
+            local_x11_socket.close()
+
+    def _connect(self, callback, attempt: int = 0, error: OSError = None):
+        try:
+            addresses = parse_display(self.display)[1]
+        except (OSError, ValueError) as e:
+            callback(None, e if isinstance(e, OSError) else OSError(str(e)))
+            return
+        if attempt >= len(addresses):
+            callback(None, error)
+            return
+        index = (self.preferred + attempt) % len(addresses)
+        family, address = addresses[index]
+        local_x11_socket = socket.socket(family=family)
+        local_x11_socket.setblocking(False)
+        code = local_x11_socket.connect_ex(address)
+        if code in (errno.EINPROGRESS, errno.EWOULDBLOCK):
+            self.loop.register(local_x11_socket, selectors.EVENT_WRITE,
+                               partial(self._connect_done, callback, attempt, index))
+            return
+        self._finish_connect(callback, attempt, index, local_x11_socket, code)
+
+    def _connect_done(self, callback, attempt: int, index: int, local_x11_socket: socket.socket, mask: int):
+        self.loop.unregister(local_x11_socket)
+        code = local_x11_socket.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        self._finish_connect(callback, attempt, index, local_x11_socket, code)
+
+    def _finish_connect(self, callback, attempt: int, index: int, local_x11_socket: socket.socket, code: int):
+        if code:
+            local_x11_socket.close()
+            self._connect(callback, attempt + 1, OSError(code, os.strerror(code)))
+            return
+        self.preferred = index
+        callback(local_x11_socket, None)
+
+    def close(self):
+        self.closed = True
+        if _display_pools.get(self.display) is self:
+            del _display_pools[self.display]
+        for local_x11_socket, timer in self.idle.items():
+            timer.cancel()
+            self.loop.unregister(local_x11_socket)
+            local_x11_socket.close()
+        self.idle.clear()
+
+
+_display_pools: dict[str, DisplayPool] = {}
+
+
+def display_pool(loop: EventLoop, display: str = None) -> DisplayPool:
+    """
+    The pool of connections to the display shared by every session in the X11 loop. Must be called from the loop
+    thread.
+    """
+    display = display or local_display()
+    pool = _display_pools.get(display)
+    if not pool or pool.loop is not loop or pool.closed:
+        pool = _display_pools[display] = DisplayPool(loop, display)
+    return pool
+
+
+class X11Session:
+    """
+    X11 forwarding for one shell session.
+
+    Paramiko calls handler in the transport thread for each X11 channel the server opens, which hands the channel
+    straight to the X11 loop shared by every session. There it is given a connection to the local display from the
+    pool, and the two are relayed with buffers large enough for the bursts of requests and images X11 clients send.
+    Relays close themselves when either side closes, any left are closed with the session.
+
+    With the fake cookie the server was given, the connection setup each X11 client sends is read first and the fake
+    cookie is replaced by the display's real one, or removed if it has none. Clients which don't send the fake cookie
+    are disconnected.
+    """
+
+    def __init__(self, loop: EventLoop, x11_try_start_server: bool = False, share: Share = None,
+                 buffer_size: int = X11_BUFFER_SIZE, display: str = None, cookie: bytes = None):
+        self.loop = loop
+        self.x11_try_start_server = x11_try_start_server
+        self.share = share
+        self.buffer_size = buffer_size
+        self.display = display or local_display()
+        self.cookie = cookie
+        self.relays: set[Relay] = set()
+        self.setups: dict[paramiko.Channel, bytearray] = {}
+        self.connecting: set[paramiko.Channel] = set()
+        self.pool: Optional[DisplayPool] = None
+        self.closed = False
+        self.loop.call_soon(self._attach)
+
+    def __repr__(self) -> str:
+        return f'<X11Session(relays={len(self.relays)}, connecting={len(self.connecting)})>'
+
+    def _attach(self):
+        if not self.closed:
+            self.pool = display_pool(self.loop, self.display)
+            self.pool.add(self)
+
+    def handler(self, channel: paramiko.Channel, address: tuple[str, int]):
+        logger.info('X11 channel opened from %s', address)
+        self.loop.call_soon(self._open, channel)
+
+    def _open(self, channel: paramiko.Channel):
+        if self.closed:
+            channel.close()
+        elif self.cookie:
+            self.setups[channel] = bytearray()
+            channel.setblocking(False)
+            self.loop.register(channel, selectors.EVENT_READ, self._read_setup)
+        else:
+            self._connect(channel, b'')
+
+    def _read_setup(self, channel: paramiko.Channel, mask: int):
+        setup = self.setups[channel]
         try:
-            logger.debug('Connecting to X11 server %s', x11_server)
-            local_x11_socket.connect(x11_server)
-            break
-        except socket.error as e:
-            if i == 0 and x11_try_start_server:
-                if not start_x11_server():
-                    raise X11ServerConnectionFailure(str(e))
-            else:
-                raise X11ServerConnectionFailure
-    return local_x11_socket
-
-
-def _x11_handler(channels: dict[int, tuple], selector: selectors.BaseSelector, x11_try_start_server: bool,
-                channel: paramiko.Channel, address: tuple[str, int]):
-    '''handler for incoming x11 connections
-    for each x11 incoming connection,
-    - get a connection to the local display
-    - maintain bidirectional map of remote x11 channel to local x11 channel
-    - add the descriptors to the poller
-    - queue the channel (use transport.accept())'''
-    x11_chanfd = channel.fileno()
-    local_x11_socket = connect_to_x11_server(x11_try_start_server)
-    local_x11_socket_fileno = local_x11_socket.fileno()
-    channels[x11_chanfd] = channel, local_x11_socket
-    channels[local_x11_socket_fileno] = local_x11_socket, channel
-    selector.register(channel, selectors.EVENT_READ)
-    selector.register(local_x11_socket, selectors.EVENT_READ)
-    transport = channel.get_transport()
-    transport._queue_incoming_channel(channel)
-
-
-def x11_handler(channels: dict[int, tuple], selector: selectors.BaseSelector, x11_try_start_server: bool,
-                channel: paramiko.Channel, address: tuple[str, int]):
-    """
-    Run in thread so as not to block terminal while connectiing to x11 server
-    """
-    logger.info('Running X11 handler')
-    executor.submit(_x11_handler, channels, selector, x11_try_start_server, channel, address)
-
-
-def process_x11(session, channels: dict[int, tuple], selector: selectors.BaseSelector):
-    # accept first remote x11 connection
-    transport = session.get_transport()
-
-    while not session.exit_status_ready():
-        if not bool(selector.get_map()):    # Select will fail in Windows if no sockets are registered
-            transport.accept(timeout=0.25)
+            data = channel.recv(self.buffer_size)
+        except (BlockingIOError, socket.timeout):
+            return
+        except OSError:
+            data = b''
+        setup += data
+        try:
+            replaced = replace_cookie(setup, self.cookie, xauth_cookie(self.display)) if data else False
+        except ValueError as e:
+            logger.warning(str(e))
+            replaced = False
+        if replaced is None:
+            return
+        self.loop.unregister(channel)
+        del self.setups[channel]
+        if not replaced:
+            channel.close()
+            return
+        rewritten, length = replaced
+        self._connect(channel, rewritten + setup[length:])
+
+    def _connect(self, channel: paramiko.Channel, initial: bytes, deadline: float = None):
+        self.connecting.add(channel)
+        self.pool.get(partial(self._connected, channel, initial, deadline))
+
+    def _connected(self, channel: paramiko.Channel, initial: bytes, deadline: Optional[float],
+                   local_x11_socket: Optional[socket.socket], error: Optional[OSError]):
+        if self.closed or channel not in self.connecting:
+            if local_x11_socket:
+                local_x11_socket.close()
+            return
+        self.connecting.discard(channel)
+        if local_x11_socket:
+            self._start_relay(channel, local_x11_socket, initial)
+        elif deadline and time.monotonic() < deadline:
+            self.connecting.add(channel)
+            self.loop.call_later(X11_START_RETRY, self._retry, channel, initial, deadline)
+        elif self.x11_try_start_server and not deadline:
+            self.connecting.add(channel)
+            future = ensure_x11_server()
+            future.add_done_callback(
+                lambda f: self.loop.call_soon(self._server_started, channel, initial, error, f))
         else:
-            for key, mask in selector.select(timeout=0.5):
-                fileObj, fd, events, data = key
-                # accept subsequent x11 connections if any
-                if len(transport.server_accepts) > 0:
-                    transport.accept()
-                # data either on local/remote x11 socket
-                if fd in channels.keys():
-                    channel, counterpart = channels[fd]
-                    try:
-                        # forward data between local/remote x11 socket.
-                        data = channel.recv(4096)
-                        counterpart.sendall(data)
-                    except socket.error:
-                        channel.close()
-                        counterpart.close()
-                        del channels[fd]
-                        selector.unregister(channel)
-                        selector.unregister(counterpart)
+            logger.error(X11ServerConnectionFailure(str(error)).message)
+            channel.close()
+
+    def _retry(self, channel: paramiko.Channel, initial: bytes, deadline: float):
+        if channel in self.connecting:
+            self.connecting.discard(channel)
+            self._connect(channel, initial, deadline)
+
+    def _server_started(self, channel: paramiko.Channel, initial: bytes, error: OSError, future: Future):
+        if channel not in self.connecting:
+            return
+        self.connecting.discard(channel)
+        if future.exception() or not future.result():
+            logger.error(X11ServerConnectionFailure(str(error)).message)
+            channel.close()
+            return
+        self._connect(channel, initial, time.monotonic() + X11_START_TIMEOUT)
+
+    def _start_relay(self, channel: paramiko.Channel, local_x11_socket: socket.socket, initial: bytes):
+        if initial:
+            try:
+                local_x11_socket.setblocking(True)
+                local_x11_socket.sendall(initial)
+            except OSError as e:
+                logger.error(X11ServerConnectionFailure(str(e)).message)
+                local_x11_socket.close()
+                channel.close()
+                return
+        relay = Relay(self.loop, channel, local_x11_socket, self.buffer_size, on_close=self.relays.discard,
+                      share=self.share)
+        self.relays.add(relay)
+        relay.start()
+
+    def _close(self):
+        self.closed = True
+        for relay in list(self.relays):
+            relay.close()
+        for channel in self.setups:
+            self.loop.unregister(channel)
+            channel.close()
+        self.setups.clear()
+        for channel in self.connecting:
+            channel.close()
+        self.connecting.clear()
+        if self.pool:
+            self.pool.remove(self)
+            self.pool = None
+
+    def close(self):
+        if self.loop.in_loop_thread() or not self.loop.running:
+            self._close()
+        else:
+            self.loop.call_soon(self._close)
+
+
+def x11_loop() -> EventLoop:
+    """
+    The loop which relays the X11 connections of every session in the process, started when first needed
+    """
+    global _x11_loop
+    with _x11_loop_lock:
+        if not _x11_loop:
+            _x11_loop = EventLoop(name='terminalX-x11')
+        _x11_loop.start()
+        return _x11_loop
 
 
 def register_x11(session: paramiko.Channel, screen_number: int = None, auth_protocol: str = None,
-                 x11_try_start_server: bool = False) -> threading.Thread:
-    selector = selectors.DefaultSelector()
-    channels = {}
-    handler = partial(x11_handler, channels, selector, x11_try_start_server)
-    session.request_x11(handler=handler, screen_number=screen_number, auth_protocol=auth_protocol)
-    thread = threading.Thread(target=process_x11, args=(session, channels, selector))
-    thread.start()
-    return thread
+                 x11_try_start_server: bool = False, share: Share = None) -> X11Session:
+    """
+    Request X11 forwarding for the session. The local display is found, and started if need be, in the background
+    while the shell starts, and the session's display pool opens connections ready for the first X11 channel.
+    """
+    loop = x11_loop()
+    display = local_display()
+    x11_session = X11Session(loop, x11_try_start_server, share, display=display)
+    if x11_try_start_server:
+        executor.submit(_probe_display, display)
+    fake_cookie = session.request_x11(handler=x11_session.handler, screen_number=screen_number,
+                                      auth_protocol=auth_protocol)
+    x11_session.cookie = binascii.unhexlify(fake_cookie)
+    return x11_session
@@ -93,6 +93,22 @@ def ssh_client_with_src_tunnel_connected(ssh_client_with_src_tunnel) -> Client:
     ssh_client_with_src_tunnel.close()
 
 
+@pytest.fixture
+def ssh_client_with_src_tunnel_event_loop(ssh_host, ssh_port, username, tunnel_port, next_hop, next_hop_port) -> Client:
+    client = Client(ssh_host, port=ssh_port, username=username, timeout=5, term='linux', forward_engine="selector",
+                    tunnels=[{'src': ('127.0.0.1', tunnel_port), 'dst': (next_hop, next_hop_port)}])
+    yield client
+    client.close()
+
+
+@pytest.fixture
+def ssh_client_with_src_tunnel_event_loop_connected(ssh_client_with_src_tunnel_event_loop) -> Client:
+    ssh_client_with_src_tunnel_event_loop.connect()
+    ssh_client_with_src_tunnel_event_loop.wait_started()
+    yield ssh_client_with_src_tunnel_event_loop
+    ssh_client_with_src_tunnel_event_loop.close()
+
+
 @pytest.fixture
 def ssh_client_via_tunnel(tunnel_port, username) -> Client:
     client = Client("127.0.0.1", port=tunnel_port, username=username, timeout=10, x11=False, term='linux')
@@ -0,0 +1,50 @@
+import asyncio
+
+from terminalX.async_client import AsyncClient
+
+
+def test_async_exec(ssh_client):
+    async def run():
+        async with AsyncClient(ssh_client) as client:
+            await client.connect()
+            return await client.exec('echo Hello World; echo Error >&2; exit 3', timeout=10)
+
+    result = asyncio.run(run())
+    assert result.stdout == b'Hello World\n'
+    assert result.stderr == b'Error\n'
+    assert result.exit_status == 3
+
+
+def test_async_shell(ssh_client):
+    async def run():
+        async with AsyncClient(ssh_client) as client:
+            await client.connect()
+            await client.invoke_shell()
+            await client.send('echo Hello World\n')
+            await client.send('exit\n')
+            output = b''
+            async for data in client:
+                output += data
+            return output, client.display_screen_as_text()
+
+    output, screen = asyncio.run(run())
+    assert b'Hello World' in output
+    assert 'Hello World' in screen
+
+
+class ClosedChannel:
+    out_max_packet_size = 32768
+
+    def send_ready(self):
+        return True
+
+    def send(self, data):
+        return 0
+
+
+def test_async_send_closed_channel():
+    client = AsyncClient(host='localhost', x11=False)
+    client.client.ssh_shell = ClosedChannel()
+    client.client.shell_active_event.set()
+    asyncio.run(asyncio.wait_for(client.send('echo Hello World\n'), 5))
+    assert not client.client.shell_active_event.is_set()
@@ -1,6 +1,116 @@
-from terminalX.forwarder import forward_tunnel
+from concurrent.futures import Future
+import errno
+import selectors
+import socket
+import threading
 import time
 
+import pytest
+
+from terminalX import forwarder
+from terminalX.event_loop import EventLoop
+from terminalX.forwarder import forward_tunnel
+from terminalX.paramiko_util import DNSCache
+
+
+class DualStackTransport:
+    """
+    Blackholes direct-tcpip channels to IPv6 addresses and connects those to IPv4 addresses to an echo socket
+    """
+
+    def __init__(self):
+        self.requests = []
+
+    def open_channel(self, kind, dest_addr, src_addr, timeout=None):
+        self.requests.append(dest_addr)
+        if ':' in dest_addr[0]:
+            time.sleep(timeout)
+            raise socket.timeout()
+        channel, echo = socket.socketpair()
+
+        def serve():
+            with echo:
+                while data := echo.recv(65536):
+                    echo.sendall(data)
+
+        threading.Thread(target=serve, daemon=True).start()
+        return channel
+
+
+def dual_stack_resolver(hostname: str) -> Future:
+    future = Future()
+    future.set_result([(socket.AF_INET6, ('2001:db8::1', 0, 0, 0)), (socket.AF_INET, ('192.0.2.1', 0))])
+    return future
+
+
+@pytest.mark.parametrize('use_loop', [False, True])
+def test_forward_server_happy_eyeballs(monkeypatch, use_loop):
+    monkeypatch.setattr(forwarder, 'dns_cache', DNSCache(dual_stack_resolver))
+    loop = EventLoop() if use_loop else None
+    transport = DualStackTransport()
+    server = forward_tunnel(0, 'dual-stack.example', 8080, transport, '127.0.0.1', loop=loop, attempt_delay=0.05,
+                            open_timeout=5)
+    try:
+        server.wait_started(5)
+        with socket.create_connection(server.server_address, timeout=2) as sock:
+            sock.sendall(b'hello')
+            assert sock.recv(5) == b'hello'     # Didn't wait for the blackholed IPv6 attempt to time out
+        assert transport.requests == [('2001:db8::1', 8080, 0, 0), ('192.0.2.1', 8080)]
+    finally:
+        server.shutdown()
+        if loop:
+            loop.stop()
+
+
+class ExhaustedSocket:
+    """
+    A listening socket which can't accept connections while the process is out of file descriptors
+    """
+
+    def __init__(self, sock: socket.socket, failures: int):
+        self.sock = sock
+        self.failures = failures
+        self.accepts = 0
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def accept(self):
+        self.accepts += 1
+        if self.accepts <= self.failures:
+            raise OSError(errno.EMFILE, 'Too many open files')
+        return self.sock.accept()
+
+    def close(self):
+        self.sock.close()
+
+
+def test_loop_forward_server_pauses_accepting(monkeypatch):
+    monkeypatch.setattr(forwarder, 'ACCEPT_RETRY_DELAY', 0.3)
+    loop = EventLoop()
+    server = forward_tunnel(0, '192.0.2.1', 8080, DualStackTransport(), '127.0.0.1', loop=loop, remote_dns=True)
+    try:
+        server.wait_started(5)
+        replaced = threading.Event()
+
+        def replace_socket():
+            loop.unregister(server.socket)
+            server.socket = ExhaustedSocket(server.socket, 1)
+            loop.register(server.socket, selectors.EVENT_READ, server._accept)
+            replaced.set()
+
+        loop.call_soon(replace_socket)
+        assert replaced.wait(5)
+        start = time.monotonic()
+        with socket.create_connection(server.server_address, timeout=2) as sock:
+            sock.sendall(b'hello')
+            assert sock.recv(5) == b'hello'
+        assert time.monotonic() - start >= 0.3
+        assert server.socket.accepts == 3       # Failed, accepted, then would block. Not retried while paused
+    finally:
+        server.shutdown()
+        loop.stop()
+
 
 def test_forward_server(ssh_client_connected, tunnel_port, tunnel_to, ssh_port, ssh_client_via_tunnel):
     server = forward_tunnel(tunnel_port, tunnel_to, ssh_port, ssh_client_connected.transport, "127.0.0.1")
@@ -15,3 +125,21 @@ def test_forward_server(ssh_client_connected, tunnel_port, tunnel_to, ssh_port,
     assert screen[-2].startswith('Hello World')
     ssh_client_via_tunnel.close()
     server.shutdown()
+
+
+def test_forward_server_event_loop(ssh_client_connected, tunnel_port, next_hop, next_hop_port, ssh_client_via_tunnel):
+    loop = EventLoop()
+    server = forward_tunnel(tunnel_port, next_hop, next_hop_port, ssh_client_connected.transport, "127.0.0.1",
+                            loop=loop)
+    server.wait_started(5)
+    ssh_client_via_tunnel.connect()
+    ssh_client_via_tunnel.invoke_shell()
+    ssh_client_via_tunnel.send('echo Hello World')
+    time.sleep(0.1)
+    ssh_client_via_tunnel.send('\n')
+    time.sleep(0.2)
+    screen = ssh_client_via_tunnel.display_screen()
+    assert screen[-2].startswith('Hello World')
+    ssh_client_via_tunnel.close()
+    server.shutdown()
+    loop.stop()
@@ -0,0 +1,141 @@
+import socket
+import threading
+import time
+
+import paramiko
+import pytest
+
+from terminalX.event_loop import EventLoop
+from terminalX.happy_eyeballs import ChannelOpener, interleave, open_channel
+
+
+IPV6 = (socket.AF_INET6, ('::1', 80, 0, 0))
+IPV6_OTHER = (socket.AF_INET6, ('::2', 80, 0, 0))
+IPV4 = (socket.AF_INET, ('127.0.0.1', 80))
+
+
+class Channel:
+    def __init__(self, addr):
+        self.addr = addr
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class SlowTransport:
+    """
+    Opens a channel to each address after a delay, or fails after the delay if it is given as an exception
+    """
+
+    def __init__(self, behaviour: dict):
+        self.behaviour = behaviour
+        self.attempts = []
+        self.channels = []
+        self.lock = threading.Lock()
+
+    def open_channel(self, kind, dest_addr, src_addr, timeout=None):
+        with self.lock:
+            self.attempts.append(dest_addr)
+        delay, error = self.behaviour[dest_addr]
+        time.sleep(min(delay, timeout))
+        if delay > timeout:
+            raise paramiko.SSHException("Timeout opening channel.")
+        if error:
+            raise error
+        channel = Channel(dest_addr)
+        self.channels.append(channel)
+        return channel
+
+
+def test_interleave():
+    assert interleave([IPV6, IPV6_OTHER, IPV4]) == [IPV6, IPV4, IPV6_OTHER]
+    assert interleave([IPV4, IPV6, IPV6_OTHER]) == [IPV4, IPV6, IPV6_OTHER]
+
+
+def test_open_channel_blackholed_address():
+    transport = SlowTransport({IPV6[1]: (1, None), IPV4[1]: (0, None)})
+    start = time.monotonic()
+    channel, af, addr = open_channel(transport, [IPV6, IPV4], ('127.0.0.1', 1), attempt_delay=0.05)
+    assert time.monotonic() - start < 0.5
+    assert (af, addr) == IPV4
+    assert not channel.closed
+    time.sleep(1.2)
+    loser = next(channel for channel in transport.channels if channel.addr == IPV6[1])
+    assert loser.closed
+
+
+def test_open_channel_failures():
+    transport = SlowTransport({IPV6[1]: (0, ConnectionRefusedError()), IPV4[1]: (0.05, None)})
+    start = time.monotonic()
+    channel, af, addr = open_channel(transport, [IPV6, IPV4], ('127.0.0.1', 1), attempt_delay=5)
+    assert time.monotonic() - start < 1     # The next address was tried as soon as the first failed
+    assert (af, addr) == IPV4
+    transport = SlowTransport({IPV6[1]: (0, ConnectionRefusedError()), IPV4[1]: (0, ConnectionRefusedError())})
+    with pytest.raises(paramiko.ssh_exception.NoValidConnectionsError):
+        open_channel(transport, [IPV6, IPV4], ('127.0.0.1', 1))
+    transport = SlowTransport({IPV6[1]: (5, None), IPV4[1]: (5, None)})
+    with pytest.raises(TimeoutError):
+        open_channel(transport, [IPV6, IPV4], ('127.0.0.1', 1), attempt_delay=0.05, timeout=0.2)
+
+
+def test_channel_opener():
+    loop = EventLoop()
+    loop.start()
+    try:
+        transport = SlowTransport({IPV6[1]: (1, None), IPV6_OTHER[1]: (0, None), IPV4[1]: (0.05, None)})
+        results = []
+        opened = threading.Event()
+
+        def start():
+            opener = ChannelOpener(loop, transport, [IPV6, IPV6_OTHER, IPV4], ('127.0.0.1', 1), attempt_delay=0.2)
+            opener.start().add_done_callback(lambda future: (results.append(future.result()), opened.set()))
+
+        loop.call_soon(start)
+        assert opened.wait(5)
+        channel, af, addr = results[0]
+        assert (af, addr) == IPV4
+        assert transport.attempts == [IPV6[1], IPV4[1]]     # ::2 was never tried
+
+        transport = SlowTransport({IPV6[1]: (5, None)})
+        failed = threading.Event()
+
+        def start_timeout():
+            opener = ChannelOpener(loop, transport, [IPV6], ('127.0.0.1', 1), timeout=0.1)
+            opener.start().add_done_callback(lambda future: (results.append(future.exception()), failed.set()))
+
+        loop.call_soon(start_timeout)
+        assert failed.wait(5)
+        assert isinstance(results[-1], TimeoutError)
+    finally:
+        loop.stop()
+
+
+def test_channel_openers_dont_queue_behind_blackholed_attempts():
+    loop = EventLoop()
+    loop.start()
+    try:
+        transport = SlowTransport({IPV6[1]: (3, None), IPV4[1]: (0, None)})
+        results = []
+        lock = threading.Lock()
+        done = threading.Event()
+
+        def finished(future):
+            with lock:
+                results.append(future.exception() or future.result())
+                if len(results) == 40:
+                    done.set()
+
+        def start():
+            for _ in range(40):
+                opener = ChannelOpener(loop, transport, [IPV6, IPV4], ('127.0.0.1', 1), attempt_delay=0.05,
+                                       timeout=2)
+                opener.start().add_done_callback(finished)
+
+        start_time = time.monotonic()
+        loop.call_soon(start)
+        assert done.wait(5)
+        assert time.monotonic() - start_time < 1
+        assert all(result[1:] == IPV4 for result in results)
+    finally:
+        loop.stop()
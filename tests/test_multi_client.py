@@ -0,0 +1,47 @@
+import asyncio
+import socket
+import time
+
+import paramiko
+
+from terminalX.connections import Client
+from terminalX.multi_client import MultiClient
+
+
+def test_multi_client(ssh_host, ssh_port, username):
+    clients = [Client(ssh_host, port=ssh_port, username=username, name=f'host{i}', timeout=10, x11=False)
+               for i in range(5)]
+    clients.append(Client(ssh_host, port=1, username=username, name='unreachable', timeout=2, x11=False))
+    results = {result.client.name: result for result in MultiClient(clients, timeout=10).run_sync('echo Hello World')}
+    assert len(results) == 6
+    for i in range(5):
+        assert results[f'host{i}'].ok
+        assert results[f'host{i}'].result.stdout == b'Hello World\n'
+    assert not results['unreachable'].ok
+    assert results['unreachable'].error
+
+
+def test_multi_client_timeout(monkeypatch):
+    server = socket.create_server(('127.0.0.1', 0))      # Accepts connections but never sends a banner
+    server.settimeout(2)
+    port = server.getsockname()[1]
+    clients = [Client('127.0.0.1', port=port, username='user', name=f'hung{i}', x11=False) for i in range(4)]
+    connecting = []
+    with_timeouts = MultiClient._with_timeouts
+    monkeypatch.setattr(MultiClient, '_with_timeouts',
+                        lambda self, client: connecting.append(with_timeouts(self, client)) or connecting[-1])
+    multi_client = MultiClient(clients, max_concurrency=2, timeout=0.5)
+    start = time.monotonic()
+    results = list(multi_client.run_sync('echo Hello World'))
+    assert time.monotonic() - start < 3
+    assert all(isinstance(result.error, (asyncio.TimeoutError, paramiko.SSHException)) for result in results)
+    assert all(result.client in clients for result in results)
+    assert len(connecting) == 4
+    for _ in connecting:        # Every connection the copies made is closed, rather than left waiting for a banner
+        sock, _ = server.accept()
+        with sock:
+            sock.settimeout(2)
+            while sock.recv(1024):
+                pass
+    assert all(not client.transport or not client.transport.is_active() for client in connecting)
+    server.close()
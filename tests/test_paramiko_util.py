@@ -0,0 +1,86 @@
+from concurrent.futures import Future
+import socket
+import threading
+
+import pytest
+
+from terminalX.paramiko_util import DNSCache, with_port
+
+
+class CountingResolver:
+    """
+    Resolves names in a dict when release is called, counting the queries made
+    """
+
+    def __init__(self, names: dict):
+        self.names = names
+        self.queries = []
+        self.futures = []
+
+    def __call__(self, hostname: str) -> Future:
+        self.queries.append(hostname)
+        future = Future()
+        self.futures.append((hostname, future))
+        return future
+
+    def release(self):
+        for hostname, future in self.futures:
+            if hostname in self.names:
+                future.set_result(self.names[hostname])
+            else:
+                future.set_exception(socket.gaierror(socket.EAI_NONAME, 'Name or service not known'))
+        self.futures.clear()
+
+
+def test_dns_cache_coalesces_and_caches():
+    resolver = CountingResolver({'example.com': [(socket.AF_INET6, ('::1', 0, 0, 0)),
+                                                 (socket.AF_INET, ('127.0.0.1', 0))]})
+    cache = DNSCache(resolver)
+    futures = [cache.resolve_async('example.com') for _ in range(10)]
+    assert resolver.queries == ['example.com']
+    assert not any(future.done() for future in futures)
+    resolver.release()
+    assert cache.resolve('Example.COM', 443) == [(socket.AF_INET6, ('::1', 443, 0, 0)),
+                                                 (socket.AF_INET, ('127.0.0.1', 443))]
+    assert resolver.queries == ['example.com']
+
+
+def test_dns_cache_negative_and_expiry():
+    resolver = CountingResolver({})
+    cache = DNSCache(resolver, ttl=0, negative_ttl=60)
+    future = cache.resolve_async('missing.invalid')
+    resolver.release()
+    with pytest.raises(socket.gaierror):
+        future.result()
+    with pytest.raises(socket.gaierror):
+        cache.resolve('missing.invalid', 80)
+    assert resolver.queries == ['missing.invalid']
+    resolver.names['found.example'] = [(socket.AF_INET, ('10.0.0.1', 0))]
+    cache.resolve_async('found.example')
+    resolver.release()
+    cache.resolve_async('found.example')      # Positive answers aren't kept with a ttl of 0
+    assert resolver.queries == ['missing.invalid', 'found.example', 'found.example']
+
+
+def test_dns_cache_size():
+    resolver = CountingResolver({f'host{i}': [(socket.AF_INET, (f'10.0.0.{i}', 0))] for i in range(5)})
+    cache = DNSCache(resolver, max_entries=3)
+    for i in range(5):
+        cache.resolve_async(f'host{i}')
+    resolver.release()
+    assert list(cache.entries) == ['host2', 'host3', 'host4']
+
+
+def test_dns_cache_system_resolver():
+    cache = DNSCache()
+    threads = [threading.Thread(target=cache.resolve, args=('localhost', 22)) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    addresses = cache.resolve('localhost', 22)
+    assert addresses and all(address[1] == 22 for _, address in addresses)
+
+
+def test_with_port():
+    assert with_port([(socket.AF_INET6, ('fe80::1', 0, 1, 2))], 8080) == [(socket.AF_INET6, ('fe80::1', 8080, 1, 2))]
@@ -0,0 +1,39 @@
+from dataclasses import replace
+
+from terminalX.connections import Client
+from terminalX.pool import jump_transport_pool, TransportPool
+
+
+def test_transport_pool_reuses_transport(ssh_host, ssh_port, username):
+    pool = TransportPool(idle_timeout=5)
+    transports = set()
+    for _ in range(3):
+        client = Client(ssh_host, port=ssh_port, username=username, timeout=10, x11=False, transport_pool=pool)
+        client.connect()
+        assert list(client.command_result('echo Hello World')) == ['Hello World\n']
+        transports.add(client.transport)
+        client.close()
+    assert len(transports) == 1
+    pool.close()
+    assert not transports.pop().is_active()
+
+
+def test_duplicate(ssh_client_connected):
+    client = ssh_client_connected.duplicate()
+    assert client.transport is ssh_client_connected.transport
+    assert list(client.command_result('echo Hello World')) == ['Hello World\n']
+    client.close()
+    assert ssh_client_connected.transport.is_active()
+
+
+def test_jump_host_transport_shared(ssh_client_via_jump_server):
+    duplicate = replace(ssh_client_via_jump_server)
+    ssh_client_via_jump_server.connect()
+    duplicate.connect()
+    bastion = ssh_client_via_jump_server.sub_clients[0].transport
+    assert duplicate.sub_clients[0].transport is bastion
+    ssh_client_via_jump_server.close()
+    assert bastion.is_active()
+    duplicate.close()
+    assert not bastion.is_active()
+    assert not jump_transport_pool.transports
@@ -0,0 +1,56 @@
+import pytest
+
+from terminalX.recording import Recorder, RecordingReader, UnknownRecordingFormat
+from terminalX.replay import ReplayClient, replay
+
+
+output = ['Hello W'.encode(), 'ö'.encode()[:1], 'ö'.encode()[1:] + b'rld\r\n', b'\x1b[1;31mred\x1b[0m\r\n$ ']
+
+
+@pytest.mark.parametrize('format', ['asciicast', 'binary'])
+def test_recording(tmp_path, format):
+    path = tmp_path / 'session.rec'
+    with Recorder(path, 40, 10, format=format, term='xterm') as recorder:
+        for data in output:
+            recorder.output(data)
+        recorder.input(b'exit\n')
+    with RecordingReader(path) as reader:
+        assert reader.format == format
+        assert (reader.width, reader.height) == (40, 10)
+        assert reader.header['env'] == {'TERM': 'xterm'}
+        events = list(reader)
+    assert b''.join(event.data for event in events if event.kind == 'o') == b''.join(output)
+    assert [event.data for event in events if event.kind == 'i'] == [b'exit\n']
+    assert all(a.time <= b.time for a, b in zip(events, events[1:]))
+
+
+def test_recording_cut_off_character(tmp_path):
+    path = tmp_path / 'session.rec'
+    with Recorder(path, 40, 10) as recorder:
+        recorder.output(b'Hello W' + 'ö'.encode()[:1])
+    with RecordingReader(path) as reader:
+        assert b''.join(event.data for event in reader) == 'Hello W\ufffd'.encode()
+
+
+def test_not_a_recording(tmp_path):
+    path = tmp_path / 'session.rec'
+    path.write_text('Not a recording')
+    with pytest.raises(UnknownRecordingFormat):
+        RecordingReader(path)
+
+
+@pytest.mark.parametrize('format', ['asciicast', 'binary'])
+@pytest.mark.parametrize('screen_backend', ['pyte', 'fast'])
+def test_replay(tmp_path, format, screen_backend):
+    path = tmp_path / 'session.rec'
+    with Recorder(path, 20, 3, format=format) as recorder:
+        for data in output:
+            recorder.output(data)
+    client = ReplayClient('replay', recording=path, screen_backend=screen_backend, x11=False)
+    size, seconds = replay(client)
+    assert size == len(b''.join(output))
+    assert client.pty_size == (20, 3)
+    assert client.display_screen() == ['Hello Wörld         ', 'red                 ', '$                   ']
+    assert not client.shell_active
+    client.send('ignored')
+    client.close()
@@ -0,0 +1,102 @@
+import os
+import socket
+import threading
+import time
+
+from terminalX.event_loop import EventLoop
+from terminalX.relay import Relay, RelayBuffer, relay
+
+
+def test_relay_buffer_partial_writes():
+    source, source_peer = socket.socketpair()
+    dest, dest_peer = socket.socketpair()
+    buf = RelayBuffer(16)
+    source.sendall(b'0123456789abcdef')
+    assert buf.fill(source_peer) == 16
+    assert buf.free == 0
+    assert buf.drain(dest) == 16
+    assert not buf and buf.free == 16
+    assert dest_peer.recv(100) == b'0123456789abcdef'
+    source.sendall(b'0123456789')
+    buf.fill(source_peer)
+    buf.start = 6       # Simulate a partial write of 6 bytes
+    source.sendall(b'abcdef')
+    buf.fill(source_peer)
+    assert buf.end == 16
+    source.sendall(b'ghijkl')
+    assert buf.fill(source_peer) == 6     # Pending data moved to the start of the buffer to make space
+    buf.drain_all(dest)
+    assert dest_peer.recv(100) == b'6789abcdefghijkl'
+    for sock in (source, source_peer, dest, dest_peer):
+        sock.close()
+
+
+def test_relay():
+    client, relay_a = socket.socketpair()
+    relay_b, server = socket.socketpair()
+    thread = threading.Thread(target=relay, args=(relay_a, relay_b, 4096))
+    thread.start()
+    payload = os.urandom(1024 * 1024)
+    writer = threading.Thread(target=client.sendall, args=(payload,))
+    writer.start()
+    received = bytearray()
+    while len(received) < len(payload):
+        received += server.recv(65536)
+    writer.join()
+    assert received == payload
+    client.close()
+    server.close()
+    thread.join(5)
+    assert not thread.is_alive()
+
+
+def test_relay_half_close():
+    client, relay_a = socket.socketpair()
+    relay_b, server = socket.socketpair()
+    thread = threading.Thread(target=relay, args=(relay_a, relay_b, 4096))
+    thread.start()
+    payload = os.urandom(256 * 1024)
+    client.sendall(payload[:1024])
+    client.shutdown(socket.SHUT_WR)
+    received = bytearray()
+    while data := server.recv(65536):
+        received += data
+    assert received == payload[:1024]      # EOF passed on after the data
+    server.sendall(payload)                 # Other direction is still open
+    server.close()
+    received = bytearray()
+    while data := client.recv(65536):
+        received += data
+    assert received == payload
+    thread.join(5)
+    assert not thread.is_alive()
+    client.close()
+
+
+def test_relay_backpressure():
+    loop = EventLoop()
+    client, relay_a = socket.socketpair()
+    relay_b, server = socket.socketpair()
+    for sock in (relay_b, server):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+    r = Relay(loop, relay_a, relay_b, 4096)
+    loop.call_soon(r.start)
+    loop.start()
+    client.setblocking(False)
+    sent = 0
+    deadline = time.monotonic() + 1
+    while time.monotonic() < deadline:
+        try:
+            sent += client.send(b'x' * 65536)
+        except BlockingIOError:
+            time.sleep(0.01)
+    assert len(r.a_to_b.buffer) <= 4096
+    assert not r.a_to_b.want_read           # Stopped reading while the server isn't consuming
+    received = 0
+    client.close()
+    while data := server.recv(65536):
+        received += len(data)
+    assert received == sent
+    loop.stop()
+    server.close()
@@ -0,0 +1,99 @@
+from functools import partial
+import threading
+
+import pytest
+
+from terminalX.connections import Client
+from terminalX.screens import FastScreen, create_screen, fast_screen, register_screen_backend, screen_backends
+
+
+session = ''.join([
+    ''.join(f'line {i} {"x" * (i * 7 % 130)}\r\n' for i in range(60)),
+    '\x1b[1;31mred\x1b[0m normal \x1b[42mbackground\x1b[0m\r\n',
+    '\x1b[5;10Hmoved\x1b[K',
+    'wide 漢字テスト é done\r\n',
+    '\x1b[4hinserted\x1b[4l',
+    '\x1b(0lqqk\x1b(B\r\n',
+    '\x1b[3L\x1b[2M\x1b[5P\x1b[2@\x1b[1K',
+    '\x1bM\x1bD\ttab\x08\x08bs\r\n',
+    'text without a newline',
+])
+
+
+def feed(backend: str, data: str, chunk_size: int = 13):
+    screen, stream = create_screen(backend, 80, 24, 100)
+    for i in range(0, len(data), chunk_size):
+        stream.feed(data[i:i + chunk_size])
+    return screen
+
+
+def snapshot(screen) -> tuple:
+    return (screen.display, (screen.cursor.x, screen.cursor.y), screen.dirty,
+            [[screen.buffer[y][x] for x in range(screen.columns)] for y in range(screen.lines)])
+
+
+def test_fast_screen_matches_pyte():
+    pyte_screen = feed('pyte', session)
+    screen = feed('fast', session)
+    assert isinstance(screen, FastScreen)
+    assert snapshot(screen) == snapshot(pyte_screen)
+
+
+def test_fast_screen_history():
+    pyte_screen = feed('pyte', session)
+    screen = feed('fast', session)
+    for _ in range(3):
+        pyte_screen.prev_page()
+        screen.prev_page()
+        assert screen.display == pyte_screen.display
+    pyte_screen.next_page()
+    screen.next_page()
+    assert screen.display == pyte_screen.display
+    pyte_screen.resize(30, 100)
+    screen.resize(30, 100)
+    assert screen.display == pyte_screen.display
+
+
+def test_custom_screen_backend():
+    register_screen_backend('small', lambda width, height, history: create_screen('fast', 10, 2, history))
+    try:
+        screen, stream = create_screen('small', 80, 24, 100)
+        stream.feed('hello world')
+        assert screen.display == ['hello worl', 'd         ']
+    finally:
+        screen_backends.pop('small')
+
+
+@pytest.mark.parametrize('screen_backend', ['pyte', 'fast'])
+def test_client_screen_backend(screen_backend):
+    client = Client('localhost', screen_backend=screen_backend)
+    client.create_screen(20, 3)
+    client.feed(b'prompt$ ls\r\nfile\r\n')
+    assert client.display_screen() == ['prompt$ ls          ', 'file                ', '                    ']
+
+
+@pytest.mark.parametrize('screen_backend', ['pyte', 'fast'])
+def test_client_screen_changes_while_feeding(screen_backend):
+    client = Client('localhost', screen_backend=screen_backend)
+    client.create_screen(80, 24)
+    feeding = threading.Thread(target=lambda: [client.feed(b'line %d\r\n' % i) for i in range(20000)])
+    feeding.start()
+    while feeding.is_alive():
+        for line in client.display_screen_line_changes().values():
+            assert len(line) == 80
+    feeding.join()
+
+
+def test_fast_screen_spilled_history():
+    pyte_screen = feed('pyte', session)
+    screen, stream = create_screen(partial(fast_screen, page_size=4, memory_limit=0), 80, 24, 100)
+    stream.feed(session)
+    assert screen.history.top.spill_file
+    for _ in range(5):
+        pyte_screen.prev_page()
+        screen.prev_page()
+        assert screen.display == pyte_screen.display
+    for _ in range(5):
+        pyte_screen.next_page()
+        screen.next_page()
+        assert screen.display == pyte_screen.display
@@ -0,0 +1,83 @@
+import marshal
+
+import pytest
+
+from terminalX import scrollback as scrollback_module
+from terminalX.scrollback import MemoryBudget, Page, Scrollback, SpillFile
+
+
+class StringCodec:
+    def encode(self, lines: list[str]) -> bytes:
+        return marshal.dumps(lines)
+
+    def decode(self, data: bytes) -> list[str]:
+        return marshal.loads(data)
+
+    def size(self, line: str) -> int:
+        return len(line)
+
+
+def lines(count: int, start: int = 0) -> list[str]:
+    return [f'line {i}' for i in range(start, start + count)]
+
+
+@pytest.mark.parametrize('compress', [True, False])
+def test_scrollback(compress):
+    scrollback = Scrollback(StringCodec(), 1000, page_size=16, compress=compress, budget=MemoryBudget(None))
+    scrollback.extend(lines(1200))
+    assert len(scrollback) == 1000
+    assert len(scrollback.pages) > 1
+    assert scrollback[0] == 'line 200'
+    assert scrollback[500] == 'line 700'
+    assert scrollback[-1] == 'line 1199'
+    with pytest.raises(IndexError):
+        scrollback[1000]
+    assert [scrollback.pop() for _ in range(100)] == lines(100, 1100)[::-1]
+    scrollback.extend(lines(50, 2000))
+    assert [scrollback[i] for i in range(len(scrollback))] == lines(900, 200) + lines(50, 2000)
+    assert [scrollback.pop() for _ in range(len(scrollback))] == (lines(900, 200) + lines(50, 2000))[::-1]
+    assert not scrollback
+    with pytest.raises(IndexError):
+        scrollback.pop()
+
+
+def test_scrollback_spill(tmp_path):
+    scrollback = Scrollback(StringCodec(), 10000, page_size=16, memory_limit=0, budget=MemoryBudget(None),
+                            spill_directory=str(tmp_path))
+    scrollback.extend(lines(5000))
+    assert all(page.spilled for page in scrollback.pages)
+    assert scrollback.pages_memory == 0
+    assert scrollback[1234] == 'line 1234'
+    scrollback.extend(lines(6000, 5000))       # Oldest spilled pages dropped
+    assert scrollback[0] == 'line 1000'
+    assert [scrollback.pop() for _ in range(len(scrollback))] == lines(10000, 1000)[::-1]
+    assert scrollback.spill_file.end == 0
+    scrollback.close()
+
+
+def test_spill_file_compact(tmp_path, monkeypatch):
+    monkeypatch.setattr(scrollback_module, 'COMPACT_MIN_SIZE', 1000)
+    monkeypatch.setattr(scrollback_module, 'COMPACT_CHUNK_SIZE', 300)
+    spill_file = SpillFile(str(tmp_path))
+    pages = []
+    for i in range(10):
+        data = bytes([i]) * 250
+        pages.append(Page(i * 10, 10, None, len(data), spill_file.write(data)))
+    for page in pages[:6]:
+        spill_file.free(page)
+    assert spill_file.compact(pages[6:])
+    assert (spill_file.start, spill_file.end) == (0, 1000)
+    assert [spill_file.read(page.offset, page.length) for page in pages[6:]] == [bytes([i]) * 250 for i in range(6, 10)]
+    spill_file.close()
+
+
+def test_memory_budget():
+    budget = MemoryBudget(10000)
+    first = Scrollback(StringCodec(), 100000, page_size=64, compress=False, memory_limit=None, budget=budget)
+    second = Scrollback(StringCodec(), 100000, page_size=64, compress=False, memory_limit=None, budget=budget)
+    first.extend(lines(10000))
+    second.extend(lines(500))
+    assert budget.used <= 10000 + 2 * 64 * len('line 10000')
+    assert any(page.spilled for page in first.pages)
+    assert second[100] == 'line 100'
+    assert first[9999] == 'line 9999'
@@ -0,0 +1,77 @@
+import re
+import threading
+
+import pytest
+
+from terminalX.connections import Client
+from terminalX.recording import Recorder
+from terminalX.replay import ReplayClient, replay
+from terminalX.search import BLOCK_LINES, OutputIndex, SearchMatch, SearchNotEnabled, index_recording, required_literals
+
+
+def log_lines(count: int) -> list[str]:
+    return [f'{i} \x1b[31mERROR\x1b[0m connection refused' if i % 50 == 7 else f'{i} INFO request handled'
+            for i in range(count)]
+
+
+def feed_in_chunks(index: OutputIndex, text: str, size: int = 100):
+    for i in range(0, len(text), size):
+        index.feed(text[i:i + size])
+
+
+def test_search():
+    index = OutputIndex()
+    feed_in_chunks(index, '\r\n'.join(log_lines(1000)) + '\r\nprogress 10%\rprogress 100%\r\n$ ')
+    matches = index.search('ERROR')
+    assert [match.line for match in matches] == list(range(7, 1000, 50))
+    assert matches[0] == SearchMatch(7, 2, 7, '7 ERROR connection refused')
+    assert len(index.search(r'^\d*7 INFO')) == 80
+    assert index.search('error', re.IGNORECASE, limit=3) == matches[:3]
+    assert index.search('progress') == [SearchMatch(1000, 0, 8, 'progress 100%')]
+    assert index.search(r'^\$ $') == [SearchMatch(1001, 0, 2, '$ ')]
+    assert index.search('not in the output') == []
+
+
+def test_search_dropped_lines():
+    index = OutputIndex(max_lines=10 * BLOCK_LINES)
+    feed_in_chunks(index, '\n'.join(log_lines(5000)) + '\n')
+    assert len(index) == 5000
+    assert [match.line for match in index.search('ERROR')] == list(range(7 + 4700, 5000, 50))
+
+
+def test_search_while_feeding():
+    index = OutputIndex(max_lines=4 * BLOCK_LINES)
+    text = '\n'.join(log_lines(20000)) + '\n'
+    feeding = threading.Thread(target=feed_in_chunks, args=(index, text))
+    feeding.start()
+    while feeding.is_alive():
+        for match in index.search('ERROR'):
+            assert match.text.startswith(f'{match.line} ')      # Line numbers stay right as old blocks are dropped
+    feeding.join()
+
+
+@pytest.mark.parametrize('pattern,literals', [
+    ('connection refused', ['connection refused']),
+    (r'^\d+ ERROR: .*failed', [' ERROR: ', 'failed']),
+    ('colou?r (red)? green', ['colo', ' green']),
+    (r'10\.0\.0\.1', ['10.0.0.1']),
+    ('ERROR|WARNING', []),
+])
+def test_required_literals(pattern, literals):
+    assert required_literals(re.compile(pattern)) == literals
+
+
+def test_search_recording(tmp_path):
+    path = tmp_path / 'session.cast'
+    with Recorder(path, 80, 24) as recorder:
+        for line in log_lines(200):
+            recorder.output(f'{line}\r\n'.encode())
+    assert [match.line for match in index_recording(path).search('ERROR')] == [7, 57, 107, 157]
+    client = ReplayClient('replay', recording=path, index_output=True, headless=True, x11=False)
+    replay(client)
+    assert [match.line for match in client.search('ERROR')] == [7, 57, 107, 157]
+
+
+def test_search_not_enabled():
+    with pytest.raises(SearchNotEnabled):
+        Client('127.0.0.1').search('ERROR')
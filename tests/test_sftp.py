@@ -0,0 +1,127 @@
+import json
+import os
+import types
+
+import pytest
+
+from terminalX import sftp
+from terminalX.sftp import mapped, preallocate, Range, RESUME_SUFFIX, SFTPTransfer, split_ranges
+
+
+def test_split_ranges():
+    assert split_ranges(0, 4, 1024) == [Range(0, 0)]
+    assert split_ranges(1000, 4, 1024) == [Range(0, 1000)]
+    ranges = split_ranges(10 * 32768 + 5, 4, 32768)
+    assert ranges[0].start == 0 and ranges[-1].end == 10 * 32768 + 5
+    assert all(r.end == n.start and r.end % 32768 == 0 for r, n in zip(ranges, ranges[1:]))
+
+
+def test_mapped_window(tmp_path):
+    path = tmp_path / 'file'
+    with open(path, 'wb') as f:
+        preallocate(f, 200000)
+    assert path.stat().st_size == 200000
+    with open(path, 'r+b') as f:
+        with mapped(f, 70000, 5, writable=True) as view:
+            view[:] = b'hello'
+    with open(path, 'rb') as f:
+        with mapped(f, 70000, 5, writable=False) as view:
+            assert bytes(view) == b'hello'
+
+
+class FailingFile:
+    def __init__(self):
+        self.writes = 0
+
+    def set_pipelined(self, pipelined):
+        pass
+
+    def write(self, data):
+        self.writes += 1
+        chunk = data[:100]      # As paramiko slices what it is given
+        if self.writes > 1:
+            raise OSError('write failed', chunk)
+
+
+def test_mapped_window_write_error(tmp_path):
+    path = tmp_path / 'file'
+    path.write_bytes(os.urandom(100000))
+    transfer = SFTPTransfer([object()])
+    with open(path, 'rb') as f:
+        with pytest.raises(OSError, match='write failed'):      # Not hidden by a BufferError closing the map
+            with mapped(f, 0, 100000, writable=False) as view:
+                transfer._put_window(FailingFile(), (view[i:i + 32768] for i in range(0, 100000, 32768)))
+
+
+class DroppingSFTP:
+    """
+    Serves reads of a remote file until the connection drops after a number of windows
+    """
+
+    def __init__(self, data: bytes, windows: int):
+        self.data = data
+        self.windows = windows
+
+    def open(self, path, mode):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def stat(self, path):
+        return types.SimpleNamespace(st_size=len(self.data), st_mtime=1000, st_atime=1000)
+
+    def readv(self, window):
+        if not self.windows:
+            raise OSError('connection dropped')
+        self.windows -= 1
+        for offset, length in window:
+            yield self.data[offset:offset + length]
+
+
+def test_sftp_journal_saved_during_transfer(tmp_path, monkeypatch):
+    monkeypatch.setattr(sftp, 'JOURNAL_BYTES', 4 * 32768)
+    data = os.urandom(40 * 32768)
+    dest = tmp_path / 'downloaded'
+    transfer = SFTPTransfer([DroppingSFTP(data, 3)], max_requests=2, min_range_size=32768)
+    journals = []
+    save = transfer._save_local_journal
+
+    def save_and_read(file_transfer):
+        save(file_transfer)
+        journals.append(json.loads((tmp_path / ('downloaded' + RESUME_SUFFIX)).read_text())['ranges'])
+        if len(journals) > 2:
+            raise PermissionError('journal not writable')
+
+    monkeypatch.setattr(transfer, '_save_local_journal', save_and_read)
+    with pytest.raises(OSError, match='connection dropped'):    # Not hidden by failing to save the journal
+        transfer.get('remote', dest)
+    assert journals == [[[0, len(data)]], [[4 * 32768, len(data)]], [[6 * 32768, len(data)]]]
+    assert dest.read_bytes()[:6 * 32768] == data[:6 * 32768]
+
+
+def test_sftp_put_get(ssh_client_connected, tmp_path):
+    data = os.urandom(3 * 1024 * 1024 + 7)
+    (tmp_path / 'src').write_bytes(data)
+    progress = []
+    ssh_client_connected.put(tmp_path / 'src', str(tmp_path / 'uploaded'), min_range_size=1024 * 1024,
+                              progress=lambda *args: progress.append(args))
+    ssh_client_connected.get(str(tmp_path / 'uploaded'), tmp_path / 'downloaded', min_range_size=1024 * 1024)
+    assert (tmp_path / 'downloaded').read_bytes() == data
+    assert progress[-1] == (str(tmp_path / 'src'), len(data), len(data))
+    ssh_client_connected.get(str(tmp_path / 'uploaded'), tmp_path / 'unmapped', use_mmap=False, resume=False)
+    assert (tmp_path / 'unmapped').read_bytes() == data
+
+
+def test_sftp_put_get_tree(ssh_client_connected, tmp_path):
+    (tmp_path / 'src' / 'sub').mkdir(parents=True)
+    for i in range(10):
+        (tmp_path / 'src' / 'sub' / f'{i}.txt').write_bytes(os.urandom(i * 1000))
+    ssh_client_connected.put_tree(tmp_path / 'src', str(tmp_path / 'uploaded'))
+    ssh_client_connected.get_tree(str(tmp_path / 'uploaded'), tmp_path / 'downloaded')
+    for i in range(10):
+        assert (tmp_path / 'downloaded' / 'sub' / f'{i}.txt').read_bytes() == \
+               (tmp_path / 'src' / 'sub' / f'{i}.txt').read_bytes()
@@ -0,0 +1,94 @@
+import time
+
+from terminalX.shaping import DEFAULT_QUANTUM, Scheduler, TokenBucket
+
+
+def test_token_bucket():
+    bucket = TokenBucket(1000, burst=2000)
+    now = bucket.updated
+    assert bucket.take(5000, now) == 2000
+    assert bucket.take(1, now) == 0
+    assert bucket.delay(500, now) == 0.5
+    assert bucket.take(5000, now + 0.25) == 250
+    bucket.give_back(100)
+    assert bucket.available(now + 0.25) == 100
+
+
+def test_share_limit():
+    scheduler = Scheduler()
+    share = scheduler.share('user', rate=10000, burst=10000)
+    assert share.grant(65536) == 10000
+    assert share.grant(65536) == 0
+    assert share.delay() > 0.3
+    share.give_back(5000)
+    assert share.grant(65536) == 5000
+
+
+def test_fair_share():
+    scheduler = Scheduler(rate=10 ** 9, burst=DEFAULT_QUANTUM * 100)
+    heavy = scheduler.share('heavy')
+    light = scheduler.share('light')
+    light.grant(DEFAULT_QUANTUM)
+    granted = {'heavy': 0, 'light': 0}
+    for i in range(100):
+        for _ in range(10):     # heavy asks ten times as often
+            granted['heavy'] += heavy.grant(DEFAULT_QUANTUM)
+        granted['light'] += light.grant(DEFAULT_QUANTUM)
+    assert granted['heavy'] <= granted['light'] + 2 * DEFAULT_QUANTUM
+
+
+def test_idle_share_catches_up():
+    scheduler = Scheduler(rate=10 ** 9, burst=10 ** 9)
+    busy = scheduler.share('busy')
+    idle = scheduler.share('idle')
+    for _ in range(10):
+        busy.grant(DEFAULT_QUANTUM)
+    idle.last_active = time.monotonic() - 10
+    assert idle.grant(DEFAULT_QUANTUM) == DEFAULT_QUANTUM
+    assert idle.served >= busy.served
+
+
+def test_priority_weights():
+    scheduler = Scheduler(rate=10 ** 9, burst=10 ** 9)
+    x11 = scheduler.priority_share('x11', 'x11')
+    bulk = scheduler.priority_share('bulk', 'bulk')
+    granted = {'x11': 0, 'bulk': 0}
+    for _ in range(200):
+        granted['bulk'] += bulk.grant(DEFAULT_QUANTUM)
+        granted['x11'] += x11.grant(DEFAULT_QUANTUM)
+    assert 3 <= granted['x11'] / granted['bulk'] <= 5
+
+
+def test_charge_makes_room():
+    scheduler = Scheduler(rate=10000, burst=10000)
+    shell = scheduler.priority_share('shell', 'interactive')
+    tunnel = scheduler.priority_share('tunnel', 'tunnel')
+    shell.charge(10000)
+    assert tunnel.grant(1000) == 0
+    assert tunnel.delay() > 0.3
+    # Only charged, so the shell doesn't hold back the others while they catch up with it
+    assert scheduler._least_virtual_time(time.monotonic()) == 0
+
+
+def test_parent_share():
+    parent = Scheduler(rate=10000, burst=10000).share('proxy')
+    users = Scheduler(parent=parent)
+    alice = users.share('alice')
+    bob = users.share('bob', rate=5000, burst=5000)
+    assert bob.grant(65536) == 5000
+    assert alice.grant(65536) == 5000
+    assert alice.grant(65536) == 0
+    alice.give_back(1000)
+    assert bob.grant(65536) == 0        # Bob's own limit
+    assert alice.grant(65536) == 1000
+
+
+def test_capped_share_doesnt_hold_back_others():
+    scheduler = Scheduler(rate=10 ** 9, burst=10 ** 9)
+    limited = scheduler.share('limited', rate=1000, burst=1000)
+    other = scheduler.share('other')
+    granted = 0
+    for _ in range(100):
+        limited.grant(DEFAULT_QUANTUM)
+        granted += other.grant(DEFAULT_QUANTUM)
+    assert granted == 100 * DEFAULT_QUANTUM
@@ -0,0 +1,324 @@
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from python_socks import ProxyError
+from python_socks.sync import Proxy
+import pytest
+
+from terminalX import socks_proxy
+from terminalX.event_loop import EventLoop
+from terminalX.hashing import hash_password
+from terminalX.socks_proxy import (LoopSOCKSProxy, SOCKSProxy, SOCKS5_ATYP_DOMAINNAME, SOCKS5_ATYP_IPV6, SOCKS5_CMD_BIND,
+                                   SOCKS5_CMD_CONNECT, SOCKS5_CMD_UDP_ASSOCIATE, SOCKS5_TTL_EXPIRED, build_reply,
+                                   encode_address, parse_greeting, parse_request)
+from terminalX.socks_udp import UDP_HEADER, helper_command
+
+
+class SocketTransport:
+    """
+    Stands in for a transport, connecting directly instead of opening direct-tcpip channels
+    """
+
+    def __init__(self):
+        self.requests = []
+        self.listeners = {}
+
+    def open_channel(self, kind, dest_addr, src_addr, timeout=None):
+        self.requests.append(dest_addr)
+        return socket.create_connection(dest_addr, timeout=5)
+
+    def open_session(self, timeout=None):
+        a, b = socket.socketpair()
+        return CommandSocket(a, b)
+
+    def getpeername(self):
+        return '127.0.0.1', 22
+
+    def is_active(self):
+        return True
+
+    def request_port_forward(self, address, port, handler):
+        server = socket.create_server(('127.0.0.1', port))
+        port = server.getsockname()[1]
+        self.listeners[port] = server
+
+        def accept():
+            try:
+                sock, origin = server.accept()
+            except OSError:
+                return
+            handler(sock, origin, ('127.0.0.1', port))
+
+        threading.Thread(target=accept, daemon=True).start()
+        return port
+
+    def global_request(self, kind, data, wait=True):
+        self.listeners.pop(data[1]).close()
+
+
+class CommandSocket(socket.socket):
+    """
+    Stands in for a session channel, running the command locally with its input and output on the other socket
+    """
+
+    def __init__(self, sock, other):
+        super().__init__(fileno=sock.detach())
+        self.other = other
+
+    def exec_command(self, command):
+        command = command.replace('python3', sys.executable, 1)
+        subprocess.Popen(command, shell=True, stdin=self.other, stdout=self.other)
+        self.other.close()
+
+
+@pytest.fixture
+def echo_server():
+    server = socket.create_server(('127.0.0.1', 0))
+
+    def echo(sock):
+        with sock:
+            while data := sock.recv(65536):
+                sock.sendall(data)
+
+    def serve():
+        while True:
+            try:
+                sock, _ = server.accept()
+            except OSError:
+                return
+            threading.Thread(target=echo, args=(sock,), daemon=True).start()
+
+    threading.Thread(target=serve, daemon=True).start()
+    yield server.getsockname()
+    server.close()
+
+
+@pytest.fixture
+def loop():
+    loop = EventLoop()
+    yield loop
+    loop.stop()
+
+
+def test_parse_handshake():
+    assert parse_greeting(b'\x05') is None
+    assert parse_greeting(b'\x05\x02\x00') is None
+    assert parse_greeting(b'\x05\x02\x00\x02\x05\x01') == (5, {0, 2}, 4)
+    request = b'\x05\x01\x00\x03\x0bexample.com\x01\xbb'
+    for i in range(len(request)):
+        assert parse_request(request[:i]) is None
+    parsed, length = parse_request(request + b'GET')
+    assert length == len(request)
+    assert (parsed.command, parsed.address_type, parsed.host, parsed.port) == \
+           (SOCKS5_CMD_CONNECT, SOCKS5_ATYP_DOMAINNAME, 'example.com', 443)
+    parsed, length = parse_request(b'\x05\x01\x00\x04' + socket.inet_pton(socket.AF_INET6, '::1') + b'\x00\x16')
+    assert (parsed.address_type, parsed.host, parsed.port, length) == (SOCKS5_ATYP_IPV6, '::1', 22, 22)
+    assert parse_request(build_reply(0, socket.AF_INET, ('10.0.0.1', 80)))[0].host == '10.0.0.1'
+
+
+def test_loop_socks_proxy(loop, echo_server):
+    transport = SocketTransport()
+    with LoopSOCKSProxy(transport, loop, '127.0.0.1', 0) as proxy:
+        host, port = proxy.get_address()
+        socks = [Proxy.from_url(f'socks5://{host}:{port}').connect(*echo_server, timeout=5) for _ in range(20)]
+        for i, sock in enumerate(socks):
+            sock.sendall(b'hello %d' % i)
+        for i, sock in enumerate(socks):
+            assert sock.recv(100) == b'hello %d' % i
+            sock.close()
+        assert transport.requests == [echo_server] * 20
+
+
+def test_loop_socks_proxy_split_and_pipelined(loop, echo_server):
+    with LoopSOCKSProxy(SocketTransport(), loop, '127.0.0.1', 0) as proxy:
+        with socket.create_connection(proxy.get_address(), timeout=5) as sock:
+            sock.sendall(b'\x05')
+            sock.sendall(b'\x01\x00\x05\x01\x00\x01')
+            sock.sendall(socket.inet_aton(echo_server[0]) + echo_server[1].to_bytes(2, 'big') + b'early data')
+            received = b''
+            while len(received) < 2 + 10 + 10:
+                received += sock.recv(100)
+            assert received[:3] == b'\x05\x00\x05'
+            assert received[3] == 0x00
+            assert received[-10:] == b'early data'
+
+
+def test_loop_socks_proxy_failures(loop):
+    with LoopSOCKSProxy(SocketTransport(), loop, '127.0.0.1', 0) as proxy:
+        with socket.create_connection(proxy.get_address(), timeout=5) as sock:
+            sock.sendall(b'\x05\x01\x02')
+            assert sock.recv(100) == b'\x05\xff'
+            assert sock.recv(100) == b''
+        unused = socket.create_server(('127.0.0.1', 0))
+        address = unused.getsockname()
+        unused.close()
+        with pytest.raises(ProxyError):
+            Proxy.from_url('socks5://{}:{}'.format(*proxy.get_address())).connect(*address, timeout=5)
+
+
+class BlackholeTransport(SocketTransport):
+    def open_channel(self, kind, dest_addr, src_addr, timeout=None):
+        time.sleep(timeout)
+        raise socket.timeout()
+
+
+def test_loop_socks_proxy_open_timeout(loop, monkeypatch):
+    monkeypatch.setattr(socks_proxy, 'HANDSHAKE_TIMEOUT', 0.2)
+    with LoopSOCKSProxy(BlackholeTransport(), loop, '127.0.0.1', 0, open_timeout=0.5) as proxy:
+        with socket.create_connection(proxy.get_address(), timeout=5) as sock:
+            sock.sendall(b'\x05\x01\x00\x05\x01\x00' + encode_address(socket.AF_INET, ('192.0.2.1', 80)))
+            assert sock.recv(2) == b'\x05\x00'
+            reply = sock.recv(10)       # The handshake timeout doesn't cut off the open
+            assert reply[:2] == bytes((5, SOCKS5_TTL_EXPIRED))
+
+
+@pytest.mark.parametrize('remote_dns', [False, True])
+def test_loop_socks_proxy_domain_names(loop, echo_server, remote_dns):
+    transport = SocketTransport()
+    with LoopSOCKSProxy(transport, loop, '127.0.0.1', 0, remote_dns=remote_dns) as proxy:
+        host, port = proxy.get_address()
+        sock = Proxy.from_url(f'socks5://{host}:{port}', rdns=True).connect('localhost', echo_server[1], timeout=5)
+        sock.sendall(b'hello')
+        assert sock.recv(100) == b'hello'
+        sock.close()
+    if remote_dns:
+        assert transport.requests == [('localhost', echo_server[1])]
+    else:
+        assert transport.requests[-1] == ('127.0.0.1', echo_server[1])
+
+
+@pytest.fixture
+def udp_echo_server():
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(('127.0.0.1', 0))
+
+    def echo():
+        while True:
+            try:
+                data, address = server.recvfrom(65536)
+                server.sendto(data.upper(), address)
+            except OSError:
+                return
+
+    threading.Thread(target=echo, daemon=True).start()
+    yield server.getsockname()
+    server.close()
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def socks_request(proxy, command, address):
+    sock = socket.create_connection(proxy.get_address(), timeout=5)
+    sock.sendall(b'\x05\x01\x00\x05' + bytes((command, 0)) + encode_address(socket.AF_INET, address))
+    assert sock.recv(2) == b'\x05\x00'
+    return sock
+
+
+def read_reply(sock):
+    reply = b''
+    while len(reply) < 10:
+        reply += sock.recv(10 - len(reply))
+    parsed, _ = parse_request(reply)
+    assert parsed.command == 0
+    return parsed.host, parsed.port
+
+
+def test_helper_command():
+    command = helper_command()
+    assert command.startswith('python3 -c ')
+    assert 'class Helper' in command
+
+
+def test_loop_socks_proxy_udp_associate(loop, udp_echo_server):
+    with LoopSOCKSProxy(SocketTransport(), loop, '127.0.0.1', 0, udp_helper_command=helper_command()) as proxy:
+        with socks_request(proxy, SOCKS5_CMD_UDP_ASSOCIATE, ('0.0.0.0', 0)) as control:
+            relay_address = read_reply(control)
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as client:
+                client.settimeout(5)
+                header = UDP_HEADER + encode_address(socket.AF_INET, udp_echo_server)
+                for i in range(10):
+                    client.sendto(header + b'datagram %d' % i, relay_address)
+                replies = {client.recvfrom(65536)[0] for _ in range(10)}
+                assert replies == {header + b'DATAGRAM %d' % i for i in range(10)}
+        assert wait_for(lambda: not proxy.udp_channel.associations)
+
+
+def test_loop_socks_proxy_bind(loop):
+    transport = SocketTransport()
+    with LoopSOCKSProxy(transport, loop, '127.0.0.1', 0) as proxy:
+        with socks_request(proxy, SOCKS5_CMD_BIND, ('127.0.0.1', 0)) as sock:
+            host, port = read_reply(sock)
+            assert host == '127.0.0.1'
+            with socket.create_connection((host, port), timeout=5) as incoming:
+                assert read_reply(sock) == incoming.getsockname()
+                incoming.sendall(b'hello')
+                assert sock.recv(100) == b'hello'
+                sock.sendall(b'world')
+                assert incoming.recv(100) == b'world'
+        assert wait_for(lambda: not transport.listeners)
+
+
+USERS = {'alice': {'password_hash': hash_password('secret'), 'max_connections': 2},
+         'bob': {'password_hash': hash_password('hunter2'), 'rate': 200000}}
+
+
+@pytest.fixture(params=['loop', 'threading'])
+def proxy_factory(request):
+    if request.param == 'threading':
+        yield lambda **kwargs: SOCKSProxy(SocketTransport(), '127.0.0.1', 0, **kwargs)
+    else:
+        loop = EventLoop()
+        yield lambda **kwargs: LoopSOCKSProxy(SocketTransport(), loop, '127.0.0.1', 0, **kwargs)
+        loop.stop()
+
+
+def test_socks_proxy_login(proxy_factory, echo_server):
+    with proxy_factory(users=USERS) as proxy:
+        host, port = proxy.get_address()
+        with pytest.raises(ProxyError):
+            Proxy.from_url(f'socks5://{host}:{port}').connect(*echo_server, timeout=5)
+        with pytest.raises(ProxyError):
+            Proxy.from_url(f'socks5://alice:wrong@{host}:{port}').connect(*echo_server, timeout=5)
+        for _ in range(2):          # The second time the cached digest is checked
+            with Proxy.from_url(f'socks5://alice:secret@{host}:{port}').connect(*echo_server, timeout=5) as sock:
+                sock.sendall(b'hello')
+                assert sock.recv(100) == b'hello'
+
+
+def test_socks_proxy_max_connections(proxy_factory, echo_server):
+    with proxy_factory(users=USERS) as proxy:
+        url = 'socks5://alice:secret@{}:{}'.format(*proxy.get_address())
+        socks = [Proxy.from_url(url).connect(*echo_server, timeout=5) for _ in range(2)]
+        with pytest.raises(ProxyError):
+            Proxy.from_url(url).connect(*echo_server, timeout=5)
+        socks.pop().close()
+        users = proxy.users if isinstance(proxy, LoopSOCKSProxy) else proxy.server.users
+        assert wait_for(lambda: users.connections == {'alice': 1})
+        socks.append(Proxy.from_url(url).connect(*echo_server, timeout=5))
+        for sock in socks:
+            sock.close()
+        assert wait_for(lambda: users.connections == {})
+
+
+def test_socks_proxy_rate(proxy_factory, echo_server):
+    with proxy_factory(users=USERS) as proxy:
+        url = 'socks5://bob:hunter2@{}:{}'.format(*proxy.get_address())
+        with Proxy.from_url(url).connect(*echo_server, timeout=5) as sock:
+            data = b'x' * 200000
+            start = time.monotonic()
+            threading.Thread(target=sock.sendall, args=(data,), daemon=True).start()
+            received = 0
+            while received < len(data):
+                received += len(sock.recv(65536))
+            # The burst allowance covers the first second's worth, the rest is counted in both directions
+            assert time.monotonic() - start > 0.5
@@ -1,8 +1,14 @@
+import queue
 import re
+import socket
+import threading
 import time
 
 import pytest
 
+from terminalX.connections import Client
+from terminalX.recording import RecordingReader
+
 
 def test_ssh_connection_full_name(ssh_client, ssh_host, username):
     assert ssh_client.full_name() == f'{ssh_host} ({username})'
@@ -40,6 +46,71 @@ def test_ssh_terminal(ssh_client_connected):
     assert len(line_changes) == 2
 
 
+def test_ssh_terminal_coalesced_callbacks(ssh_client_connected):
+    received = []
+    ssh_client_connected.frame_interval = 0.1
+    ssh_client_connected.invoke_shell(recv_callback=lambda data: received.append((time.monotonic(), data)))
+    time.sleep(0.5)
+    received.clear()
+    ssh_client_connected.send('for i in $(seq 1 2000); do echo line $i; done\n')
+    time.sleep(2)
+    assert any('line 2000' in line for line in ssh_client_connected.display_screen())
+    assert all(later[0] - earlier[0] >= 0.09 for earlier, later in zip(received, received[1:]))
+    assert sum(data.chunks for _, data in received) >= len(received)
+    assert b'line 2000' in b''.join(data for _, data in received)
+
+
+def test_receive_always_reports_end_of_stream():
+    client = Client('localhost', x11=False)
+    client.ssh_shell, server = socket.socketpair()
+    client.shell_active_event.set()
+    client.frame_interval = 1
+    received = []
+    client.receive_callback = received.append
+    server.sendall(b'first')
+
+    def finish():
+        time.sleep(0.1)
+        server.sendall(b'last')
+        server.close()          # Before the frame interval is up, so it arrives while the last output is pending
+
+    threading.Thread(target=finish).start()
+    client.receive_always()
+    assert received == [b'first', b'last', b'']
+
+
+class QueueShell:
+    """
+    A shell which can't be waited on, only read from
+    """
+
+    def __init__(self):
+        self.output = queue.Queue()
+
+    def recv(self, size):
+        return self.output.get()
+
+
+def test_receive_always_unpollable_shell():
+    client = Client('localhost', x11=False)
+    client.ssh_shell = QueueShell()
+    client.shell_active_event.set()
+    client.frame_interval = 1
+    received = []
+    client.receive_callback = received.append
+    receiving = threading.Thread(target=client.receive_always)
+    receiving.start()
+    client.ssh_shell.output.put(b'first')
+    client.ssh_shell.output.put(b'second')
+    deadline = time.monotonic() + 5
+    while b'second' not in received and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert received == [b'first', b'second']      # Not held back waiting for more output
+    client.ssh_shell.output.put(b'')
+    receiving.join(5)
+    assert received == [b'first', b'second', b'']
+
+
 def test_ssh_terminal_file_editing(ssh_client_with_shell):
     screen = ssh_client_with_shell.display_screen()
     assert screen
@@ -94,6 +165,18 @@ def test_ssh_tunnelling(ssh_client_with_src_tunnel_connected, ssh_client_via_tun
     ssh_client_via_tunnel.close()
 
 
+def test_ssh_tunnelling_event_loop(ssh_client_with_src_tunnel_event_loop_connected, ssh_client_via_tunnel):
+    ssh_client_via_tunnel.connect()
+    ssh_client_via_tunnel.invoke_shell()
+    ssh_client_via_tunnel.send('echo Hello World')
+    time.sleep(0.3)
+    ssh_client_via_tunnel.send('\n')
+    time.sleep(0.3)
+    screen = find_terminal_lines(ssh_client_via_tunnel.display_screen())
+    assert screen[-2].startswith('Hello World')
+    ssh_client_via_tunnel.close()
+
+
 def test_socks_proxy(ssh_client_with_socks_tunnel_connected, ssh_client_via_socks):
     ssh_client_via_socks.connect()
     ssh_client_via_socks.invoke_shell()
@@ -144,3 +227,64 @@ def test_ssh_x11(ssh_client_x11):
     ssh_client_x11.send('xterm\n')
     print('xterm window should appear now')
     time.sleep(20)
+
+
+def test_split_multibyte_characters():
+    client = Client('127.0.0.1')
+    client.create_screen()
+    data = 'Hello Wörld €'.encode('utf-8')
+    for i in range(len(data)):
+        client.feed(data[i:i + 1])
+    assert client.display_screen()[0].rstrip() == 'Hello Wörld €'
+
+
+def test_encoding():
+    client = Client('127.0.0.1', encoding='latin-1')
+    client.create_screen()
+    client.feed('Wörld'.encode('latin-1'))
+    assert client.display_screen()[0].rstrip() == 'Wörld'
+
+
+def test_headless_shell(ssh_client_connected):
+    ssh_client_connected.headless = True
+    ssh_client_connected.open_shell()
+    assert ssh_client_connected.screen is None
+    ssh_client_connected.send('echo Hello World; exit\n')
+    output = b''.join(ssh_client_connected.iter_output())
+    assert b'Hello World' in output
+    assert not ssh_client_connected.shell_active
+
+
+def test_headless_shell_file(ssh_client_connected):
+    ssh_client_connected.headless = True
+    ssh_client_connected.open_shell(width=100, height=30)
+    output = ssh_client_connected.shell_file()
+    screen = ssh_client_connected.attach_screen()
+    assert (screen.columns, screen.lines) == (100, 30)
+    ssh_client_connected.send('echo Hello World; exit\n')
+    assert b'Hello World' in output.read()
+    assert 'Hello World' in ssh_client_connected.display_screen_as_text()
+
+
+def test_attach_screen():
+    client = Client('127.0.0.1', headless=True)
+    client.feed(b'Before')
+    assert client.display_screen() == []
+    client.attach_screen()
+    client.feed(b'After')
+    assert client.display_screen()[0].rstrip() == 'After'
+    client.detach_screen()
+    client.feed(b'Detached')
+    assert client.display_screen() == []
+
+
+def test_record_session(ssh_client_connected, tmp_path):
+    ssh_client_connected.record = tmp_path / 'session.cast'
+    ssh_client_connected.record_input = True
+    ssh_client_connected.open_shell()
+    ssh_client_connected.send('echo Hello World; exit\n')
+    output = b''.join(ssh_client_connected.iter_output())
+    with RecordingReader(tmp_path / 'session.cast') as reader:
+        events = list(reader)
+    assert b''.join(event.data for event in events if event.kind == 'o') == output
+    assert [event.data for event in events if event.kind == 'i'] == [b'echo Hello World; exit\n']
@@ -0,0 +1,209 @@
+import socket
+import struct
+import threading
+import time
+
+import pytest
+
+from terminalX import x11
+from terminalX.event_loop import EventLoop
+from terminalX.x11 import MIT_MAGIC_COOKIE, DisplayPool, X11Session, parse_display, replace_cookie, xauth_cookie, \
+    x11_loop
+
+
+@pytest.fixture(autouse=True)
+def clear_display_cache():
+    parse_display.cache_clear()
+    x11._display_pools.clear()
+    yield
+    parse_display.cache_clear()
+    x11._display_pools.clear()
+
+
+@pytest.fixture
+def accepted():
+    return []
+
+
+@pytest.fixture
+def x11_display(tmp_path, monkeypatch, accepted):
+    """
+    Stands in for a local X server, echoing whatever it receives. DISPLAY is the path of its socket, as XQuartz sets.
+    """
+    path = str(tmp_path / 'X:0')
+    server = socket.socket(socket.AF_UNIX)
+    server.bind(path)
+    server.listen()
+
+    def echo(sock):
+        with sock:
+            while data := sock.recv(65536):
+                sock.sendall(data)
+
+    def serve():
+        while True:
+            try:
+                sock, _ = server.accept()
+            except OSError:
+                return
+            accepted.append(sock)
+            threading.Thread(target=echo, args=(sock,), daemon=True).start()
+
+    threading.Thread(target=serve, daemon=True).start()
+    monkeypatch.setenv('DISPLAY', path)
+    yield path
+    server.close()
+
+
+@pytest.fixture
+def loop():
+    loop = EventLoop()
+    loop.start()
+    yield loop
+    loop.stop()
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_x11_loop_shared():
+    assert x11_loop() is x11_loop()
+    assert x11_loop().running
+
+
+def test_x11_session(loop, x11_display):
+    session = X11Session(loop)
+    remotes = []
+    for i in range(10):
+        remote, channel = socket.socketpair()
+        session.handler(channel, ('127.0.0.1', 6010 + i))
+        remotes.append(remote)
+    data = bytes(range(256)) * 4096
+    for remote in remotes:
+        threading.Thread(target=remote.sendall, args=(data,), daemon=True).start()
+    for remote in remotes:
+        received = bytearray()
+        while len(received) < len(data):
+            received += remote.recv(65536)
+        assert received == data
+    assert wait_for(lambda: len(session.relays) == 10)
+    session.close()
+    for remote in remotes:
+        assert remote.recv(100) == b''
+        remote.close()
+    assert wait_for(lambda: not session.relays)
+
+
+def test_x11_session_no_display(loop, tmp_path, monkeypatch):
+    monkeypatch.setenv('DISPLAY', str(tmp_path / 'missing:0'))
+    session = X11Session(loop)
+    remote, channel = socket.socketpair()
+    session.handler(channel, ('127.0.0.1', 6010))
+    remote.settimeout(5)
+    assert remote.recv(100) == b''
+    assert not session.relays
+
+
+def setup_request(name: bytes, data: bytes) -> bytes:
+    def pad(b):
+        return b + bytes(-len(b) % 4)
+    return b'l\x00' + struct.pack('<HHHHH', 11, 0, len(name), len(data), 0) + pad(name) + pad(data)
+
+
+@pytest.fixture
+def xauthority(tmp_path, monkeypatch):
+    path = tmp_path / '.Xauthority'
+    entries = [(256, b'otherhost', b'0', b'a' * 16), (256, socket.gethostname().encode(), b'0', b'b' * 16),
+               (65535, b'', b'1', b'c' * 16), (0, bytes([127, 0, 0, 1]), b'10', b'd' * 16)]
+    with path.open('wb') as f:
+        for family, address, number, cookie in entries:
+            f.write(struct.pack('>H', family))
+            for field in (address, number, MIT_MAGIC_COOKIE.encode(), cookie):
+                f.write(struct.pack('>H', len(field)) + field)
+    monkeypatch.setenv('XAUTHORITY', str(path))
+    return path
+
+
+def test_parse_display():
+    number, addresses = parse_display(':1')
+    assert number == 1
+    assert addresses[-1] == (socket.AF_UNIX, '/tmp/.X11-unix/X1')
+    assert addresses[0] == (socket.AF_UNIX, '\0/tmp/.X11-unix/X1')
+    assert parse_display('unix:2.0')[1][-1] == (socket.AF_UNIX, '/tmp/.X11-unix/X2')
+    xquartz = '/private/tmp/com.apple.launchd.abc/org.xquartz:0'
+    assert parse_display(xquartz) == (0, ((socket.AF_UNIX, xquartz),))
+    number, addresses = parse_display('localhost:10.0')
+    assert number == 10
+    assert all(address[1] == 6010 for _, address in addresses)
+    assert parse_display('[::1]:3')[1] == ((socket.AF_INET6, ('::1', 6003, 0, 0)),)
+    with pytest.raises(ValueError):
+        parse_display('nodisplay')
+
+
+def test_xauth_cookie(xauthority):
+    assert xauth_cookie(':0') == (MIT_MAGIC_COOKIE, b'b' * 16)
+    assert xauth_cookie(':1') == (MIT_MAGIC_COOKIE, b'c' * 16)
+    assert xauth_cookie('localhost:10') == (MIT_MAGIC_COOKIE, b'd' * 16)
+    assert xauth_cookie(':2') is None
+
+
+def test_replace_cookie():
+    setup = setup_request(MIT_MAGIC_COOKIE.encode(), b'fake' * 4)
+    assert replace_cookie(setup[:20], b'fake' * 4, None) is None
+    replaced, length = replace_cookie(setup + b'more', b'fake' * 4, (MIT_MAGIC_COOKIE, b'real' * 4))
+    assert replaced == setup_request(MIT_MAGIC_COOKIE.encode(), b'real' * 4)
+    assert length == len(setup)
+    assert replace_cookie(setup, b'fake' * 4, None)[0] == setup_request(b'', b'')
+    with pytest.raises(ValueError):
+        replace_cookie(setup, b'other' * 4, None)
+
+
+def test_x11_session_cookie(loop, x11_display, xauthority):
+    session = X11Session(loop, cookie=b'fake' * 4)
+    remote, channel = socket.socketpair()
+    session.handler(channel, ('127.0.0.1', 6010))
+    remote.sendall(setup_request(MIT_MAGIC_COOKIE.encode(), b'fake' * 4) + b'request')
+    expected = setup_request(MIT_MAGIC_COOKIE.encode(), b'b' * 16) + b'request'
+    received = bytearray()
+    remote.settimeout(5)
+    while len(received) < len(expected):
+        received += remote.recv(65536)
+    assert received == expected
+    rejected, channel = socket.socketpair()
+    session.handler(channel, ('127.0.0.1', 6011))
+    rejected.sendall(setup_request(MIT_MAGIC_COOKIE.encode(), b'other' * 4))
+    rejected.settimeout(5)
+    assert rejected.recv(100) == b''
+    session.close()
+
+
+def test_display_pool(loop, x11_display, accepted):
+    received = []
+    pool = x11._display_pools[x11_display] = DisplayPool(loop, x11_display, max_age=0.2)
+    session = X11Session(loop)
+    assert wait_for(lambda: len(pool.idle) == 2)        # Filled when the session is added
+    idle = set(pool.idle)
+    loop.call_soon(pool.get, lambda sock, error: received.append(sock))
+    assert wait_for(lambda: received)
+    assert received[0] in idle          # Handed out straight away
+    assert wait_for(lambda: len(pool.idle) == 2)
+    assert wait_for(lambda: not pool.idle)      # Dropped after max_age without being replaced
+    opened = len(accepted)
+    time.sleep(0.5)
+    assert len(accepted) == opened
+    loop.call_soon(pool.get, lambda sock, error: received.append(sock))
+    assert wait_for(lambda: len(received) == 2 and len(pool.idle) == 2)
+    session.close()
+    assert wait_for(lambda: pool.closed and not pool.idle)
+    assert x11_display not in x11._display_pools
+    opened = len(accepted)
+    time.sleep(0.5)
+    assert len(accepted) == opened
+    for sock in received:
+        sock.close()